@@ -0,0 +1,111 @@
+"""
+Асинхронные варианты нагруженных вводом-выводом endpoint для режима ASGI
+(foodgram.asgi, GUNICORN_MODE=asgi). Подключаются в api.urls перед
+маршрутами router, если включен settings.ASYNC_VIEWS.
+Тело запроса читается и ответ отдается в цикле событий, медленный
+клиент не занимает поток. Синхронная работа DRF view (ORM, Pillow,
+хранилище) выполняется в пуле потоков через sync_to_async
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers,)
+from rest_framework.renderers import JSONRenderer
+
+from asgiref.sync import sync_to_async
+from foodgram.metrics import render
+
+from .mixins import catalog_cache_key, catalog_etag
+from .views import IngredientViewSet, RecipeViewSet, TagViewSet
+from recipes.versions import acatalog_version
+
+
+def render_response(view, request, *args, **kwargs):
+    """
+    Выполняет view и рендер ответа. Потоковый ответ (список покупок)
+    возвращается как есть: его части читаются в потоке запроса
+    порциями при отправке (foodgram.handlers.ASGIHandler)
+    """
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+        render(response)
+    return response
+
+
+def sync_view(view):
+    """
+    async view, выполняющий синхронный view и рендер ответа в потоке
+    (thread_sensitive: соединения с базой данных закрываются
+    по окончании запроса как у синхронных views)
+    """
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        return await sync_to_async(render_response)(
+            view, request, *args, **kwargs
+        )
+    return async_view
+
+
+def catalog_view(view):
+    """
+    Каталог: If-None-Match и тело из кэша проверяются в цикле событий
+    (как CatalogCacheMixin, только для JSON ответа), без потока
+    и без обращения к базе данных. Остальное - синхронный view в потоке
+    """
+    threaded = sync_view(view)
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        if (
+            request.method == 'GET'
+            and request.GET.get('format', 'json') == 'json'
+            and 'text/html' not in request.headers.get('Accept', '')
+        ):
+            etag = catalog_etag(
+                await acatalog_version(), 'json', request.get_full_path()
+            )
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                data = await cache.aget(catalog_cache_key(etag))
+                if data is not None:
+                    response = HttpResponse(
+                        JSONRenderer().render(data),
+                        content_type='application/json',
+                    )
+            if response is not None:
+                response['ETag'] = etag
+                patch_vary_headers(response, ('Accept',))
+                patch_cache_control(
+                    response,
+                    public=True,
+                    max_age=settings.CATALOG_CACHE_MAX_AGE,
+                )
+                return response
+        return await threaded(request, *args, **kwargs)
+    return async_view
+
+
+download_shopping_cart = sync_view(RecipeViewSet.as_view(
+    {'get': 'download_shopping_cart'}, basename='recipes', detail=False
+))
+upload_image = sync_view(RecipeViewSet.as_view(
+    {'post': 'upload_image'},
+    basename='recipes',
+    detail=False,
+    **RecipeViewSet.upload_image.kwargs,
+))
+tag_list = catalog_view(TagViewSet.as_view(
+    {'get': 'list'}, basename='tags', detail=False
+))
+tag_detail = catalog_view(TagViewSet.as_view(
+    {'get': 'retrieve'}, basename='tags', detail=True
+))
+ingredient_list = catalog_view(IngredientViewSet.as_view(
+    {'get': 'list'}, basename='ingredients', detail=False
+))
+ingredient_detail = catalog_view(IngredientViewSet.as_view(
+    {'get': 'retrieve'}, basename='ingredients', detail=True
+))
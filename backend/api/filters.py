@@ -1,23 +1,24 @@
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
 
-from recipes.models import Ingredient, Recipe
-
-
-class IngredientFilter(FilterSet):
-
-    name = filters.CharFilter(field_name='name', lookup_expr='icontains')
-
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
+from recipes.models import Recipe, Tag
 
 
 class RecipeFilters(FilterSet):
-    tags = filters.AllValuesMultipleFilter(
-        field_name='tags__slug',
+    """
+    Фильтры ленты рецептов. Теги, избранное и список покупок
+    проверяются подзапросами EXISTS по таблицам связей: строки
+    рецептов не размножаются JOIN-ами, DISTINCT не нужен.
+    Слаги тегов переводятся в id одним запросом при проверке
+    параметров, значения author и тегов не требуют запросов
+    за списком допустимых вариантов
+    """
+    tags = filters.ModelMultipleChoiceFilter(
+        queryset=Tag.objects.all(),
+        to_field_name='slug',
         method='filter_tags'
     )
-    author = filters.AllValuesFilter(
+    author = filters.NumberFilter(
         method='filter_author'
     )
     is_favorited = filters.BooleanFilter(
@@ -31,23 +32,41 @@ class RecipeFilters(FilterSet):
         model = Recipe
         fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
 
+    @staticmethod
+    def related_exists(through, **lookups):
+        return Exists(through.objects.filter(
+            recipe_id=OuterRef('pk'), **lookups
+        ))
+
     def filter_tags(self, queryset, name, value):
         if value:
-            return queryset.filter(
-                tags__slug__in=value).distinct()
+            return queryset.filter(self.related_exists(
+                Recipe.tags.through,
+                tag_id__in=[tag.id for tag in value],
+            ))
         return queryset
 
     def filter_author(self, queryset, name, value):
         if value:
-            return queryset.filter(author=value)
+            return queryset.filter(author_id=value)
         return queryset
 
     def filter_is_favorited(self, queryset, name, value):
-        if value:
-            return queryset.filter(favorite=self.request.user.id)
-        return queryset
+        return self.filter_user_relation(
+            queryset, Recipe.favorite.through, value
+        )
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
-        if value:
-            return queryset.filter(cart=self.request.user.id)
-        return queryset
+        return self.filter_user_relation(
+            queryset, Recipe.cart.through, value
+        )
+
+    def filter_user_relation(self, queryset, through, value):
+        if not value:
+            return queryset
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.none()
+        return queryset.filter(
+            self.related_exists(through, user_id=user.id)
+        )
@@ -0,0 +1,76 @@
+import random
+from statistics import quantiles
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from api.views import IngredientViewSet
+from recipes import ingredient_index
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = (
+        'Задержка поиска ингредиентов для автодополнения: p50, p95, p99 '
+        'и максимум для индекса в памяти, view /api/ingredients/?name= '
+        'и запроса name__icontains к базе данных. Запросы - начала '
+        'названий и слов случайных ингредиентов каталога'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=500,
+            help='количество поисковых запросов',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='seed выбора запросов, для повторяемости',
+        )
+
+    def handle(self, *args, **options):
+        names = list(Ingredient.objects.values_list('name', flat=True))
+        if not names:
+            raise CommandError('Каталог ингредиентов пуст')
+        rnd = random.Random(options['seed'])
+        queries = []
+        for _ in range(options['queries']):
+            word = rnd.choice(rnd.choice(names).split())
+            queries.append(word[:rnd.randint(1, min(len(word), 4))])
+        index = ingredient_index.get_index()
+        view = IngredientViewSet.as_view({'get': 'list'})
+        factory = RequestFactory()
+        limit = settings.INGREDIENT_SEARCH_LIMIT
+        self.stdout.write(
+            f'ingredients={len(names)} queries={len(queries)}'
+        )
+        self.stdout.write(
+            f'{"":<10}{"p50, ms":>10}{"p95, ms":>10}'
+            f'{"p99, ms":>10}{"max, ms":>10}'
+        )
+        for label, search in (
+            ('index', lambda value: index.search(value, limit)),
+            ('view', lambda value: view(
+                factory.get('/api/ingredients/', {'name': value})
+            ).render()),
+            ('database', lambda value: list(
+                Ingredient.objects.filter(
+                    name__icontains=value
+                ).values('id', 'name', 'measurement_unit')[:limit]
+            )),
+        ):
+            timings = []
+            for value in queries:
+                started = perf_counter()
+                search(value)
+                timings.append((perf_counter() - started) * 1000)
+            cuts = quantiles(timings, n=100, method='inclusive')
+            self.stdout.write(
+                f'{label:<10}{cuts[49]:>10.3f}{cuts[94]:>10.3f}'
+                f'{cuts[98]:>10.3f}{max(timings):>10.3f}'
+            )
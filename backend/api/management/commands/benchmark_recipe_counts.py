@@ -0,0 +1,167 @@
+from statistics import median
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.paginators import CountStrategyPaginator
+from recipes.models import Recipe, Tag
+from recipes.versions import bump_version, rows_version
+
+User = get_user_model()
+
+BENCHMARK_USERNAME = 'benchmark'
+
+
+class Command(BaseCommand):
+    help = (
+        'Подсчет количества рецептов для постраничной пагинации: '
+        'точный COUNT(*), оценка планировщика EXPLAIN и '
+        'CountStrategyPaginator.count при промахе и попадании в кэш. '
+        'С --create добавляет синтетические рецепты автора benchmark '
+        'до --rows (по умолчанию 1 000 000), --cleanup их удаляет'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=1000000,
+            help='количество синтетических рецептов',
+        )
+        parser.add_argument(
+            '--create',
+            action='store_true',
+            help='создать недостающие синтетические рецепты',
+        )
+        parser.add_argument(
+            '--cleanup',
+            action='store_true',
+            help='удалить синтетические рецепты и выйти',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='записей в одном INSERT',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='повторов каждого замера, в таблице медиана',
+        )
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            self.cleanup()
+            return
+        tag = Tag.objects.order_by('id').first()
+        if tag is None:
+            raise CommandError('Нужен хотя бы один тег')
+        author = self.get_author()
+        if options['create']:
+            self.create(author, tag, options['rows'], options['batch_size'])
+        version = rows_version(Recipe._meta.label_lower)
+        self.stdout.write(f'recipes: {Recipe.objects.count()}')
+        self.stdout.write(
+            f'{"":<8}{"count":>10}{"estimate":>10}{"COUNT, ms":>11}'
+            f'{"EXPLAIN, ms":>13}{"miss, ms":>10}{"hit, ms":>9}'
+        )
+        for label, queryset in (
+            ('all', Recipe.objects.all()),
+            ('tag', Recipe.objects.filter(tags=tag)),
+            ('author', Recipe.objects.filter(author=author)),
+        ):
+            queryset = queryset.values('pk')
+            sql, params = queryset.query.sql_with_params()
+            count_timings, explain_timings = [], []
+            miss_timings, hit_timings = [], []
+            estimate = None
+            for _ in range(options['repeat']):
+                started = perf_counter()
+                count = queryset.count()
+                count_timings.append(perf_counter() - started)
+                started = perf_counter()
+                estimate = CountStrategyPaginator.estimated_count(
+                    queryset, sql, params
+                )
+                explain_timings.append(perf_counter() - started)
+                bump_version(version)
+                for timings in (miss_timings, hit_timings):
+                    paginator = CountStrategyPaginator(
+                        queryset, 6, versions=(version,)
+                    )
+                    started = perf_counter()
+                    paginator.count
+                    timings.append(perf_counter() - started)
+            self.stdout.write(
+                f'{label:<8}{count:>10}{str(estimate):>10}'
+                f'{median(count_timings) * 1000:>11.2f}'
+                f'{median(explain_timings) * 1000:>13.2f}'
+                f'{median(miss_timings) * 1000:>10.2f}'
+                f'{median(hit_timings) * 1000:>9.2f}'
+            )
+
+    def get_author(self):
+        author, _ = User.objects.get_or_create(
+            username=BENCHMARK_USERNAME,
+            defaults={
+                'email': 'benchmark@example.com',
+                'first_name': BENCHMARK_USERNAME,
+                'last_name': BENCHMARK_USERNAME,
+            },
+        )
+        return author
+
+    def create(self, author, tag, rows, batch_size):
+        """
+        bulk_create без сигналов: счетчики, изображения и ленты
+        синтетических рецептов не поддерживаются, каждый третий
+        рецепт получает тег
+        """
+        existing = Recipe.objects.filter(author=author).count()
+        through = Recipe.tags.through
+        for start in range(existing, rows, batch_size):
+            with transaction.atomic():
+                recipes = Recipe.objects.bulk_create(
+                    Recipe(
+                        author=author,
+                        name=f'benchmark recipe {number}',
+                        text='benchmark',
+                        cooking_time=10,
+                        image='recipe_images/benchmark.png',
+                    )
+                    for number in range(start, min(start + batch_size, rows))
+                )
+                through.objects.bulk_create(
+                    through(recipe_id=recipe.pk, tag_id=tag.pk)
+                    for recipe in recipes[::3]
+                )
+            self.stdout.write(f'создано рецептов: {start + len(recipes)}')
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE recipes_recipe')
+                cursor.execute('ANALYZE recipes_recipe_tags')
+        bump_version(rows_version(Recipe._meta.label_lower))
+
+    def cleanup(self):
+        """
+        удаление без сигналов и каскада Collector: синтетические
+        рецепты не имеют ингредиентов, изображений и связей,
+        кроме тегов
+        """
+        author = User.objects.filter(username=BENCHMARK_USERNAME).first()
+        if author is None:
+            return
+        with transaction.atomic():
+            through = Recipe.tags.through.objects.filter(
+                recipe__author=author
+            )
+            through._raw_delete(through.db)
+            recipes = Recipe.objects.filter(author=author)
+            deleted = recipes._raw_delete(recipes.db)
+            author.delete()
+        bump_version(rows_version(Recipe._meta.label_lower))
+        self.stdout.write(f'удалено рецептов: {deleted}')
@@ -0,0 +1,134 @@
+from itertools import product
+from statistics import median
+from time import perf_counter
+from types import SimpleNamespace
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.http import QueryDict
+
+from api.filters import RecipeFilters
+from recipes.models import Recipe, Tag
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Матрица комбинаций фильтров ленты рецептов '
+        '(теги × автор × избранное × список покупок): '
+        'время выборки страницы и COUNT(*), с --explain план запроса'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            help='id пользователя, по умолчанию с наибольшим избранным',
+        )
+        parser.add_argument(
+            '--author',
+            type=int,
+            help='id автора, по умолчанию с наибольшим числом рецептов',
+        )
+        parser.add_argument(
+            '--tags',
+            nargs='+',
+            help='слаги тегов, по умолчанию два первых',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=6,
+            help='размер страницы',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='повторов каждого запроса, в таблице медиана',
+        )
+        parser.add_argument(
+            '--explain',
+            action='store_true',
+            help='вывести план запроса страницы',
+        )
+        parser.add_argument(
+            '--analyze',
+            action='store_true',
+            help='EXPLAIN ANALYZE (только PostgreSQL)',
+        )
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        author = options['author'] or Recipe.objects.values(
+            'author'
+        ).annotate(total=Count('id')).order_by('-total').values_list(
+            'author', flat=True
+        ).first()
+        tags = options['tags'] or list(
+            Tag.objects.order_by('id').values_list('slug', flat=True)[:2]
+        )
+        request = SimpleNamespace(user=user)
+        self.stdout.write(
+            f'user={user.pk} author={author} tags={",".join(tags)}'
+        )
+        self.stdout.write(
+            f'{"tags":<8}{"author":<8}{"fav":<5}{"cart":<6}'
+            f'{"count":>8}{"page, ms":>10}{"count, ms":>11}'
+        )
+        for tag_count, with_author, favorited, in_cart in product(
+            range(min(len(tags), 2) + 1), (False, True), (0, 1), (0, 1)
+        ):
+            data = QueryDict(mutable=True)
+            data.setlist('tags', tags[:tag_count])
+            if with_author and author:
+                data['author'] = author
+            data['is_favorited'] = favorited
+            data['is_in_shopping_cart'] = in_cart
+            filterset = RecipeFilters(
+                data,
+                queryset=Recipe.objects.for_read(user).order_by(
+                    '-pub_date', '-id'
+                ),
+                request=request,
+            )
+            if not filterset.is_valid():
+                raise CommandError(filterset.errors)
+            queryset = filterset.qs
+            page_timings, count_timings = [], []
+            for _ in range(options['repeat']):
+                started = perf_counter()
+                list(queryset.all()[:options['limit']])
+                page_timings.append(perf_counter() - started)
+                started = perf_counter()
+                count = queryset.values('pk').count()
+                count_timings.append(perf_counter() - started)
+            self.stdout.write(
+                f'{tag_count:<8}{"+" if with_author else "-":<8}'
+                f'{favorited:<5}{in_cart:<6}{count:>8}'
+                f'{median(page_timings) * 1000:>10.2f}'
+                f'{median(count_timings) * 1000:>11.2f}'
+            )
+            if options['explain']:
+                self.stdout.write(self.explain(
+                    queryset[:options['limit']], options['analyze']
+                ))
+
+    def get_user(self, pk):
+        if pk:
+            user = User.objects.filter(pk=pk).first()
+        else:
+            user = User.objects.annotate(
+                total=Count('favorites')
+            ).order_by('-total').first()
+        if user is None:
+            raise CommandError('Пользователь не найден')
+        return user
+
+    def explain(self, queryset, analyze):
+        if connection.vendor == 'postgresql':
+            return queryset.explain(analyze=analyze, buffers=analyze)
+        return queryset.explain()
@@ -0,0 +1,298 @@
+import json
+import random
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+from statistics import quantiles
+from time import monotonic, perf_counter, sleep
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from rest_framework.authtoken.models import Token
+
+import requests
+from PIL import Image
+
+from recipes.models import Ingredient
+
+User = get_user_model()
+
+OK_STATUSES = (200, 201, 204, 304)
+
+
+def make_image():
+    """
+    PNG из шума: не сжимается, размер как у фотографии
+    """
+    size = (640, 480)
+    buffer = BytesIO()
+    Image.frombytes(
+        'RGB', size, random.randbytes(size[0] * size[1] * 3)
+    ).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class SlowBody:
+    """
+    тело запроса, отдаваемое со скоростью rate байт в сек.,
+    длина известна заранее (Content-Length, без chunked)
+    """
+
+    def __init__(self, data, rate):
+        self.data = BytesIO(data)
+        self.size = len(data)
+        self.rate = rate
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        chunk = self.data.read(
+            self.rate if size is None or size < 0 else min(size, self.rate)
+        )
+        sleep(len(chunk) / self.rate)
+        return chunk
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузка на запущенный backend одинаковой смесью запросов: '
+        'каталог, лента рецептов, список покупок, загрузка изображений, '
+        'плюс медленные клиенты, загружающие изображения. '
+        'Для сравнения режимов GUNICORN_MODE (sync, gthread, asgi) '
+        'запустите с --label и --output для каждого режима, '
+        'затем --compare с тем же файлом'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            default='http://127.0.0.1:8000',
+            help='адрес backend',
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            help='id пользователя, по умолчанию с наибольшим списком покупок',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=20,
+            help='количество одновременных клиентов',
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=30,
+            help='длительность, сек.',
+        )
+        parser.add_argument(
+            '--slow-clients',
+            type=int,
+            default=0,
+            help='клиентов, загружающих изображение медленно',
+        )
+        parser.add_argument(
+            '--slow-rate',
+            type=int,
+            default=16 * 1024,
+            help='скорость медленных клиентов, байт в сек.',
+        )
+        parser.add_argument(
+            '--label',
+            default='',
+            help='название запуска, например режим GUNICORN_MODE',
+        )
+        parser.add_argument(
+            '--output',
+            help='файл, в который дописывается результат (JSON строка)',
+        )
+        parser.add_argument(
+            '--compare',
+            help='вывести сравнение запусков из файла --output',
+        )
+
+    def handle(self, *args, **options):
+        if options['compare']:
+            return self.compare(options['compare'])
+        user = self.get_user(options['user'])
+        self.base_url = options['url'].rstrip('/')
+        token, _ = Token.objects.get_or_create(user=user)
+        self.headers = {'Authorization': f'Token {token.key}'}
+        self.image = make_image()
+        self.prefixes = [
+            name[:3] for name in Ingredient.objects.order_by('?').values_list(
+                'name', flat=True
+            )[:50]
+        ] or ['а']
+        self.mix = (
+            ('ingredients', 30, self.search_ingredients),
+            ('tags', 10, partial(self.request, 'GET', '/api/tags/')),
+            ('recipes', 30, partial(
+                self.request, 'GET', '/api/recipes/?limit=6'
+            )),
+            ('download', 20, partial(
+                self.request, 'GET', '/api/recipes/download_shopping_cart/',
+                auth=True,
+            )),
+            ('upload', 10, self.upload),
+        )
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.deadline = monotonic() + options['duration']
+        started = monotonic()
+        clients = options['concurrency'] + options['slow_clients']
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            for _ in range(options['slow_clients']):
+                executor.submit(self.slow_client, options['slow_rate'])
+            for _ in range(options['concurrency']):
+                executor.submit(self.client)
+        elapsed = monotonic() - started
+        result = {
+            'label': options['label'],
+            'concurrency': options['concurrency'],
+            'slow_clients': options['slow_clients'],
+            'elapsed': elapsed,
+            'endpoints': {
+                name: self.summary(name, elapsed)
+                for name in sorted(self.timings.keys() | self.errors.keys())
+            },
+        }
+        self.print_result(result)
+        if options['output']:
+            with open(options['output'], 'a', encoding='utf-8') as file:
+                file.write(json.dumps(result) + '\n')
+
+    def get_user(self, pk):
+        if pk:
+            user = User.objects.filter(pk=pk).first()
+        else:
+            user = User.objects.annotate(
+                total=Count('shopping_cart_ingredients')
+            ).order_by('-total').first()
+        if user is None:
+            raise CommandError('Пользователь не найден')
+        return user
+
+    @property
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def request(self, method, path, auth=False, headers=None, **kwargs):
+        return self.session.request(
+            method,
+            self.base_url + path,
+            headers={**(self.headers if auth else {}), **(headers or {})},
+            timeout=60,
+            **kwargs,
+        )
+
+    def search_ingredients(self):
+        return self.request(
+            'GET', '/api/ingredients/',
+            params={'name': random.choice(self.prefixes)},
+        )
+
+    def upload(self, data=None):
+        return self.request(
+            'POST', '/api/recipes/images/',
+            auth=True,
+            data=self.image if data is None else data,
+            headers={'Content-Type': 'image/png'},
+        )
+
+    def client(self):
+        names = [name for name, _, _ in self.mix]
+        weights = [weight for _, weight, _ in self.mix]
+        requests_by_name = {name: send for name, _, send in self.mix}
+        while monotonic() < self.deadline:
+            name = random.choices(names, weights)[0]
+            self.measure(name, requests_by_name[name])
+
+    def slow_client(self, rate):
+        while monotonic() < self.deadline:
+            self.measure(
+                'slow_upload', lambda: self.upload(SlowBody(self.image, rate))
+            )
+
+    def measure(self, name, send):
+        started = perf_counter()
+        try:
+            ok = send().status_code in OK_STATUSES
+        except requests.RequestException:
+            ok = False
+        elapsed = perf_counter() - started
+        with self.lock:
+            if ok:
+                self.timings[name].append(elapsed)
+            else:
+                self.errors[name] += 1
+
+    def summary(self, name, elapsed):
+        timings = sorted(self.timings[name])
+        if len(timings) > 1:
+            cuts = quantiles(timings, n=100)
+            p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+        else:
+            p50 = p95 = p99 = timings[0] if timings else 0
+        return {
+            'requests': len(timings),
+            'errors': self.errors[name],
+            'rps': len(timings) / elapsed,
+            'p50': p50 * 1000,
+            'p95': p95 * 1000,
+            'p99': p99 * 1000,
+        }
+
+    def print_result(self, result):
+        self.stdout.write(
+            f'{result["label"] or "-"}: клиентов {result["concurrency"]}, '
+            f'медленных {result["slow_clients"]}, '
+            f'{result["elapsed"]:.1f} сек.'
+        )
+        self.stdout.write(
+            f'{"endpoint":<14}{"requests":>9}{"errors":>8}{"rps":>9}'
+            f'{"p50, ms":>10}{"p95, ms":>10}{"p99, ms":>10}'
+        )
+        for name, stats in result['endpoints'].items():
+            self.stdout.write(
+                f'{name:<14}{stats["requests"]:>9}{stats["errors"]:>8}'
+                f'{stats["rps"]:>9.1f}{stats["p50"]:>10.1f}'
+                f'{stats["p95"]:>10.1f}{stats["p99"]:>10.1f}'
+            )
+
+    def compare(self, path):
+        """
+        rps и p95 каждого endpoint по запускам из файла
+        """
+        try:
+            with open(path, encoding='utf-8') as file:
+                results = [json.loads(line) for line in file if line.strip()]
+        except OSError as error:
+            raise CommandError(f'Файл {path} не прочитан: {error}')
+        names = sorted({
+            name for result in results for name in result['endpoints']
+        })
+        self.stdout.write(f'{"endpoint":<14}' + ''.join(
+            f'{result["label"] or "-":>22}' for result in results
+        ))
+        self.stdout.write(f'{"":<14}' + f'{"rps / p95, ms":>22}' * len(
+            results
+        ))
+        for name in names:
+            row = f'{name:<14}'
+            for result in results:
+                stats = result['endpoints'].get(name)
+                row += (
+                    f'{stats["rps"]:>12.1f} / {stats["p95"]:<7.1f}'
+                    if stats else f'{"-":>22}'
+                )
+            self.stdout.write(row)
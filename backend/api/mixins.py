@@ -0,0 +1,333 @@
+import random
+import time
+from copy import deepcopy
+from hashlib import md5
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                quote_etag,)
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+from rest_framework.status import HTTP_401_UNAUTHORIZED
+
+from foodgram.db.router import is_pinned, primary_reads, use_replicas
+
+from .serializers import BulkIdsSerializer
+from recipes.versions import RECIPE_CONTENT, catalog_version, get_version
+
+User = get_user_model()
+
+
+def catalog_etag(version, renderer_format, path):
+    return quote_etag(md5(
+        f'{version}:{renderer_format}:{path}'.encode()
+    ).hexdigest())
+
+
+def catalog_cache_key(etag):
+    return f'catalog_response:{etag}'
+
+
+class ReplicaReadMixin:
+    """
+    Чтение безопасными методами - с реплик (foodgram.db.router),
+    кроме клиентов, недавно изменявших данные
+    (ReadYourWritesMiddleware). Аутентификация выполняется до
+    переключения, по основной базе данных: только что выданный
+    токен может еще не дойти до реплики
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        with primary_reads():
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and not is_pinned(request):
+            use_replicas()
+
+
+class CatalogCacheMixin:
+    """
+    Кэширование ответов каталога (теги, ингредиенты) по версии каталога.
+    ETag строится из версии каталога, пути с query params и формата
+    ответа, поэтому If-None-Match проверяется до обращения к данным
+    и отвечает 304. Сериализованные данные хранятся в кэше под тем же
+    ETag, при записи Tag или Ingredient версия меняется и старые
+    записи больше не используются.
+    Аутентификация ленивая: каталог доступен только на чтение,
+    и запрос с теплым кэшем не обращается к базе данных
+    uncached_query_params - параметры, с которыми тело ответа
+    не кэшируется (только ETag)
+    """
+    uncached_query_params = ()
+
+    def perform_authentication(self, request):
+        pass
+
+    def list(self, request, *args, **kwargs):
+        return self.catalog_response(
+            self.build_list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.catalog_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def build_list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    def catalog_response(self, view, request, *args, **kwargs):
+        etag = catalog_etag(
+            catalog_version(),
+            request.accepted_renderer.format,
+            request.get_full_path(),
+        )
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            cache_key = catalog_cache_key(etag)
+            data = cache.get(cache_key)
+            if data is not None:
+                response = Response(data)
+            else:
+                with primary_reads():
+                    response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                if not any(
+                    param in request.query_params
+                    for param in self.uncached_query_params
+                ):
+                    cache.set(
+                        cache_key, response.data,
+                        settings.CATALOG_CACHE_TIMEOUT
+                    )
+        response['ETag'] = etag
+        patch_cache_control(
+            response, public=True, max_age=settings.CATALOG_CACHE_MAX_AGE
+        )
+        return response
+
+
+class RecipeCacheMixin:
+    """
+    Общий кэш ответов list и retrieve рецептов.
+    В кэше хранится часть ответа, одинаковая для всех пользователей:
+    флаги is_favorited, is_in_shopping_cart и author.is_subscribed
+    сброшены и накладываются для пользователя тремя запросами по id
+    рецептов страницы. Запросы с фильтрами по избранному и списку
+    покупок в кэш не попадают.
+    Запись действительна для версии RECIPE_CONTENT и версии каталога
+    (recipes.signals) и свежа RECIPE_CACHE_TIMEOUT сек.
+    Ключ - формат ответа, хост и путь с query params.
+    Одновременные промахи по одному ключу вычисляет один запрос
+    (блокировка cache.add), остальные получают устаревшую запись,
+    если ей не больше RECIPE_CACHE_STALE_TIMEOUT сек. после
+    свежести (запись прежней версии - только клиенты, не закрепленные
+    за основной базой данных после записи), или ждут результат
+    до RECIPE_CACHE_LOCK_TIMEOUT сек.
+    """
+    user_dependent_query_params = ('is_favorited', 'is_in_shopping_cart')
+
+    def list(self, request, *args, **kwargs):
+        return self.shared_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.shared_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def shared_response(self, view, request, *args, **kwargs):
+        if any(
+            param in request.query_params
+            for param in self.user_dependent_query_params
+        ):
+            return view(request, *args, **kwargs)
+        version = f'{get_version(RECIPE_CONTENT)}:{catalog_version()}'
+        key = 'recipe_response:' + md5(
+            f'{request.accepted_renderer.format}:{request.get_host()}:'
+            f'{request.get_full_path()}'.encode()
+        ).hexdigest()
+        entry = cache.get(key)
+        if (
+            entry is not None
+            and entry['version'] == version
+            and time.time() < entry['fresh_until']
+        ):
+            return self.cached_response(request, entry)
+        lock_key = f'{key}:lock'
+        if cache.add(lock_key, 1, settings.RECIPE_CACHE_LOCK_TIMEOUT):
+            try:
+                return self.compute_response(
+                    key, version, view, request, *args, **kwargs
+                )
+            finally:
+                cache.delete(lock_key)
+        if (
+            entry is not None
+            and time.time() < entry['stale_until']
+            and (entry['version'] == version or not is_pinned(request))
+        ):
+            # запись прежней версии - только клиентам без недавней
+            # записи: свои изменения клиент видит сразу
+            return self.cached_response(request, entry)
+        entry = self.wait_entry(key, lock_key, version)
+        if entry is not None:
+            return self.cached_response(request, entry)
+        return view(request, *args, **kwargs)
+
+    @staticmethod
+    def wait_entry(key, lock_key, version):
+        """
+        ожидание записи, которую вычисляет другой запрос: паузы
+        растут от RECIPE_CACHE_WAIT_MIN до RECIPE_CACHE_WAIT_MAX сек.
+        со случайным разбросом, ожидание заканчивается раньше,
+        если блокировка снята без записи (ошибка вычисления)
+        """
+        deadline = time.time() + settings.RECIPE_CACHE_LOCK_TIMEOUT
+        delay = settings.RECIPE_CACHE_WAIT_MIN
+        while time.time() < deadline:
+            time.sleep(min(
+                delay * random.uniform(0.5, 1), deadline - time.time()
+            ))
+            delay = min(delay * 2, settings.RECIPE_CACHE_WAIT_MAX)
+            entry = cache.get(key)
+            if entry is not None and entry['version'] == version:
+                return entry
+            if cache.get(lock_key) is None:
+                return None
+        return None
+
+    def compute_response(self, key, version, view, request, *args, **kwargs):
+        with primary_reads():
+            response = view(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        data = deepcopy(response.data)
+        for recipe in self.recipes_in(data):
+            recipe['is_favorited'] = False
+            recipe['is_in_shopping_cart'] = False
+            recipe['author']['is_subscribed'] = False
+        now = time.time()
+        cache.set(
+            key,
+            {
+                'version': version,
+                'fresh_until': now + settings.RECIPE_CACHE_TIMEOUT,
+                'stale_until': (
+                    now + settings.RECIPE_CACHE_TIMEOUT
+                    + settings.RECIPE_CACHE_STALE_TIMEOUT
+                ),
+                'data': data,
+            },
+            settings.RECIPE_CACHE_TIMEOUT + settings.RECIPE_CACHE_STALE_TIMEOUT
+        )
+        return response
+
+    def cached_response(self, request, entry):
+        data = entry['data']
+        user = request.user
+        recipes = self.recipes_in(data)
+        if user.is_anonymous or not recipes:
+            return Response(data)
+        recipe_ids = [recipe['id'] for recipe in recipes]
+        favorites = set(user.favorites.filter(
+            id__in=recipe_ids
+        ).values_list('id', flat=True))
+        carts = set(user.carts.filter(
+            id__in=recipe_ids
+        ).values_list('id', flat=True))
+        subscribed = set(user.subscribe.filter(
+            id__in={recipe['author']['id'] for recipe in recipes}
+        ).values_list('id', flat=True))
+        for recipe in recipes:
+            recipe['is_favorited'] = recipe['id'] in favorites
+            recipe['is_in_shopping_cart'] = recipe['id'] in carts
+            recipe['author']['is_subscribed'] = (
+                recipe['author']['id'] in subscribed
+            )
+        return Response(data)
+
+    @staticmethod
+    def recipes_in(data):
+        if isinstance(data, list):
+            return data
+        if 'results' in data:
+            return data['results']
+        return [data]
+
+
+class BulkRelationMixin:
+    """
+    Массовое добавление (POST) и удаление (DELETE) связей пользователя:
+    избранное, список покупок, подписки. Тело запроса {"ids": [...]},
+    связи меняются одним INSERT или DELETE по промежуточной таблице,
+    количество запросов не зависит от количества id.
+    В ответе результат для каждого id: added или exists для POST,
+    removed или absent для DELETE, not_found - объекта нет
+    """
+    bulk_statuses = {
+        'POST': ('added', 'exists'),
+        'DELETE': ('removed', 'absent'),
+    }
+
+    def bulk_response(self, request, change):
+        """
+        change(ids) меняет связи и возвращает
+        множества найденных и измененных id
+        """
+        if request.user.is_anonymous:
+            return Response(status=HTTP_401_UNAUTHORIZED)
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        found, changed = change(ids)
+        done, unchanged = self.bulk_statuses[request.method]
+        return Response({'results': [
+            {
+                'id': pk,
+                'status': (
+                    done if pk in changed
+                    else unchanged if pk in found
+                    else 'not_found'
+                ),
+            }
+            for pk in ids
+        ]})
+
+    def change_relation(self, manager, queryset, ids):
+        """
+        изменение связей через related manager (m2m_changed
+        отправляется один раз на все измененные связи).
+        Объекты блокируются по порядку pk, затем пользователь, как
+        в ShoppingCartQuerySet.lock_recipes; для подписок авторы и
+        пользователь блокируются одним запросом. Одинаковые
+        параллельные запросы выполняются по очереди, added или
+        removed для id получает только один из них
+        """
+        user_id = self.request.user.pk
+        subscriptions = queryset.model is User
+        with transaction.atomic():
+            found = set(
+                queryset.select_for_update().filter(
+                    pk__in=[*ids, user_id] if subscriptions else ids
+                ).order_by('pk').values_list('pk', flat=True)
+            ) & set(ids)
+            if not subscriptions:
+                User.objects.select_for_update().filter(
+                    pk=user_id
+                ).values_list('pk').get()
+            current = set(
+                manager.filter(pk__in=found).values_list('pk', flat=True)
+            )
+            if self.request.method == 'POST':
+                changed = found - current
+                manager.add(*changed)
+            else:
+                changed = current
+                manager.remove(*changed)
+        return found, changed
@@ -1,4 +1,100 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import b64decode, b64encode
+from functools import partial
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from foodgram.db.router import primary_reads
+
+from recipes.versions import get_versions, relations_version, rows_version
+
+
+class CountStrategyPaginator(Paginator):
+    """
+    Paginator с выбором способа подсчета общего количества,
+    результат кэшируется на COUNT_CACHE_TIMEOUT по SQL запроса
+    (фильтры, пользователь) и версиям versions, которые меняются
+    при записи (recipes.signals):
+    - для PostgreSQL сначала берется оценка планировщика (EXPLAIN),
+      выше COUNT_ESTIMATE_THRESHOLD она и возвращается,
+      count_exact = False
+    - иначе точный COUNT(*) по pk.
+    EXPLAIN и COUNT(*) выполняются только при промахе кэша
+    """
+    count_exact = True
+
+    def __init__(self, *args, versions=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.versions = versions
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return super().count
+        if self.object_list.query.is_empty():
+            # .none(): SQL для ключа кэша и оценки не строится
+            return 0
+        # только pk: аннотации выборки не попадают в COUNT
+        queryset = self.object_list.values('pk')
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            # условие, которое заведомо ничего не выбирает,
+            # например pk__in=[]
+            return 0
+        cache_key = 'count:{}:{}'.format(
+            md5(':'.join(get_versions(self.versions)).encode()).hexdigest(),
+            md5(f'{sql}:{params}'.encode()).hexdigest(),
+        )
+        cached = cache.get(cache_key)
+        if cached is None:
+            estimate = self.estimated_count(queryset, sql, params)
+            if (
+                estimate is not None
+                and estimate > settings.COUNT_ESTIMATE_THRESHOLD
+            ):
+                cached = (estimate, False)
+            else:
+                with primary_reads():
+                    cached = (queryset.count(), True)
+            cache.set(cache_key, cached, settings.COUNT_CACHE_TIMEOUT)
+        count, self.count_exact = cached
+        return count
+
+    @staticmethod
+    def estimated_count(queryset, sql, params):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']['Plan Rows']
+
+
+def count_versions(queryset, user):
+    """
+    версии, от которых зависит COUNT(*) выборки: состав строк модели
+    и связи пользователя (фильтры избранного, списка покупок, подписки)
+    """
+    versions = [rows_version(queryset.model._meta.label_lower)]
+    if user.is_authenticated:
+        versions.append(relations_version(user.pk))
+    return versions
 
 
 class LimitPageNumberPagination(PageNumberPagination):
@@ -7,5 +103,157 @@ class LimitPageNumberPagination(PageNumberPagination):
     за максимальный вывод страниц, пример использования
     http://127.0.0.1:8000/api/users/subscriptions/?limit=6
     необходим для совместимости с текущей реализацией api fronend
+    count считается CountStrategyPaginator, count_exact в ответе
+    сообщает, точное ли это значение или оценка
     """
     page_size_query_param = 'limit'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        versions = (
+            count_versions(queryset, request.user)
+            if isinstance(queryset, QuerySet) else ()
+        )
+        self.django_paginator_class = partial(
+            CountStrategyPaginator, versions=versions
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.page.paginator.count,
+            'count_exact': self.page.paginator.count_exact,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class RecipeCursorPagination(BasePagination):
+    """
+    Keyset пагинация ленты рецептов по (pub_date, id) без COUNT(*)
+    и OFFSET: стоимость любой страницы одинакова, новые рецепты
+    не сдвигают уже открытые страницы.
+    Включается параметром cursor, первая страница - пустой cursor,
+    пример использования
+    http://127.0.0.1:8000/api/recipes/?cursor=&limit=6
+    далее ссылки next и previous из ответа
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = 6
+    max_page_size = 100
+    invalid_cursor_message = 'Некорректный cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_union((queryset,), request, view)
+
+    def paginate_union(self, querysets, request, view=None):
+        """
+        страница объединения (UNION) querysets с одинаковыми полями:
+        cursor и размер страницы применяются к каждой ветви по ее
+        индексу, объединяются не больше page_size + 1 строк ветви
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        reverse = position is not None and position[0]
+        ordering = ('pub_date', 'id') if reverse else ('-pub_date', '-id')
+        branches = [
+            self.after_cursor(queryset, position).order_by(*ordering)
+            for queryset in querysets
+        ]
+        if len(branches) == 1:
+            queryset = branches[0]
+        else:
+            queryset = self.union(branches, page_size + 1).order_by(
+                *ordering
+            )
+        page = list(queryset[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+        has_next = has_more or reverse
+        has_previous = has_more if reverse else position is not None
+        self.next_position = page[-1] if has_next and page else None
+        self.previous_position = page[0] if has_previous and page else None
+        return page
+
+    @staticmethod
+    def after_cursor(queryset, position):
+        if position is None:
+            return queryset
+        reverse, pub_date, pk = position
+        if reverse:
+            return queryset.filter(pub_date__gte=pub_date).filter(
+                Q(pub_date__gt=pub_date) | Q(id__gt=pk)
+            )
+        return queryset.filter(pub_date__lte=pub_date).filter(
+            Q(pub_date__lt=pub_date) | Q(id__lt=pk)
+        )
+
+    @staticmethod
+    def union(branches, limit):
+        """
+        (SELECT ... ORDER BY ... LIMIT limit) UNION (...). SQLite не
+        допускает LIMIT в ветвях составного запроса, там ветвь
+        ограничивается подзапросом pk__in
+        """
+        features = connections[branches[0].db].features
+        if features.supports_slicing_ordering_in_compound:
+            branches = [branch[:limit] for branch in branches]
+        else:
+            branches = [
+                branch.filter(
+                    pk__in=branch.values('pk')[:limit]
+                ).order_by()
+                for branch in branches
+            ]
+        return branches[0].union(*branches[1:])
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            reverse, pub_date, pk = b64decode(
+                encoded.encode(), altchars=b'-_', validate=True
+            ).decode().split('|')
+            pub_date = parse_datetime(pub_date)
+            if pub_date is None:
+                raise ValueError
+            return reverse == '1', pub_date, int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, recipe, reverse):
+        position = f'{int(reverse)}|{recipe.pub_date.isoformat()}|{recipe.pk}'
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            b64encode(position.encode(), altchars=b'-_').decode(),
+        )
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
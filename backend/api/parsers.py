@@ -0,0 +1,23 @@
+import mimetypes
+
+from rest_framework.parsers import DataAndFiles, FileUploadParser
+
+
+class ImageUploadParser(FileUploadParser):
+    """
+    Тело запроса - файл изображения целиком (Content-Type: image/*),
+    имя файла в Content-Disposition необязательно, без него
+    расширение определяется по Content-Type.
+    Файл пишется обработчиками загрузки Django по частям
+    и передается в request.data['image'], как из multipart формы
+    """
+    media_type = 'image/*'
+
+    def get_filename(self, stream, media_type, parser_context):
+        return super().get_filename(
+            stream, media_type, parser_context
+        ) or 'image' + (mimetypes.guess_extension(media_type) or '')
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parsed = super().parse(stream, media_type, parser_context)
+        return DataAndFiles({}, {'image': parsed.files['file']})
@@ -1,15 +1,25 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.db import transaction
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework.serializers import (
-    CharField, IntegerField, ModelSerializer, PrimaryKeyRelatedField,
-    SerializerMethodField, ValidationError,)
+    CharField, Field, ImageField, IntegerField, ListField, ModelSerializer,
+    Serializer, SerializerMethodField, ValidationError,)
 from rest_framework.validators import UniqueTogetherValidator
 
-from recipes.models import Ingredient, IngredientAmount, Recipe, Tag
+from recipes.models import (Ingredient, IngredientAmount, Recipe,
+                            ShoppingCartIngredient, StoredFile, Tag,)
 
 User = get_user_model()
 
+UPLOAD_IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+
+def image_reference_salt(user):
+    return f'recipes.image:{user.pk}'
+
 
 class UserSerializer(ModelSerializer):
     is_subscribed = SerializerMethodField()
@@ -56,19 +66,73 @@ class UserSerializer(ModelSerializer):
         user = self.context.get('request').user
         if user.is_anonymous or (user == obj):
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return user.subscribe.filter(id=obj.id).exists()
 
 
+class RecipeImageField(Field):
+    """
+    url уменьшенной копии изображения рецепта в совместимом формате
+    (JPEG или PNG). Вариант задается аргументом variant или
+    context['image_variant'], по умолчанию 'full'.
+    Пока копии не созданы - url оригинала
+    """
+    compatible_formats = ('jpeg', 'png')
+
+    def __init__(self, variant=None, **kwargs):
+        self.variant = variant
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def build_url(self, storage, name):
+        url = storage.url(name)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+    def get_sources(self, recipe):
+        variant = self.variant or self.context.get('image_variant', 'full')
+        return recipe.image_variants.get(variant, {})
+
+    def to_representation(self, recipe):
+        if not recipe.image:
+            return None
+        storage = recipe.image.storage
+        for image_format, name in self.get_sources(recipe).items():
+            if image_format in self.compatible_formats:
+                return self.build_url(storage, name)
+        return self.build_url(storage, recipe.image.name)
+
+
+class RecipeImageSourcesField(RecipeImageField):
+    """
+    url копий изображения во всех созданных форматах
+    {'webp': ..., 'avif': ..., 'jpeg': ...} для <picture>,
+    пока копии не созданы - пустой словарь
+    """
+
+    def to_representation(self, recipe):
+        storage = recipe.image.storage
+        return {
+            image_format: self.build_url(storage, name)
+            for image_format, name in self.get_sources(recipe).items()
+        }
+
+
 class ShortRecipeSerializer(ModelSerializer):
+    image = RecipeImageField(variant='thumbnail')
+    image_sources = RecipeImageSourcesField(variant='thumbnail')
+
     class Meta:
         model = Recipe
-        fields = 'id', 'name', 'image', 'cooking_time'
+        fields = 'id', 'name', 'image', 'image_sources', 'cooking_time'
         read_only_fields = '__all__',
 
 
 class UserSubscribeSerializer(UserSerializer):
     recipes = SerializerMethodField()
-    recipes_count = SerializerMethodField()
 
     class Meta:
         model = User
@@ -80,20 +144,22 @@ class UserSubscribeSerializer(UserSerializer):
             'last_name',
             'recipes',
             'recipes_count',
+            'subscribers_count',
         )
         read_only_fields = '__all__',
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
     def get_recipes(self, obj):
-        query_params = self.context['request'].query_params
-        recipes_limit = query_params.get('recipes_limit', False)
-        if recipes_limit:
-            recipes_limit = int(recipes_limit)
-            recipes = Recipe.objects.filter(author=obj)[:recipes_limit]
+        """
+        рецепты автора подгружены для всей страницы одним запросом
+        UserViewSet.get_subscribe_queryset в атрибут short_recipes
+        """
+        if hasattr(obj, 'short_recipes'):
+            recipes = obj.short_recipes
         else:
-            recipes = Recipe.objects.filter(author=obj)
+            recipes_limit = self.context.get(
+                'recipes_limit', settings.DEFAULT_RECIPES_LIMIT
+            )
+            recipes = Recipe.objects.filter(author=obj)[:recipes_limit]
         serializer = ShortRecipeSerializer(recipes, many=True)
         return serializer.data
 
@@ -108,7 +174,7 @@ class TagSerializer(ModelSerializer):
 class IngredientSerializer(ModelSerializer):
     class Meta:
         model = Ingredient
-        fields = '__all__'
+        fields = ('id', 'name', 'measurement_unit')
         read_only_fields = '__all__',
 
 
@@ -137,9 +203,11 @@ class IngredientInRecipeSerializer(ModelSerializer):
 
 
 class IngredientRecipeCreateSerializer(ModelSerializer):
-    id = PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    """
+    id ингредиентов всего рецепта разрешаются одним запросом
+    в RecipeCreateSerializer.validate
+    """
+    id = IntegerField()
     amount = IntegerField()
 
     class Meta:
@@ -155,7 +223,8 @@ class RecipeSerializer(ModelSerializer):
     )
     is_favorited = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
-    image = Base64ImageField()
+    image = RecipeImageField()
+    image_sources = RecipeImageSourcesField()
 
     class Meta:
         model = Recipe
@@ -166,8 +235,10 @@ class RecipeSerializer(ModelSerializer):
             'ingredients',
             'is_favorited',
             'is_in_shopping_cart',
+            'favorites_count',
             'name',
             'image',
+            'image_sources',
             'text',
             'cooking_time',
         )
@@ -176,26 +247,114 @@ class RecipeSerializer(ModelSerializer):
             'is_shopping_cart',
         )
 
+    def to_representation(self, instance):
+        """
+        флаг подписки на автора вычислен аннотацией
+        Recipe.objects.for_read(), передаем его во вложенный
+        UserSerializer без дополнительного запроса
+        """
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        return super().to_representation(instance)
+
     def get_is_favorited(self, obj):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return user.favorites.filter(id=obj.id).exists()
 
     def get_is_in_shopping_cart(self, obj):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return user.carts.filter(id=obj.id).exists()
 
 
-class RecipeCreateSerializer(ModelSerializer):
-    tags = PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True
+class BulkIdsSerializer(Serializer):
+    """
+    id объектов массового изменения связей, повторы отбрасываются
+    """
+    ids = ListField(
+        child=IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_IDS_LIMIT,
     )
+
+    def validate_ids(self, ids):
+        return list(dict.fromkeys(ids))
+
+
+class RecipeImageUploadSerializer(Serializer):
+    """
+    Загрузка изображения рецепта файлом, без base64.
+    Файл проверяется Pillow и сохраняется в хранилище,
+    в ответе ссылка image для полей image рецепта
+    (подписана для пользователя и действует MEDIA_COLLECT_DELAY сек.,
+    неиспользованный файл удалит collect_media) и url файла
+    """
+    image = ImageField()
+
+    def validate_image(self, image):
+        if image.size > settings.MAX_IMAGE_UPLOAD_SIZE:
+            raise ValidationError(
+                'Размер изображения больше '
+                f'{settings.MAX_IMAGE_UPLOAD_SIZE // 1024 // 1024} МБ'
+            )
+        if image.image.format not in UPLOAD_IMAGE_FORMATS:
+            raise ValidationError(
+                f'Допустимые форматы: {", ".join(UPLOAD_IMAGE_FORMATS)}'
+            )
+        return image
+
+    def create(self, validated_data):
+        image = validated_data['image']
+        name = default_storage.save(
+            f'recipe_images/image.{image.image.format.lower()}', image
+        )
+        StoredFile.objects.register((name,))
+        return name
+
+    def to_representation(self, name):
+        request = self.context['request']
+        return {
+            'image': signing.dumps(
+                name, salt=image_reference_salt(request.user)
+            ),
+            'url': request.build_absolute_uri(default_storage.url(name)),
+        }
+
+
+class RecipeImageInputField(Base64ImageField):
+    """
+    изображение рецепта: base64 строка или ссылка image,
+    полученная от /api/recipes/images/
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) and ';base64,' not in data and ':' in data:
+            try:
+                return signing.loads(
+                    data,
+                    salt=image_reference_salt(self.context['request'].user),
+                    max_age=settings.MEDIA_COLLECT_DELAY,
+                )
+            except signing.BadSignature:
+                raise ValidationError(
+                    'Ссылка на изображение недействительна, '
+                    'загрузите изображение заново'
+                )
+        return super().to_internal_value(data)
+
+
+class RecipeCreateSerializer(ModelSerializer):
+    tags = ListField(child=IntegerField())
     author = UserSerializer(read_only=True)
     ingredients = IngredientRecipeCreateSerializer(many=True)
-    image = Base64ImageField()
+    image = RecipeImageInputField()
 
     class Meta:
         model = Recipe
@@ -227,9 +386,10 @@ class RecipeCreateSerializer(ModelSerializer):
         - поля name, text, cooking_time
         уже валидированы на уровне модели и доступны в data,
         мы их сохраним автоматом при обновлении или создания рецепта.
-        - поле tags - значения валидируется на уровне модели,
-        убедимся в наличии минимум 1 тега
-        - ingredients валидируем наличие в рецепте и количество
+        - поле tags - убедимся в наличии минимум 1 тега,
+        id тегов разрешаются одним запросом in_bulk
+        - ingredients валидируем наличие в рецепте и количество,
+        id ингредиентов разрешаются одним запросом in_bulk
         """
         tags = data.get('tags')
         ingredients = data.get('ingredients')
@@ -241,9 +401,26 @@ class RecipeCreateSerializer(ModelSerializer):
             raise ValidationError(
                 {'ingredients': 'В рецепте нужны ингредиенты'}
             )
+        tag_objs = Tag.objects.in_bulk(tags)
+        missing_tags = set(tags) - tag_objs.keys()
+        if missing_tags:
+            raise ValidationError(
+                {'tags': f'Теги {sorted(missing_tags)} не существуют'}
+            )
+        data['tags'] = [tag_objs[pk] for pk in dict.fromkeys(tags)]
+        ingredient_objs = Ingredient.objects.in_bulk(
+            [ingredient_item['id'] for ingredient_item in ingredients]
+        )
         validated_ingredients_obj = []
         for ingredient_item in ingredients:
-            ingr_obj = ingredient_item['id']
+            ingr_obj = ingredient_objs.get(ingredient_item['id'])
+            if ingr_obj is None:
+                raise ValidationError(
+                    {'ingredients': (
+                        f'Ингредиент {ingredient_item["id"]} не существует'
+                    )}
+                )
+            ingredient_item['id'] = ingr_obj
             if ingr_obj in validated_ingredients_obj:
                 raise ValidationError(
                     f'"{ingr_obj}" уже добавлен в рецепт'
@@ -277,12 +454,51 @@ class RecipeCreateSerializer(ModelSerializer):
         return name
 
     def create_ingredients(self, ingredients, recipe):
-        for ingredient in ingredients:
-            IngredientAmount.objects.get_or_create(
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(
                 recipe=recipe,
                 ingredients=ingredient['id'],
                 amount=ingredient['amount']
             )
+            for ingredient in ingredients
+        )
+
+    def update_ingredients(self, ingredients, recipe):
+        """
+        Изменяются только отличающиеся строки IngredientAmount:
+        удаленные из рецепта - одним DELETE, с новым количеством -
+        одним bulk_update, добавленные - одним bulk_create.
+        Возвращает прежние количества {ingredient_id: amount}
+        """
+        current = {
+            row.ingredients_id: row
+            for row in IngredientAmount.objects.filter(recipe=recipe)
+        }
+        old_amounts = {pk: row.amount for pk, row in current.items()}
+        new_amounts = {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        removed = current.keys() - new_amounts.keys()
+        if removed:
+            IngredientAmount.objects.filter(
+                recipe=recipe, ingredients_id__in=removed
+            ).delete()
+        changed = []
+        for pk, row in current.items():
+            if pk in new_amounts and row.amount != new_amounts[pk]:
+                row.amount = new_amounts[pk]
+                changed.append(row)
+        if changed:
+            IngredientAmount.objects.bulk_update(changed, ('amount',))
+        self.create_ingredients(
+            [
+                ingredient for ingredient in ingredients
+                if ingredient['id'].id not in current
+            ],
+            recipe
+        )
+        return old_amounts
 
     def create(self, validated_data):
         """
@@ -296,15 +512,17 @@ class RecipeCreateSerializer(ModelSerializer):
             2. записываем в таблицы
             - создаем запись recipe, отдельно передаем image
             - обновляем поле recipe.tags
-            - пишем IngredientAmount, используем преобразованные
-            в validate data['ingredients']
+            - пишем IngredientAmount одним bulk_create, используем
+            преобразованные в validate data['ingredients']
+            все записи в одной транзакции
         """
         image = validated_data.pop('image')
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        recipe = Recipe.objects.create(image=image, **validated_data)
-        recipe.tags.set(tags)
-        self.create_ingredients(ingredients, recipe)
+        with transaction.atomic():
+            recipe = Recipe.objects.create(image=image, **validated_data)
+            recipe.tags.set(tags)
+            self.create_ingredients(ingredients, recipe)
         return recipe
 
     def update(self, instance, validated_data):
@@ -312,24 +530,39 @@ class RecipeCreateSerializer(ModelSerializer):
         Логика работы:
         - Поля по умолчанию обновляются
           super().update(instance, validated_data)
-        - ingredients
-          self.create_ingredients(ingredients, instance)
-        - tags
+        - ingredients - изменяются только отличающиеся строки
+          self.update_ingredients(ingredients, instance)
+        - tags - set() добавляет и удаляет только разницу
           instance.tags.set(tags)
+        - списки покупок с этим рецептом получают разницу
+          в количествах ингредиентов одним
+          ShoppingCartIngredient.objects.change_recipe, сигналы
+          удаляемых строк IngredientAmount внутри maintained() ее
+          не применяют
         """
-        if 'ingredients' in validated_data:
-            ingredients = validated_data.pop('ingredients')
-            instance.ingredients.clear()
-            self.create_ingredients(ingredients, instance)
-        if 'tags' in validated_data:
-            tags = validated_data.pop('tags')
-            instance.tags.clear()
-            instance.tags.set(tags)
-        return super().update(instance, validated_data)
+        with transaction.atomic():
+            if 'ingredients' in validated_data:
+                ingredients = validated_data.pop('ingredients')
+                # блокировка рецепта до чтения количеств, как в
+                # ShoppingCartQuerySet.recipe_amounts
+                Recipe.objects.select_for_update().get(pk=instance.pk)
+                with ShoppingCartIngredient.objects.maintained(instance.pk):
+                    old_amounts = self.update_ingredients(
+                        ingredients, instance
+                    )
+                    ShoppingCartIngredient.objects.change_recipe(
+                        instance,
+                        old_amounts,
+                        {item['id'].id: item['amount'] for item in ingredients}
+                    )
+            if 'tags' in validated_data:
+                instance.tags.set(validated_data.pop('tags'))
+            return super().update(instance, validated_data)
 
     def to_representation(self, instance):
+        request = self.context.get('request')
         data = RecipeSerializer(
-            instance,
-            context={'request': self.context.get('request')}
+            Recipe.objects.for_read(request.user).get(pk=instance.pk),
+            context={'request': request}
         ).data
         return data
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
@@ -16,3 +17,18 @@ urlpatterns = (
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
 )
+
+if settings.ASYNC_VIEWS:
+    from . import async_views
+
+    urlpatterns = (
+        path(
+            'recipes/download_shopping_cart/',
+            async_views.download_shopping_cart,
+        ),
+        path('recipes/images/', async_views.upload_image),
+        path('tags/', async_views.tag_list),
+        path('tags/<int:pk>/', async_views.tag_detail),
+        path('ingredients/', async_views.ingredient_list),
+        path('ingredients/<int:pk>/', async_views.ingredient_detail),
+    ) + urlpatterns
@@ -0,0 +1,45 @@
+import csv
+import json
+
+
+class Echo:
+    """
+    псевдо-буфер для csv.writer: строка не копится в памяти,
+    а сразу возвращается в генератор ответа
+    """
+
+    def write(self, value):
+        return value
+
+
+def shopping_list_txt(ingredients):
+    yield 'Список покупок\n'
+    for ingr in ingredients:
+        yield (
+            f'{ingr["name"]}: '
+            f'{ingr["amount"]} '
+            f'{ingr["measurement_unit"]}\n'
+        )
+
+
+def shopping_list_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit'))
+    for ingr in ingredients:
+        yield writer.writerow(
+            (ingr['name'], ingr['amount'], ingr['measurement_unit'])
+        )
+
+
+def shopping_list_json(ingredients):
+    yield '['
+    for index, ingr in enumerate(ingredients):
+        yield (',' if index else '') + json.dumps(ingr, ensure_ascii=False)
+    yield ']'
+
+
+SHOPPING_LIST_FORMATS = {
+    'txt': (shopping_list_txt, 'text/plain; charset=utf-8'),
+    'csv': (shopping_list_csv, 'text/csv; charset=utf-8'),
+    'json': (shopping_list_json, 'application/json; charset=utf-8'),
+}
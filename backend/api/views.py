@@ -1,41 +1,126 @@
+from functools import partial
+from itertools import chain
+from time import perf_counter
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import IntegrityError
-from django.db.models import F, Sum
-from django.http.response import HttpResponse
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.db.models import F, OuterRef, Prefetch, Subquery
+from django.http.response import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
-from rest_framework.decorators import action
+from rest_framework.decorators import (action, api_view,
+                                       authentication_classes,
+                                       permission_classes,)
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.status import (
-    HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_400_BAD_REQUEST,
-    HTTP_401_UNAUTHORIZED,)
+from rest_framework.status import (HTTP_200_OK, HTTP_201_CREATED,
+                                   HTTP_204_NO_CONTENT, HTTP_400_BAD_REQUEST,
+                                   HTTP_401_UNAUTHORIZED,
+                                   HTTP_503_SERVICE_UNAVAILABLE,)
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from .filters import IngredientFilter, RecipeFilters
-from .paginators import LimitPageNumberPagination
+from foodgram.db.pool import pools
+
+from .filters import RecipeFilters
+from .mixins import (BulkRelationMixin, CatalogCacheMixin, RecipeCacheMixin,
+                     ReplicaReadMixin,)
+from .paginators import LimitPageNumberPagination, RecipeCursorPagination
+from .parsers import ImageUploadParser
 from .permissions import IsAdminOrReadOnly, UserAndAdminOrReadOnly
 from .serializers import (IngredientSerializer, RecipeCreateSerializer,
-                          RecipeSerializer, ShortRecipeSerializer,
-                          TagSerializer, UserSerializer,
+                          RecipeImageUploadSerializer, RecipeSerializer,
+                          ShortRecipeSerializer, TagSerializer, UserSerializer,
                           UserSubscribeSerializer,)
-from recipes.models import Ingredient, IngredientAmount, Recipe, Tag
+from .utils import SHOPPING_LIST_FORMATS
+from recipes import ingredient_index
+from recipes.models import (FeedEntry, Ingredient, Recipe,
+                            ShoppingCartIngredient, Tag,)
 
 User = get_user_model()
 
+SHOPPING_LIST_CHUNK_SIZE = 500
+
+# значения параметра ordering, по умолчанию первое;
+# счетчики поддерживаются recipes.models.CounterDeltaQuerySet
+RECIPE_ORDERINGS = {
+    'new': ('-pub_date', '-id'),
+    'popular': ('-favorites_count', '-pub_date', '-id'),
+    'carts': ('-carts_count', '-pub_date', '-id'),
+}
+# окна /api/recipes/trending/, периоды RECIPE_RANKING_PERIODS
+TRENDING_WINDOWS = ('day', 'week')
+USER_ORDERINGS = {
+    'new': ('-date_joined',),
+    'popular': ('-subscribers_count', '-date_joined'),
+    'recipes': ('-recipes_count', '-date_joined'),
+}
+
+
+def get_ordering(request, orderings):
+    ordering = request.query_params.get('ordering')
+    return orderings.get(ordering, next(iter(orderings.values())))
+
 
-class UserViewSet(DjoserUserViewSet):
+class UserViewSet(ReplicaReadMixin, BulkRelationMixin, DjoserUserViewSet):
     queryset = User.objects.all().order_by('-date_joined')
     serializer_class = UserSerializer
     pagination_class = LimitPageNumberPagination
     additional_serializer = UserSubscribeSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            return queryset.order_by(
+                *get_ordering(self.request, USER_ORDERINGS)
+            )
+        return queryset
+
+    def get_recipes_limit(self):
+        """
+        recipes_limit из query params, по умолчанию и сверху
+        ограничен настройками DEFAULT_RECIPES_LIMIT и MAX_RECIPES_LIMIT
+        """
+        try:
+            recipes_limit = int(self.request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return settings.DEFAULT_RECIPES_LIMIT
+        return max(0, min(recipes_limit, settings.MAX_RECIPES_LIMIT))
+
+    def get_subscribe_queryset(self, queryset):
+        """
+        Авторы с первыми recipes_limit рецептами в short_recipes,
+        количество рецептов - счетчик User.recipes_count.
+        Рецепты всех авторов страницы выбираются одним запросом:
+        для каждого автора берем recipes_limit последних id
+        коррелированным подзапросом с LIMIT (индекс по автору и дате
+        публикации). Вместо ROW_NUMBER() OVER (PARTITION BY author):
+        Django 4.0 не умеет фильтровать по оконной функции
+        (это появилось в Django 4.2), а коррелированный LIMIT читает
+        не больше recipes_limit строк индекса на автора
+        """
+        latest_recipes = Recipe.objects.filter(
+            author=OuterRef('author')
+        ).order_by('-pub_date').values('pk')[:self.get_recipes_limit()]
+        return queryset.prefetch_related(
+            Prefetch(
+                'recipes',
+                queryset=Recipe.objects.filter(
+                    pk__in=Subquery(latest_recipes)
+                ).order_by('-pub_date'),
+                to_attr='short_recipes',
+            )
+        )
+
     @action(methods=('POST', 'DELETE'), detail=True)
     def subscribe(self, request, **kwargs):
         user = self.request.user
         if user.is_anonymous:
             return Response(status=HTTP_401_UNAUTHORIZED)
-        obj = get_object_or_404(self.queryset, id=kwargs.get('id'))
+        obj = get_object_or_404(
+            self.get_subscribe_queryset(self.queryset), id=kwargs.get('id')
+        )
         serializer = self.additional_serializer(
             obj, context={'request': self.request}
         )
@@ -47,12 +132,23 @@ class UserViewSet(DjoserUserViewSet):
             return Response(status=HTTP_204_NO_CONTENT)
         return Response(status=HTTP_400_BAD_REQUEST)
 
+    @action(methods=('POST', 'DELETE'), detail=False, url_path='subscribe')
+    def bulk_subscribe(self, request):
+        """
+        подписка и отписка от нескольких авторов, тело {"ids": [...]}
+        """
+        return self.bulk_response(request, partial(
+            self.change_relation, request.user.subscribe, User.objects
+        ))
+
     @action(methods=('GET',), detail=False)
     def subscriptions(self, request):
         user = self.request.user
         if user.is_anonymous:
             return Response(status=HTTP_401_UNAUTHORIZED)
-        authors = user.subscribe.all()
+        authors = self.get_subscribe_queryset(
+            user.subscribe.order_by('username')
+        )
         pages = self.paginate_queryset(authors)
         serializer = UserSubscribeSerializer(
             pages, many=True, context={'request': request}
@@ -60,27 +156,44 @@ class UserViewSet(DjoserUserViewSet):
         return self.get_paginated_response(serializer.data)
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(ReplicaReadMixin, CatalogCacheMixin, ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (IsAdminOrReadOnly,)
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(
+    ReplicaReadMixin, CatalogCacheMixin, ReadOnlyModelViewSet
+):
     """
     по полю name реализован поиск
-    не чувствительный к регистру и вхождению в слове
-    совместимо только с PostgreSQL
+    не чувствительный к регистру и вхождению в слове,
+    совпадения с начала названия выводятся первыми.
+    Поиск по name обслуживается только индексом в памяти процесса
+    recipes.ingredient_index без запросов к базе данных,
+    без name - полный список из кэша каталога.
+    Ответы поиска не кэшируются, только получают ETag
     """
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (IsAdminOrReadOnly,)
-    search_fields = ('name',)
-    filter_backends = [DjangoFilterBackend]
-    filterset_class = IngredientFilter
+    filter_backends = []
+    uncached_query_params = ('name',)
+
+    def build_list(self, request, *args, **kwargs):
+        name = request.query_params.get('name', '')
+        if not name.strip():
+            return super().build_list(request, *args, **kwargs)
+        return Response(
+            ingredient_index.get_index().search(
+                name, settings.INGREDIENT_SEARCH_LIMIT
+            )
+        )
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(
+    ReplicaReadMixin, BulkRelationMixin, RecipeCacheMixin, ModelViewSet
+):
     queryset = Recipe.objects.select_related('author')
     serializer_class = RecipeCreateSerializer
     permission_classes = (UserAndAdminOrReadOnly,)
@@ -88,19 +201,72 @@ class RecipeViewSet(ModelViewSet):
     additional_serializer = ShortRecipeSerializer
     filter_class = RecipeFilters
 
+    @property
+    def paginator(self):
+        """
+        с параметром cursor - keyset пагинация RecipeCursorPagination
+        (только для сортировки по дате), иначе постраничная,
+        совместимая с frontend. Лента подписок - всегда keyset
+        """
+        if not hasattr(self, '_paginator'):
+            if self.action == 'feed' or self.action == 'list' and (
+                'cursor' in self.request.query_params
+            ) and get_ordering(
+                self.request, RECIPE_ORDERINGS
+            ) == RECIPE_ORDERINGS['new']:
+                self._paginator = RecipeCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self):
+        """
+        список сортируется параметром ordering: new (по умолчанию),
+        popular - по количеству добавлений в избранное,
+        carts - в списки покупок
+        """
+        if self.action in ('list', 'retrieve'):
+            return Recipe.objects.for_read(self.request.user).order_by(
+                *get_ordering(self.request, RECIPE_ORDERINGS)
+            )
+        return self.queryset
+
     def get_serializer_class(self):
         if self.request.method in ['POST', 'PATCH', 'PUT']:
             return RecipeCreateSerializer
         return RecipeSerializer
 
     def get_serializer_context(self):
+        """
+        в списке рецептов - копии изображений для карточек,
+        на странице рецепта - полноразмерные
+        """
         context = super().get_serializer_context()
-        context.update({'request': self.request})
+        context.update({
+            'request': self.request,
+            'image_variant': (
+                'card' if self.action in (
+                    'list', 'popular', 'trending', 'feed'
+                ) else 'full'
+            ),
+        })
         return context
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    def perform_destroy(self, instance):
+        """
+        рецепт удаляется из списков покупок вместе с его ингредиентами
+        одним изменением, без изменений по каждой строке IngredientAmount
+        """
+        with transaction.atomic(), (
+            ShoppingCartIngredient.objects.maintained(instance.pk)
+        ):
+            amounts = ShoppingCartIngredient.objects.recipe_amounts(instance)
+            ShoppingCartIngredient.objects.change_recipe(instance, amounts, {})
+            instance.delete()
+
     def create(self, request, *args, **kwargs):
         try:
             return super().create(request, *args, **kwargs)
@@ -133,15 +299,18 @@ class RecipeViewSet(ModelViewSet):
             obj, context={'request': self.request}
         )
         tables = {
-            'favorites': user.favorites,
-            'carts': user.carts,
+            'favorites': (user.favorites.add, user.favorites.remove),
+            'carts': (
+                partial(ShoppingCartIngredient.objects.add_recipe, user),
+                partial(ShoppingCartIngredient.objects.remove_recipe, user),
+            ),
         }
-        table = tables[table]
+        add, remove = tables[table]
         if self.request.method == 'POST':
-            table.add(obj)
+            add(obj)
             return Response(serializer.data, status=HTTP_201_CREATED)
         if self.request.method == 'DELETE':
-            table.remove(obj)
+            remove(obj)
             return Response(status=HTTP_204_NO_CONTENT)
         return Response(status=HTTP_400_BAD_REQUEST)
 
@@ -153,30 +322,186 @@ class RecipeViewSet(ModelViewSet):
     def shopping_cart(self, request, **kwargs):
         return self.post_delete_obj(request, 'carts', **kwargs)
 
+    @action(methods=('POST', 'DELETE'), detail=False, url_path='favorite')
+    def bulk_favorite(self, request):
+        """
+        несколько рецептов в избранное или из него, тело {"ids": [...]}
+        """
+        return self.bulk_response(request, partial(
+            self.change_relation, request.user.favorites, Recipe.objects
+        ))
+
+    @action(
+        methods=('POST', 'DELETE'), detail=False, url_path='shopping_cart'
+    )
+    def bulk_shopping_cart(self, request):
+        """
+        несколько рецептов в список покупок или из него,
+        тело {"ids": [...]}, ингредиенты всех рецептов
+        применяются к ShoppingCartIngredient одним изменением
+        """
+        change = (
+            ShoppingCartIngredient.objects.add_recipes
+            if request.method == 'POST'
+            else ShoppingCartIngredient.objects.remove_recipes
+        )
+        return self.bulk_response(request, partial(change, request.user))
+
+    def ranked_response(self, request, period):
+        """
+        страница рецептов по рейтингу RecipeRanking периода period,
+        фильтры RecipeFilters применяются как в списке
+        """
+        queryset = self.filter_queryset(
+            Recipe.objects.for_read(request.user).filter(
+                rankings__period=period, rankings__score__gt=0
+            ).order_by('-rankings__score', '-id')
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = RecipeSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=('GET',), detail=False)
+    def popular(self, request):
+        """
+        популярные рецепты: избранное и списки покупок
+        с затуханием за месяц (рейтинг popular)
+        """
+        return self.ranked_response(request, 'popular')
+
+    @action(methods=('GET',), detail=False)
+    def trending(self, request):
+        """
+        рецепты, популярные за последнее время:
+        window=day (по умолчанию) или week
+        """
+        window = request.query_params.get('window', TRENDING_WINDOWS[0])
+        if window not in TRENDING_WINDOWS:
+            return Response(
+                {'errors': f'Допустимые окна: {", ".join(TRENDING_WINDOWS)}'},
+                HTTP_400_BAD_REQUEST
+            )
+        return self.ranked_response(request, window)
+
+    @action(methods=('GET',), detail=False)
+    def feed(self, request):
+        """
+        лента рецептов подписок, новые сверху, keyset пагинация
+        RecipeCursorPagination, фильтры RecipeFilters как в списке
+        """
+        if request.user.is_anonymous:
+            return Response(status=HTTP_401_UNAUTHORIZED)
+        page = self.paginator.paginate_union(
+            [
+                self.filter_queryset(queryset)
+                for queryset in FeedEntry.objects.feed(request.user)
+            ],
+            request,
+            self,
+        )
+        serializer = RecipeSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        methods=('POST',),
+        detail=False,
+        url_path='images',
+        parser_classes=(MultiPartParser, ImageUploadParser),
+        permission_classes=(IsAuthenticated,),
+    )
+    def upload_image(self, request):
+        """
+        Загрузка изображения рецепта multipart формой (поле image)
+        или телом запроса с Content-Type: image/*.
+        Возвращает ссылку image, которую принимают создание
+        и изменение рецепта вместо base64 строки
+        """
+        serializer = RecipeImageUploadSerializer(
+            data=request.data, context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=HTTP_201_CREATED)
+
     @action(methods=('GET',), detail=False)
     def download_shopping_cart(self, request):
+        """
+        Список покупок отдается потоком StreamingHttpResponse,
+        готовый агрегат ShoppingCartIngredient пользователя читается
+        серверным курсором через iterator(). В режиме asgi части
+        ответа читаются в потоке запроса (foodgram.handlers).
+        Формат выбирается параметром file_format: txt (по умолчанию),
+        csv, json. Пустой список покупок - 204
+        """
         user = self.request.user
-        if not user.carts.exists():
-            return Response(status=HTTP_400_BAD_REQUEST)
-        ingredients = IngredientAmount.objects.filter(
-            recipe__in=(user.carts.values('id'))
-        ).values(
-            ingredient=F('ingredients__name'),
-            measure_unit=F('ingredients__measurement_unit')
-        ).annotate(amount_cart=Sum('amount'))
-        filename = f'{user.username}_shopping_list.txt'
-        shopping_list = ("Список покупок\n")
-
-        for ingr in ingredients:
-            shopping_list += (
-                f'{ingr["ingredient"]}: '
-                f'{ingr["amount_cart"]} '
-                f'{ingr["measure_unit"]}\n'
+        if user.is_anonymous:
+            return Response(status=HTTP_401_UNAUTHORIZED)
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response(
+                {'errors': (
+                    'Допустимые форматы: '
+                    f'{", ".join(SHOPPING_LIST_FORMATS)}'
+                )},
+                HTTP_400_BAD_REQUEST
             )
-        response = HttpResponse(
-            shopping_list, content_type='text.txt; charset=utf-8'
+        ingredients = ShoppingCartIngredient.objects.filter(
+            user=user
+        ).values(
+            'amount',
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+        ).order_by('name').iterator(
+            chunk_size=SHOPPING_LIST_CHUNK_SIZE
         )
+        first = next(ingredients, None)
+        if first is None:
+            return Response(status=HTTP_204_NO_CONTENT)
+        generator, content_type = SHOPPING_LIST_FORMATS[file_format]
+        response = StreamingHttpResponse(
+            generator(chain((first,), ingredients)),
+            content_type=content_type
+        )
+        filename = f'{user.username}_shopping_list.{file_format}'
         response['Content-Disposition'] = (
-            f'attachment; filename={filename}.txt'
+            f'attachment; filename={filename}'
         )
         return response
+
+
+@api_view(('GET',))
+@authentication_classes(())
+@permission_classes((AllowAny,))
+def ready(request):
+    """
+    Готовность воркера к приему запросов (readiness probe):
+    каждая база данных отвечает на SELECT 1, в ответе время ответа
+    и статистика пулов соединений процесса foodgram.db.pool.
+    503, если хотя бы одна база данных недоступна.
+    Подключен вне /api/, через nginx не публикуется
+    """
+    databases = {}
+    for alias in connections:
+        started = perf_counter()
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+            databases[alias] = {'ok': True}
+        except DatabaseError as error:
+            databases[alias] = {'ok': False, 'error': str(error)}
+        databases[alias]['latency_ms'] = round(
+            (perf_counter() - started) * 1000, 2
+        )
+    for alias, alias_pools in pools().items():
+        databases.setdefault(alias, {'ok': True})['pools'] = [
+            pool.stats() for pool in alias_pools
+        ]
+    is_ready = all(database['ok'] for database in databases.values())
+    return Response(
+        {'ready': is_ready, 'databases': databases},
+        status=HTTP_200_OK if is_ready else HTTP_503_SERVICE_UNAVAILABLE,
+    )
@@ -1,7 +1,17 @@
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+
+from foodgram.handlers import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+os.environ.setdefault('ASYNC_VIEWS', 'True')
+
+# как django.core.asgi.get_asgi_application, с ASGIHandler
+# foodgram.handlers
+django.setup(set_prefix=False)
+application = ASGIHandler()
+
+from recipes.ingredient_index import warm_up  # noqa: E402
 
-application = get_asgi_application()
+warm_up()
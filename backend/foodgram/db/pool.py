@@ -0,0 +1,188 @@
+import threading
+from collections import deque
+from time import monotonic
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Ограниченный пул соединений с базой данных одного процесса.
+    max_size соединений держатся открытыми между запросами,
+    сверх них при нагрузке открывается до max_overflow временных,
+    которые закрываются при возврате. Если все заняты, выдача
+    ждет освобождения до timeout сек., затем PoolTimeout.
+    Соединение, простоявшее в пуле дольше check_interval сек.,
+    при выдаче проверяется check(connection); соединения старше
+    max_lifetime сек. закрываются. Последнее возвращенное соединение
+    выдается первым, лишние дольше простаивают и закрываются
+    по max_lifetime.
+    alias - база данных в settings.DATABASES,
+    connect, check и reset - функции backend базы данных:
+    открыть соединение, проверить его, подготовить к повторному
+    использованию (False - соединение закрыть)
+    """
+
+    def __init__(
+        self, alias, connect, check, reset, max_size=10, max_overflow=10,
+        timeout=30, check_interval=30, max_lifetime=3600,
+    ):
+        self.alias = alias
+        self.connect = connect
+        self.check = check
+        self.reset = reset
+        self.max_size = max_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.max_lifetime = max_lifetime
+        self.condition = threading.Condition()
+        # (соединение, время открытия, время возврата в пул)
+        self.idle = deque()
+        self.opened = {}
+        self.in_use = 0
+        self.created = 0
+        self.closed = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.failed_checks = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @property
+    def size(self):
+        return len(self.opened)
+
+    def acquire(self):
+        started = monotonic()
+        with self.condition:
+            while not self.idle and (
+                self.in_use >= self.max_size + self.max_overflow
+            ):
+                remaining = started + self.timeout - monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(
+                        f'нет свободных соединений за {self.timeout} сек.: '
+                        f'занято {self.in_use}'
+                    )
+                self.condition.wait(remaining)
+            entry = self.idle.pop() if self.idle else None
+            self.in_use += 1
+            self.checkouts += 1
+            waited = monotonic() - started
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+        try:
+            while entry is not None:
+                connection = self.checked(*entry)
+                if connection is not None:
+                    return connection
+                with self.condition:
+                    entry = self.idle.pop() if self.idle else None
+            connection = self.connect()
+        except BaseException:
+            with self.condition:
+                self.in_use -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.opened[id(connection)] = monotonic()
+            self.created += 1
+        return connection
+
+    def checked(self, connection, opened, returned):
+        """
+        соединение из пула или None, если оно закрыто как устаревшее
+        или не прошло проверку
+        """
+        now = monotonic()
+        if now - opened > self.max_lifetime:
+            self.discard(connection)
+            return None
+        if now - returned >= self.check_interval:
+            try:
+                usable = self.check(connection)
+            except Exception:
+                usable = False
+            if not usable:
+                with self.condition:
+                    self.failed_checks += 1
+                self.discard(connection)
+                return None
+        return connection
+
+    def release(self, connection):
+        with self.condition:
+            self.in_use -= 1
+            self.condition.notify()
+            opened = self.opened.get(id(connection))
+            overflow = len(self.idle) >= self.max_size
+        if opened is None:
+            return
+        try:
+            reusable = not overflow and self.reset(connection)
+        except Exception:
+            reusable = False
+        if not reusable:
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append((connection, opened, monotonic()))
+            self.condition.notify()
+
+    def discard(self, connection):
+        with self.condition:
+            if self.opened.pop(id(connection), None) is None:
+                return
+            self.closed += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        with self.condition:
+            return {
+                'size': self.size,
+                'idle': len(self.idle),
+                'in_use': self.in_use,
+                'max_size': self.max_size,
+                'max_overflow': self.max_overflow,
+                'created': self.created,
+                'closed': self.closed,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'failed_checks': self.failed_checks,
+                'wait_time': self.wait_time,
+                'max_wait_time': self.max_wait_time,
+            }
+
+
+def get_pool(key, factory):
+    """
+    пул процесса для параметров соединения key,
+    factory() создает его при первом обращении
+    """
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = factory()
+    return pool
+
+
+def pools():
+    """
+    пулы процесса: {alias: [ConnectionPool, ...]}
+    """
+    result = {}
+    for pool in list(_pools.values()):
+        result.setdefault(pool.alias, []).append(pool)
+    return result
@@ -0,0 +1,96 @@
+from django.db.backends.postgresql import base
+
+import psycopg2.extensions
+import psycopg2.extras
+
+from ..pool import ConnectionPool, PoolTimeout, get_pool
+
+POOL_DEFAULTS = {
+    'MAX_SIZE': 10,
+    'MAX_OVERFLOW': 10,
+    'TIMEOUT': 30,
+    'CHECK_INTERVAL': 30,
+    'MAX_LIFETIME': 3600,
+}
+
+
+def connect(conn_params, isolation_level):
+    """
+    новое соединение, как base.DatabaseWrapper.get_new_connection
+    """
+    connection = psycopg2.connect(**conn_params)
+    if (
+        isolation_level is not None
+        and isolation_level != connection.isolation_level
+    ):
+        connection.set_session(isolation_level=isolation_level)
+    psycopg2.extras.register_default_jsonb(
+        conn_or_curs=connection, loads=lambda value: value
+    )
+    return connection
+
+
+def check(connection):
+    if connection.closed:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    return True
+
+
+def reset(connection):
+    """
+    незавершенная транзакция откатывается,
+    соединение в неизвестном состоянии закрывается
+    """
+    if connection.closed:
+        return False
+    status = connection.get_transaction_status()
+    if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+    return True
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL с пулом соединений процесса foodgram.db.pool,
+    ENGINE = 'foodgram.db.postgresql', параметры пула -
+    DATABASES[alias]['POOL'] (ключи POOL_DEFAULTS).
+    Django закрывает соединение в конце запроса (CONN_MAX_AGE = 0),
+    закрытие возвращает его в пул
+    """
+
+    def get_pool(self, conn_params):
+        options = {**POOL_DEFAULTS, **self.settings_dict.get('POOL', {})}
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        key = (self.alias, tuple(sorted(
+            (name, str(value)) for name, value in conn_params.items()
+        )))
+        return get_pool(key, lambda: ConnectionPool(
+            self.alias,
+            lambda: connect(conn_params, isolation_level),
+            check,
+            reset,
+            max_size=options['MAX_SIZE'],
+            max_overflow=options['MAX_OVERFLOW'],
+            timeout=options['TIMEOUT'],
+            check_interval=options['CHECK_INTERVAL'],
+            max_lifetime=options['MAX_LIFETIME'],
+        ))
+
+    def get_new_connection(self, conn_params):
+        self.connection_pool = self.get_pool(conn_params)
+        try:
+            connection = self.connection_pool.acquire()
+        except PoolTimeout as error:
+            raise base.Database.OperationalError(str(error)) from error
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            self.connection_pool.release(self.connection)
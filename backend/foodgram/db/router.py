@@ -0,0 +1,87 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework.permissions import SAFE_METHODS
+
+PRIMARY = 'default'
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def pin_key(request):
+    """
+    ключ закрепления за основной базой данных: токен из заголовка
+    Authorization (у пользователя один токен), без запроса к базе данных
+    """
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if not authorization:
+        return None
+    return f'replica_pin:{md5(authorization.encode()).hexdigest()}'
+
+
+def is_pinned(request):
+    key = pin_key(request)
+    return key is not None and cache.get(key) is not None
+
+
+@contextmanager
+def primary_reads():
+    """
+    чтение внутри блока - с основной базы данных (пока в нем
+    не вызван use_replicas), по выходе прежний режим.
+    Кэши, действительные до смены версии (recipes.versions),
+    заполняются только так: данные реплики могут отставать
+    от записи, сменившей версию
+    """
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def use_replicas():
+    _replica_reads.set(True)
+
+
+class ReplicaRouter:
+    """
+    Запись и по умолчанию чтение - основная база данных default.
+    Чтение после use_replicas() - случайная реплика из
+    REPLICA_DATABASES. Миграции применяются только к default,
+    реплики получают схему репликацией
+    """
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and settings.REPLICA_DATABASES:
+            return random.choice(settings.REPLICA_DATABASES)
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == PRIMARY
+
+
+class ReadYourWritesMiddleware(MiddlewareMixin):
+    """
+    После изменяющего запроса (не SAFE_METHODS) клиент на
+    REPLICA_PIN_TIMEOUT сек. закрепляется за основной базой данных:
+    его чтения не идут на реплики, пока они могут отставать
+    """
+
+    def process_response(self, request, response):
+        if settings.REPLICA_DATABASES and request.method not in SAFE_METHODS:
+            key = pin_key(request)
+            if key is not None:
+                cache.set(key, 1, settings.REPLICA_PIN_TIMEOUT)
+        return response
@@ -0,0 +1,56 @@
+"""
+ASGIHandler для foodgram.asgi. ASGIHandler Django 4.0 перебирает
+streaming_content потокового ответа синхронно в цикле событий:
+итератор, читающий базу данных (список покупок) или файл, блокирует
+цикл событий, а запросы к базе данных в нем запрещены. Асинхронные
+итераторы streaming_content поддерживаются только с Django 4.2
+"""
+from itertools import islice
+
+from django.conf import settings
+from django.core.handlers import asgi
+
+from asgiref.sync import sync_to_async
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """
+    Части потокового ответа читаются порциями по
+    ASGI_STREAMING_BATCH_SIZE в потоке запроса (thread_sensitive,
+    там же выполнялся view и открыто соединение с базой данных)
+    и отправляются из цикла событий, в памяти - одна порция.
+    Заголовки и остальные ответы отправляет ASGIHandler Django
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        parts = iter(response)
+        # ASGIHandler Django отправит только заголовки и завершение
+        # ответа, закрытие исходного итератора остается за
+        # response.close() после отправки
+        response.streaming_content = ()
+        read = sync_to_async(
+            lambda: list(islice(parts, settings.ASGI_STREAMING_BATCH_SIZE)),
+            thread_sensitive=True,
+        )
+
+        async def send_parts(message):
+            if (
+                message['type'] == 'http.response.body'
+                and not message.get('more_body')
+            ):
+                while True:
+                    batch = await read()
+                    if not batch:
+                        break
+                    for part in batch:
+                        for chunk, _ in self.chunk_bytes(part):
+                            await send({
+                                'type': 'http.response.body',
+                                'body': chunk,
+                                'more_body': True,
+                            })
+            await send(message)
+
+        await super().send_response(response, send_parts)
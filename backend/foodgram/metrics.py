@@ -0,0 +1,459 @@
+"""
+Измерение запросов. MetricsMiddleware для каждого запроса считает
+SQL запросы и их время, время сериализации (Serializer.data)
+и рендера ответа, отдает их в заголовке Server-Timing и копит
+гистограммы длительности по endpoint (ViewSet.action).
+Счетчики процесса раз в METRICS_FLUSH_INTERVAL сек. сохраняются
+в общий кэш, каждый воркер под своим ключом, view metrics отдает
+их сумму по воркерам в текстовом формате Prometheus
+"""
+import asyncio
+import logging
+import os
+import socket
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import monotonic, perf_counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework import serializers
+
+from .db.pool import pools
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_timings = ContextVar('request_timings', default=None)
+_instrument_lock = threading.Lock()
+_instrumented = False
+
+
+class RequestTimings:
+    """
+    время частей текущего запроса, сек.
+    """
+    __slots__ = ('queries', 'db', 'serialize', 'render', 'serializing')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.render = 0.0
+        self.serializing = False
+
+
+def sql_timer(execute, sql, params, many, context):
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.db += perf_counter() - started
+
+
+def install_sql_timer(connection, **kwargs):
+    """
+    execute_wrappers хранятся в DatabaseWrapper потока
+    и переживают переоткрытие соединения
+    """
+    if sql_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_timer)
+
+
+def timed_data(data):
+    """
+    Serializer.data с учетом времени в RequestTimings.serialize,
+    вложенные сериализаторы входят во время внешнего
+    """
+    getter = data.fget
+
+    def timed(self):
+        timings = _timings.get()
+        if timings is None or timings.serializing:
+            return getter(self)
+        timings.serializing = True
+        started = perf_counter()
+        try:
+            return getter(self)
+        finally:
+            timings.serializing = False
+            timings.serialize += perf_counter() - started
+    timed.__wrapped__ = getter
+    return property(timed, doc=data.__doc__)
+
+
+def instrument():
+    """
+    один раз на процесс: таймер SQL запросов на каждое соединение
+    (уже открытые в текущем потоке и новые), таймер Serializer.data
+    и ListSerializer.data DRF
+    """
+    global _instrumented
+    with _instrument_lock:
+        if _instrumented:
+            return
+        for connection in connections.all():
+            install_sql_timer(connection)
+        connection_created.connect(
+            install_sql_timer, dispatch_uid='foodgram.metrics'
+        )
+        for serializer_class in (
+            serializers.Serializer, serializers.ListSerializer
+        ):
+            serializer_class.data = timed_data(serializer_class.data)
+        _instrumented = True
+
+
+def render(response):
+    """
+    рендер ответа DRF с учетом времени в RequestTimings.render
+    """
+    timings = _timings.get()
+    started = perf_counter()
+    response.render()
+    if timings is not None:
+        timings.render += perf_counter() - started
+    return response
+
+
+def slot_key(slot):
+    return f'metrics:worker:{slot}'
+
+
+def endpoint_name(request):
+    """
+    ViewSet.action для DRF, имя view для остальных
+    """
+    match = request.resolver_match
+    if match is None:
+        return 'unmatched'
+    view = match.func
+    view_class = getattr(view, 'cls', None)
+    if view_class is None:
+        return match.view_name or view.__name__
+    method = request.method.lower()
+    actions = getattr(view, 'actions', None) or {}
+    return f'{view_class.__name__}.{actions.get(method, method)}'
+
+
+class Metrics:
+    """
+    Счетчики процесса по (endpoint, метод, статус): распределение
+    длительности по корзинам settings.METRICS_BUCKETS и суммы
+    длительности, SQL запросов, их времени, сериализации и рендера
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.next_flush = 0
+        self.worker = None
+        self.slot = None
+
+    def observe(self, key, duration, timings):
+        index = bisect_left(settings.METRICS_BUCKETS, duration)
+        with self.lock:
+            series = self.requests.get(key)
+            if series is None:
+                series = self.requests[key] = {
+                    'buckets': [0] * (len(settings.METRICS_BUCKETS) + 1),
+                    'duration': 0.0,
+                    'queries': 0,
+                    'db': 0.0,
+                    'serialize': 0.0,
+                    'render': 0.0,
+                }
+            series['buckets'][index] += 1
+            series['duration'] += duration
+            series['queries'] += timings.queries
+            series['db'] += timings.db
+            series['serialize'] += timings.serialize
+            series['render'] += timings.render
+
+    def snapshot(self):
+        with self.lock:
+            requests = {
+                key: {**series, 'buckets': list(series['buckets'])}
+                for key, series in self.requests.items()
+            }
+        pool_stats = {}
+        for alias, alias_pools in pools().items():
+            totals = pool_stats[alias] = {}
+            for pool in alias_pools:
+                for name, value in pool.stats().items():
+                    totals[name] = totals.get(name, 0) + value
+        return {'requests': requests, 'pools': pool_stats}
+
+    def flush(self, force=False):
+        """
+        снимок счетчиков процесса в общий кэш не чаще
+        METRICS_FLUSH_INTERVAL сек. под ключом слота воркера;
+        снимок остановленного воркера устаревает через
+        METRICS_WORKER_TIMEOUT сек., и слот освобождается
+        """
+        now = monotonic()
+        with self.lock:
+            if not force and now < self.next_flush:
+                return
+            self.next_flush = now + settings.METRICS_FLUSH_INTERVAL
+        # pid уникален только в пределах хоста (контейнера)
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        if worker != self.worker:
+            self.worker, self.slot = worker, None
+        snapshot = {**self.snapshot(), 'worker': worker}
+        try:
+            if not self.store(snapshot):
+                self.slot = self.claim(snapshot)
+        except Exception:
+            logger.warning('metrics flush failed', exc_info=True)
+
+    def store(self, snapshot):
+        """
+        снимок в слот воркера, если слот еще за ним
+        """
+        if self.slot is None:
+            return False
+        key = slot_key(self.slot)
+        current = cache.get(key)
+        if current is None:
+            return cache.add(
+                key, snapshot, settings.METRICS_WORKER_TIMEOUT
+            )
+        if current['worker'] != snapshot['worker']:
+            return False
+        cache.set(key, snapshot, settings.METRICS_WORKER_TIMEOUT)
+        return True
+
+    @staticmethod
+    def claim(snapshot):
+        """
+        первый свободный слот из METRICS_MAX_WORKERS, занимается
+        атомарно через cache.add вместе с записью снимка
+        """
+        for slot in range(settings.METRICS_MAX_WORKERS):
+            if cache.add(
+                slot_key(slot), snapshot, settings.METRICS_WORKER_TIMEOUT
+            ):
+                return slot
+        logger.warning(
+            'metrics: заняты все %s слотов воркеров',
+            settings.METRICS_MAX_WORKERS,
+        )
+        return None
+
+    def collect(self):
+        """
+        снимки живых воркеров: все слоты читаются одним get_many
+        """
+        self.flush(force=True)
+        return list(cache.get_many([
+            slot_key(slot) for slot in range(settings.METRICS_MAX_WORKERS)
+        ]).values())
+
+
+metrics = Metrics()
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """
+    Первый в MIDDLEWARE: время запроса включает остальные middleware.
+    Server-Timing (при settings.SERVER_TIMING): db - SQL запросы,
+    serialize - Serializer.data (вместе с его SQL запросами),
+    render - рендер ответа, total - весь запрос без отдачи
+    потокового тела
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        instrument()
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        started = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.finish(request, response, timings, started)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        started = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.finish(request, response, timings, started)
+
+    def process_template_response(self, request, response):
+        # последний из process_template_response: ответ рендерится
+        # здесь же, повторный response.render() Django ничего не делает
+        return render(response)
+
+    def finish(self, request, response, timings, started):
+        duration = perf_counter() - started
+        metrics.observe(
+            (endpoint_name(request), request.method, response.status_code),
+            duration,
+            timings,
+        )
+        metrics.flush()
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = (
+                f'db;dur={timings.db * 1000:.2f};'
+                f'desc="{timings.queries} queries", '
+                f'serialize;dur={timings.serialize * 1000:.2f}, '
+                f'render;dur={timings.render * 1000:.2f}, '
+                f'total;dur={duration * 1000:.2f}'
+            )
+        return response
+
+
+def label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n'
+    )
+
+
+def labels(**values):
+    return '{' + ','.join(
+        f'{name}="{label_value(value)}"' for name, value in values.items()
+    ) + '}'
+
+
+REQUEST_COUNTERS = (
+    ('queries', 'foodgram_request_db_queries_total',
+     'SQL запросов'),
+    ('db', 'foodgram_request_db_seconds_total',
+     'время SQL запросов, сек.'),
+    ('serialize', 'foodgram_request_serialize_seconds_total',
+     'время сериализации, сек.'),
+    ('render', 'foodgram_request_render_seconds_total',
+     'время рендера ответа, сек.'),
+)
+POOL_GAUGES = (
+    ('size', 'foodgram_db_pool_connections',
+     'открытых соединений пула'),
+    ('in_use', 'foodgram_db_pool_connections_in_use',
+     'выданных соединений пула'),
+)
+POOL_COUNTERS = (
+    ('checkouts', 'foodgram_db_pool_checkouts_total',
+     'выдач соединений'),
+    ('created', 'foodgram_db_pool_created_total',
+     'открытых соединений'),
+    ('timeouts', 'foodgram_db_pool_timeouts_total',
+     'выдач, не дождавшихся соединения'),
+    ('failed_checks', 'foodgram_db_pool_failed_checks_total',
+     'соединений, не прошедших проверку'),
+    ('wait_time', 'foodgram_db_pool_wait_seconds_total',
+     'ожидание соединений, сек.'),
+)
+
+
+def merge_snapshots(snapshots):
+    """
+    сумма снимков воркеров: серии запросов и статистика пулов
+    """
+    requests = {}
+    pool_stats = {}
+    for snapshot in snapshots:
+        for key, series in snapshot['requests'].items():
+            total = requests.get(key)
+            if total is None:
+                requests[key] = {**series, 'buckets': list(series['buckets'])}
+                continue
+            for name, value in series.items():
+                if name == 'buckets':
+                    total['buckets'] = [
+                        count + other for count, other in zip(
+                            total['buckets'], value
+                        )
+                    ]
+                else:
+                    total[name] += value
+        for alias, stats in snapshot['pools'].items():
+            totals = pool_stats.setdefault(alias, {})
+            for name, value in stats.items():
+                totals[name] = totals.get(name, 0) + value
+    return requests, pool_stats
+
+
+def render_durations(requests):
+    bounds = [*map(str, settings.METRICS_BUCKETS), '+Inf']
+    name = 'foodgram_request_duration_seconds'
+    lines = [
+        f'# HELP {name} длительность запроса, сек.',
+        f'# TYPE {name} histogram',
+    ]
+    for (endpoint, method, status), series in sorted(requests.items()):
+        key = dict(endpoint=endpoint, method=method, status=status)
+        cumulative = 0
+        for bound, count in zip(bounds, series['buckets']):
+            cumulative += count
+            lines.append(
+                f'{name}_bucket{labels(**key, le=bound)} {cumulative}'
+            )
+        lines.append(f'{name}_sum{labels(**key)} {series["duration"]}')
+        lines.append(f'{name}_count{labels(**key)} {cumulative}')
+    return lines
+
+
+def render_request_counters(requests):
+    lines = []
+    for field, name, description in REQUEST_COUNTERS:
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} counter')
+        for (endpoint, method, status), series in sorted(requests.items()):
+            key = labels(endpoint=endpoint, method=method, status=status)
+            lines.append(f'{name}{key} {series[field]}')
+    return lines
+
+
+def render_pools(pool_stats):
+    lines = []
+    for metric_type, fields in (('gauge', POOL_GAUGES),
+                                ('counter', POOL_COUNTERS)):
+        for field, name, description in fields:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for alias, stats in sorted(pool_stats.items()):
+                lines.append(f'{name}{labels(alias=alias)} {stats[field]}')
+    return lines
+
+
+def render_metrics(snapshots):
+    """
+    сумма снимков воркеров в текстовом формате Prometheus
+    """
+    requests, pool_stats = merge_snapshots(snapshots)
+    lines = [
+        *render_durations(requests),
+        *render_request_counters(requests),
+        *render_pools(pool_stats),
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Метрики всех воркеров для Prometheus.
+    Подключен вне /api/, через nginx не публикуется
+    """
+    return HttpResponse(
+        render_metrics(metrics.collect()), content_type=CONTENT_TYPE
+    )
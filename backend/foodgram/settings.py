@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from dotenv import load_dotenv
 
@@ -37,6 +38,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -44,10 +46,33 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'foodgram.db.router.ReadYourWritesMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
 
+# foodgram.metrics: заголовок Server-Timing в ответах (по умолчанию
+# выключен: раскрывает клиентам время и количество SQL запросов),
+# корзины гистограммы длительности запросов /metrics, сек.,
+# сохранение счетчиков воркера в общий кэш раз в
+# METRICS_FLUSH_INTERVAL сек., снимок остановленного воркера
+# не учитывается через METRICS_WORKER_TIMEOUT сек.,
+# слотов воркеров в кэше METRICS_MAX_WORKERS
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'False') == 'True'
+METRICS_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+METRICS_FLUSH_INTERVAL = 10
+METRICS_WORKER_TIMEOUT = 60
+METRICS_MAX_WORKERS = 64
+
+# асинхронные варианты загрузки изображений, списка покупок и каталога
+# (api.async_views), включаются при запуске через foodgram.asgi
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
+# потоковые ответы в режиме asgi (foodgram.handlers) перебираются
+# в потоке запроса порциями по ASGI_STREAMING_BATCH_SIZE частей
+ASGI_STREAMING_BATCH_SIZE = 500
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -66,6 +91,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
+# DB_ENGINE=foodgram.db.postgresql - PostgreSQL с пулом соединений
+# процесса (foodgram/db/pool.py), параметры в POOL, CONN_MAX_AGE
+# с пулом должен быть 0: соединение возвращается в пул после запроса.
+# Без пула CONN_MAX_AGE > 0 оставляет соединение потока открытым
 DATABASES = {
     'default': {
         'ENGINE': os.getenv('DB_ENGINE'),
@@ -73,10 +102,88 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
-        'PORT': os.getenv('DB_PORT', default='5432')
+        'PORT': os.getenv('DB_PORT', default='5432'),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default='0')),
+        'POOL': {
+            # соединений, открытых между запросами
+            'MAX_SIZE': int(os.getenv('DB_POOL_MAX_SIZE', default='10')),
+            # временных соединений сверх MAX_SIZE под нагрузкой
+            'MAX_OVERFLOW': int(
+                os.getenv('DB_POOL_MAX_OVERFLOW', default='10')
+            ),
+            # ожидание свободного соединения, сек.
+            'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', default='30')),
+            # соединение, простоявшее дольше, проверяется SELECT 1
+            'CHECK_INTERVAL': float(
+                os.getenv('DB_POOL_CHECK_INTERVAL', default='30')
+            ),
+            'MAX_LIFETIME': float(
+                os.getenv('DB_POOL_MAX_LIFETIME', default='3600')
+            ),
+        },
     }
 }
 
+# реплики только для чтения: DB_REPLICA_HOSTS - хосты через пробел
+# (host или host:port), база данных DB_REPLICA_NAME, по умолчанию
+# DB_NAME. Чтение RecipeViewSet, TagViewSet, IngredientViewSet и
+# UserViewSet идет на реплики (foodgram.db.router), клиент после
+# изменения данных читает с основной базы данных REPLICA_PIN_TIMEOUT сек.
+REPLICA_DATABASES = []
+for index, replica in enumerate(os.getenv('DB_REPLICA_HOSTS', '').split()):
+    host, _, port = replica.partition(':')
+    REPLICA_DATABASES.append(f'replica_{index}')
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['foodgram.db.router.ReplicaRouter']
+REPLICA_PIN_TIMEOUT = 10
+
+# Общий для воркеров кэш: ответы api, счетчики, метрики.
+# versions - версии данных (recipes.versions), с ними сверяются
+# индексы в памяти процессов и кэши ответов. Версии хранятся
+# отдельно и не вытесняются: FileBasedCache и LocMemCache при
+# превышении MAX_ENTRIES удаляют часть всех ключей. Для Redis
+# или Memcached VERSION_CACHE_LOCATION - отдельная база (экземпляр)
+# без вытеснения (Redis maxmemory-policy noeviction)
+CACHE_BACKEND = os.getenv(
+    'CACHE_BACKEND',
+    default='django.core.cache.backends.filebased.FileBasedCache'
+)
+# MAX_ENTRIES понимают только FileBasedCache и LocMemCache,
+# клиенты Redis и Memcached получают OPTIONS как свои параметры
+CULLING_CACHE = CACHE_BACKEND.rsplit('.', 1)[-1] in (
+    'FileBasedCache', 'LocMemCache'
+)
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            default=os.path.join(tempfile.gettempdir(), 'foodgram_cache')
+        ),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', default=10000)),
+        } if CULLING_CACHE else {},
+    },
+    'versions': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv(
+            'VERSION_CACHE_LOCATION',
+            default=os.path.join(tempfile.gettempdir(), 'foodgram_versions')
+        ),
+        'TIMEOUT': None,
+        # версий - по одному ключу на набор данных,
+        # порог недостижим и вытеснения нет
+        'OPTIONS': {'MAX_ENTRIES': 1000000} if CULLING_CACHE else {},
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -135,6 +242,11 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# файлы именуются хэшем содержимого, одинаковые хранятся один раз
+DEFAULT_FILE_STORAGE = 'recipes.storage.ContentAddressedStorage'
+# максимальный размер изображения в /api/recipes/images/,
+# совпадает с client_max_body_size nginx
+MAX_IMAGE_UPLOAD_SIZE = 20 * 1024 * 1024
 
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
@@ -161,3 +273,77 @@ MIN_LEN_INGRIDIENT_ERROR_MSG = f'введите более {MIN_LEN_INGRIDIENT_C
 MIN_LEN_RECIPE_CHARFIELD = 3
 MAX_LEN_RECIPE_CHARFIELD = 150
 MAX_LEN_RECIPE_TEXTFIELD = 3000
+
+# количество рецептов автора в ответах подписок,
+# если recipes_limit не передан или превышает максимум
+DEFAULT_RECIPES_LIMIT = 3
+MAX_RECIPES_LIMIT = 100
+
+# максимальное количество id в одном запросе массового изменения
+# избранного, списка покупок и подписок
+BULK_IDS_LIMIT = 500
+
+# максимальное количество ингредиентов в ответе поиска по имени
+INGREDIENT_SEARCH_LIMIT = 50
+
+# кэш ответов каталога тегов и ингредиентов, сек.
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+CATALOG_CACHE_MAX_AGE = 60
+
+# подсчет количества в постраничной пагинации: точный COUNT(*)
+# кэшируется на COUNT_CACHE_TIMEOUT сек., выше порога
+# используется оценка планировщика PostgreSQL
+COUNT_CACHE_TIMEOUT = 30
+COUNT_ESTIMATE_THRESHOLD = 100000
+
+# общий кэш ответов списка и страницы рецепта, сек.
+RECIPE_CACHE_TIMEOUT = 60
+RECIPE_CACHE_STALE_TIMEOUT = 30
+RECIPE_CACHE_LOCK_TIMEOUT = 5
+# паузы ожидания записи, которую вычисляет другой запрос
+RECIPE_CACHE_WAIT_MIN = 0.01
+RECIPE_CACHE_WAIT_MAX = 0.2
+
+# уменьшенные копии изображений рецептов: вариант - (ширина, высота),
+# создаются в фоне (recipes.tasks)
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'full': (1280, 1280),
+}
+IMAGE_QUALITY = 80
+
+# collect_media удаляет файлы без ссылок, не изменявшиеся дольше, сек.
+MEDIA_COLLECT_DELAY = 60 * 60
+
+# потоков пула фоновых задач процесса (recipes.tasks)
+BACKGROUND_WORKERS = 2
+
+# рейтинги /api/recipes/popular/ и /api/recipes/trending/:
+# период - время полураспада вклада события, сек.
+RECIPE_RANKING_PERIODS = {
+    'popular': 30 * 24 * 60 * 60,
+    'week': 7 * 24 * 60 * 60,
+    'day': 24 * 60 * 60,
+}
+RECIPE_RANKING_WEIGHTS = {
+    'favorite': 1.0,
+    # добавление в список покупок - намерение приготовить
+    'cart': 2.0,
+}
+RECIPE_RANKING_REBASE_AFTER = 256
+# строки с меньшим затухшим рейтингом удаляются при обновлении:
+# вклад одного добавления в избранное уходит через 2 периода
+# полураспада, из 'day' - через двое суток
+RECIPE_RANKING_MIN_SCORE = 0.25
+
+# лента /api/recipes/feed/: рецепты авторов, у которых подписчиков
+# не меньше FEED_FANOUT_MIN_SUBSCRIBERS, раскладываются по лентам
+# подписчиков заранее (команда rebuild_feeds), FEED_BACKFILL_SIZE -
+# сколько последних рецептов автора попадает в ленту при подписке
+FEED_FANOUT_MIN_SUBSCRIBERS = 1000
+FEED_BACKFILL_SIZE = 100
+FEED_FANOUT_BATCH_SIZE = 1000
+# rebuild_feeds дораскладывает рецепты, опубликованные за это время,
+# если задача раскладки потерялась при перезапуске воркера, сек.
+FEED_REPAIR_WINDOW = 24 * 60 * 60
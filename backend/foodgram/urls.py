@@ -4,8 +4,14 @@ from django.contrib import admin
 from django.urls import include, path, re_path
 from django.views.static import serve
 
+from foodgram.metrics import metrics_view
+
+from api.views import ready
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('ready/', ready),
+    path('metrics/', metrics_view),
     path('api/', include('api.urls', namespace='api')),
 ]
 
@@ -0,0 +1,22 @@
+import os
+
+# Режим запуска backend, переменная окружения GUNICORN_MODE:
+# sync - синхронные воркеры WSGI (по умолчанию),
+# gthread - воркеры WSGI с пулом потоков GUNICORN_THREADS,
+# asgi - воркеры uvicorn, foodgram.asgi с асинхронными
+# вариантами api.async_views.
+# Сравнение режимов под одинаковой нагрузкой: manage.py load_test
+MODES = {
+    'sync': ('foodgram.wsgi:application', 'sync'),
+    'gthread': ('foodgram.wsgi:application', 'gthread'),
+    'asgi': ('foodgram.asgi:application', 'uvicorn.workers.UvicornWorker'),
+}
+mode = os.getenv('GUNICORN_MODE', 'sync')
+if mode not in MODES:
+    raise ValueError(
+        f'GUNICORN_MODE: допустимые режимы {", ".join(MODES)}'
+    )
+wsgi_app, worker_class = MODES[mode]
+bind = os.getenv('GUNICORN_BIND', '0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', '1'))
+threads = int(os.getenv('GUNICORN_THREADS', '4' if mode == 'gthread' else '1'))
@@ -0,0 +1,111 @@
+import logging
+from functools import partial
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from PIL import Image, features
+
+from .tasks import submit_on_commit
+from .versions import RECIPE_CONTENT, bump_version
+
+logger = logging.getLogger(__name__)
+
+
+def variant_formats(image):
+    """
+    WebP и AVIF (если Pillow умеет его кодировать), плюс совместимый
+    формат: PNG для изображений с прозрачностью, иначе JPEG
+    """
+    formats = ['WEBP']
+    if features.check('avif'):
+        formats.append('AVIF')
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    )
+    formats.append('PNG' if has_alpha else 'JPEG')
+    return formats
+
+
+def encode(image, image_format):
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=settings.IMAGE_QUALITY)
+    return buffer.getvalue()
+
+
+def generate_variants(recipe_id, force=False):
+    """
+    Уменьшенные копии изображения рецепта (RECIPE_IMAGE_VARIANTS)
+    в форматах variant_formats. Результат пишется в
+    Recipe.image_variants: {'source': имя оригинала,
+    'thumbnail': {'webp': имя файла, ...}, ...}
+    Если за время обработки изображение заменили, результат
+    не сохраняется - новое изображение обработает своя задача.
+    Ссылки на копии предыдущего изображения освобождаются
+    """
+    from .models import Recipe, StoredFile
+    recipe = Recipe.objects.filter(pk=recipe_id).first()
+    if recipe is None or not recipe.image:
+        return
+    source = recipe.image.name
+    if not force and recipe.image_variants.get('source') == source:
+        return
+    storage = recipe.image.storage
+    variants = {'source': source}
+    with storage.open(source) as file, Image.open(file) as original:
+        original.load()
+        formats = variant_formats(original)
+        for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+            image = original.copy()
+            image.thumbnail(size)
+            variants[variant] = {}
+            for image_format in formats:
+                try:
+                    content = encode(image, image_format)
+                except (OSError, KeyError, ValueError):
+                    # кодировщик формата недоступен или не принимает
+                    # изображение: копия остается в других форматах
+                    logger.warning(
+                        'recipe %s: %s не создан', recipe_id, image_format,
+                        exc_info=True,
+                    )
+                    continue
+                name = storage.save(
+                    f'recipe_images/variants/{variant}.'
+                    f'{image_format.lower()}',
+                    ContentFile(content),
+                )
+                variants[variant][image_format.lower()] = name
+    with transaction.atomic():
+        rows = Recipe.objects.select_for_update().filter(
+            pk=recipe_id, image=source
+        )
+        previous = rows.values_list('image_variants', flat=True).first()
+        if previous is None:
+            return
+        rows.update(image_variants=variants)
+        StoredFile.objects.acquire(variant_names(variants))
+        StoredFile.objects.release(variant_names(previous))
+        transaction.on_commit(partial(bump_version, RECIPE_CONTENT))
+
+
+def variant_names(variants):
+    """
+    имена файлов копий из Recipe.image_variants
+    """
+    return [
+        name
+        for variant, sources in variants.items() if variant != 'source'
+        for name in sources.values()
+    ]
+
+
+def schedule_variants(recipe):
+    """
+    создание копий в фоне после фиксации транзакции
+    """
+    submit_on_commit(generate_variants, recipe.pk)
@@ -0,0 +1,163 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.db import DEFAULT_DB_ALIAS, DatabaseError
+
+from .versions import catalog_version
+
+_index = None
+_lock = threading.Lock()
+
+
+def normalize(value):
+    return ' '.join(value.lower().split())
+
+
+def word_offsets(key):
+    """
+    позиции начала слов в нормализованном названии, кроме первого
+    """
+    return [
+        offset for offset in range(1, len(key))
+        if key[offset - 1] == ' '
+    ]
+
+
+class IngredientIndex:
+    """
+    Компактный индекс ингредиентов в памяти процесса.
+    Данные хранятся в параллельных массивах, упорядоченных
+    по нормализованному названию: keys, ids, names, units.
+    Начала слов хранятся парами массивов word_records/word_offsets
+    (номер записи и смещение в keys), упорядоченных по суффиксу
+    названия с этой позиции - поиск по началу названия и по началу
+    слова выполняется бинарным поиском.
+    Для вхождений в середину слова названия склеены в одну строку
+    text, начала записей в ней - text_offsets.
+    Порядок выдачи: начало названия, начало слова,
+    вхождение в середину слова
+    """
+
+    def __init__(self, rows, version=None):
+        rows = sorted(rows, key=lambda row: (normalize(row[1]), row[0]))
+        self.version = version
+        self.keys = [normalize(row[1]) for row in rows]
+        self.ids = array('q', (row[0] for row in rows))
+        self.names = [row[1] for row in rows]
+        self.units = [row[2] for row in rows]
+        starts = sorted(
+            (
+                (record, offset)
+                for record, key in enumerate(self.keys)
+                for offset in word_offsets(key)
+            ),
+            key=lambda start: self.keys[start[0]][start[1]:]
+        )
+        self.word_records = array('l', (start[0] for start in starts))
+        self.word_offsets = array('l', (start[1] for start in starts))
+        self.text = '\n'.join(self.keys)
+        self.text_offsets = array('l', [0] * len(self.keys))
+        offset = 0
+        for record, key in enumerate(self.keys):
+            self.text_offsets[record] = offset
+            offset += len(key) + 1
+
+    def __len__(self):
+        return len(self.keys)
+
+    def word_suffix(self, position):
+        record = self.word_records[position]
+        return self.keys[record][self.word_offsets[position]:]
+
+    def name_matches(self, value):
+        position = bisect_left(self.keys, value)
+        while (
+            position < len(self.keys)
+            and self.keys[position].startswith(value)
+        ):
+            yield position
+            position += 1
+
+    def word_matches(self, value):
+        low, high = 0, len(self.word_records)
+        while low < high:
+            middle = (low + high) // 2
+            if self.word_suffix(middle) < value:
+                low = middle + 1
+            else:
+                high = middle
+        records = []
+        while (
+            low < len(self.word_records)
+            and self.word_suffix(low).startswith(value)
+        ):
+            records.append(self.word_records[low])
+            low += 1
+        yield from sorted(records)
+
+    def substring_matches(self, value):
+        position = self.text.find(value)
+        while position != -1:
+            record = bisect_right(self.text_offsets, position) - 1
+            yield record
+            position = self.text.find(
+                value, self.text_offsets[record] + len(self.keys[record])
+            )
+
+    def search(self, value, limit):
+        value = normalize(value)
+        found = []
+        seen = set()
+        for matches in (
+            self.name_matches(value),
+            self.word_matches(value),
+            self.substring_matches(value),
+        ):
+            for record in matches:
+                if record in seen:
+                    continue
+                if len(found) >= limit:
+                    return found
+                seen.add(record)
+                found.append({
+                    'id': self.ids[record],
+                    'name': self.names[record],
+                    'measurement_unit': self.units[record],
+                })
+        return found
+
+
+def get_index():
+    """
+    индекс текущей версии каталога, пересобирается,
+    если версия в кэше изменилась после записи Tag или Ingredient.
+    Читается основная база данных: реплика может отставать
+    от записи, сменившей версию
+    """
+    global _index
+    version = catalog_version()
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    with _lock:
+        if _index is None or _index.version != version:
+            from .models import Ingredient
+            _index = IngredientIndex(
+                Ingredient.objects.using(DEFAULT_DB_ALIAS).values_list(
+                    'id', 'name', 'measurement_unit'
+                ).order_by().iterator(),
+                version,
+            )
+        return _index
+
+
+def warm_up():
+    """
+    сборка индекса при старте воркера,
+    до применения миграций индекс соберется при первом запросе
+    """
+    try:
+        get_index()
+    except DatabaseError:
+        pass
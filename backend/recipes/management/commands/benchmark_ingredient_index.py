@@ -0,0 +1,106 @@
+import random
+import tracemalloc
+from statistics import quantiles
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.ingredient_index import IngredientIndex
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = (
+        'Индекс ингредиентов в памяти: время сборки, занимаемая память '
+        '(tracemalloc) в сравнении со строками каталога, задержка '
+        'поиска p50/p95. С --size - синтетический каталог из seed, '
+        'результаты воспроизводимы без базы данных'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size',
+            type=int,
+            help='синтетический каталог из size названий, '
+                 'по умолчанию ингредиенты из базы данных',
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=1000,
+            help='количество поисковых запросов',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='seed каталога и запросов',
+        )
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        if options['size']:
+            rows, rows_memory = self.measure(
+                lambda: self.synthetic_rows(rnd, options['size'])
+            )
+        else:
+            rows, rows_memory = self.measure(
+                lambda: list(Ingredient.objects.values_list(
+                    'id', 'name', 'measurement_unit'
+                ).order_by())
+            )
+        # время сборки без накладных расходов tracemalloc
+        started = perf_counter()
+        IngredientIndex(rows)
+        build_time = perf_counter() - started
+        index, index_memory = self.measure(lambda: IngredientIndex(rows))
+        queries = []
+        for _ in range(options['queries']):
+            word = rnd.choice(rnd.choice(rows)[1].split())
+            queries.append(word[:rnd.randint(1, min(len(word), 4))])
+        timings = []
+        for value in queries:
+            started = perf_counter()
+            index.search(value, settings.INGREDIENT_SEARCH_LIMIT)
+            timings.append((perf_counter() - started) * 1000)
+        cuts = quantiles(timings, n=100, method='inclusive')
+        self.stdout.write(f'ingredients: {len(index)}')
+        self.stdout.write(f'build, s: {build_time:.3f}')
+        self.stdout.write(f'rows memory, KiB: {rows_memory / 1024:.1f}')
+        self.stdout.write(f'index memory, KiB: {index_memory / 1024:.1f}')
+        self.stdout.write(
+            f'index bytes per ingredient: {index_memory / len(index):.0f}'
+        )
+        self.stdout.write(
+            f'search p50, ms: {cuts[49]:.3f}  p95, ms: {cuts[94]:.3f}'
+        )
+
+    @staticmethod
+    def measure(build):
+        """
+        объект и память, занятая при его сборке и не освобожденная, байт
+        """
+        tracemalloc.start()
+        try:
+            result = build()
+            memory = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        return result, memory
+
+    @staticmethod
+    def synthetic_rows(rnd, size):
+        """
+        названия из 1-3 слов кириллицей, как в каталоге
+        """
+        letters = 'абвгдежзиклмнопрстуфхцчшщэюя'
+        units = ('г', 'кг', 'мл', 'л', 'шт.', 'по вкусу')
+        rows = []
+        for pk in range(1, size + 1):
+            words = (
+                ''.join(rnd.choices(letters, k=rnd.randint(3, 10)))
+                for _ in range(rnd.randint(1, 3))
+            )
+            rows.append((pk, ' '.join(words), rnd.choice(units)))
+        return rows
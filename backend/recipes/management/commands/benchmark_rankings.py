@@ -0,0 +1,226 @@
+import random
+from datetime import timedelta
+from statistics import median, quantiles
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from recipes.models import Recipe, RecipeEvent, RecipeRanking
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Время обновления рейтингов RecipeRanking на синтетических '
+        'данных: обработка накопленной очереди --events событий по '
+        '--recipes рецептам за --days дней (холодный старт), затем '
+        'нескольких порций по --increment событий поверх заполненной '
+        'таблицы, prune и чтение страницы рейтинга. Все данные '
+        'создаются в транзакции и откатываются'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--events',
+            type=int,
+            default=1000000,
+            help='событий в очереди при холодном старте',
+        )
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=10000,
+            help='количество синтетических рецептов',
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='события распределены по последним days дням',
+        )
+        parser.add_argument(
+            '--removals',
+            type=float,
+            default=0.1,
+            help='доля удалений из избранного и списков покупок',
+        )
+        parser.add_argument(
+            '--increment',
+            type=int,
+            default=10000,
+            help='событий в одной порции инкрементального обновления',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='порций инкрементального обновления и чтений',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='событий в одной транзакции refresh',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='seed синтетических событий',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(random.Random(options['seed']), options)
+                raise Rollback
+        except Rollback:
+            self.stdout.write('синтетические данные удалены (rollback)')
+
+    def run(self, rnd, options):
+        recipe_ids = self.create_recipes(options['recipes'])
+        now = timezone.now()
+        started = perf_counter()
+        self.create_events(
+            rnd, recipe_ids, options['events'], options, now
+        )
+        self.stdout.write(
+            f'events: {options["events"]}, recipes: {len(recipe_ids)}, '
+            f'insert, s: {perf_counter() - started:.2f}'
+        )
+        self.stdout.write(
+            f'{"":<12}{"events":>9}{"total, s":>10}{"events/s":>10}'
+            f'{"batch p50, ms":>15}{"batch p95, ms":>15}'
+        )
+        self.report('cold', *self.refresh(options['batch_size']))
+        totals, timings = [], []
+        for _ in range(options['repeat']):
+            self.create_events(
+                rnd, recipe_ids, options['increment'],
+                {**options, 'days': 0}, timezone.now(),
+            )
+            processed, elapsed, batches = self.refresh(
+                options['batch_size']
+            )
+            totals.append(elapsed)
+            timings.extend(batches)
+        self.report(
+            'incremental', options['increment'], median(totals), timings
+        )
+        started = perf_counter()
+        pruned = RecipeRanking.objects.prune()
+        self.stdout.write(
+            f'prune, ms: {(perf_counter() - started) * 1000:.2f}, '
+            f'deleted: {pruned}, '
+            f'rows: {RecipeRanking.objects.count()}'
+        )
+        self.report_reads(options['repeat'])
+
+    def create_recipes(self, count):
+        """
+        рецепты без сигналов: счетчики, изображения и ленты
+        синтетических рецептов не нужны
+        """
+        author = User.objects.create(
+            username='benchmark_rankings',
+            email='benchmark_rankings@example.com',
+        )
+        recipes = Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author=author,
+                    name=f'benchmark ranking {number}',
+                    text='benchmark',
+                    cooking_time=10,
+                    image='recipe_images/benchmark.png',
+                )
+                for number in range(count)
+            ),
+            batch_size=10000,
+        )
+        return [recipe.pk for recipe in recipes]
+
+    @staticmethod
+    def create_events(rnd, recipe_ids, count, options, now):
+        """
+        популярность рецептов по закону Ципфа, удаление взвешивается
+        временем добавления, как в recipes.signals.count_links
+        """
+        weights = [1 / rank for rank in range(1, len(recipe_ids) + 1)]
+        seconds = options['days'] * 24 * 60 * 60
+        kinds = (RecipeEvent.FAVORITE, RecipeEvent.CART)
+        for start in range(0, count, 10000):
+            size = min(10000, count - start)
+            RecipeEvent.objects.bulk_create(
+                RecipeEvent(
+                    recipe_id=recipe_id,
+                    kind=rnd.choice(kinds),
+                    delta=-1 if rnd.random() < options['removals'] else 1,
+                    created=now - timedelta(
+                        seconds=rnd.uniform(0, seconds)
+                    ),
+                )
+                for recipe_id in rnd.choices(
+                    recipe_ids, weights=weights, k=size
+                )
+            )
+
+    @staticmethod
+    def refresh(batch_size):
+        """
+        количество событий, общее время и время каждой
+        порции refresh, мс
+        """
+        processed, batches = 0, []
+        started = perf_counter()
+        while True:
+            batch_started = perf_counter()
+            refreshed = RecipeRanking.objects.refresh(batch_size)
+            if not refreshed:
+                break
+            batches.append((perf_counter() - batch_started) * 1000)
+            processed += refreshed
+        return processed, perf_counter() - started, batches
+
+    def report(self, label, processed, elapsed, batches):
+        cuts = (
+            quantiles(batches, n=100, method='inclusive')
+            if len(batches) > 1 else batches * 99
+        )
+        rate = processed / elapsed if elapsed else 0
+        self.stdout.write(
+            f'{label:<12}{processed:>9}{elapsed:>10.2f}{rate:>10.0f}'
+            f'{cuts[49]:>15.1f}{cuts[94]:>15.1f}'
+        )
+
+    def report_reads(self, repeat):
+        """
+        первая страница каждого рейтинга, как в ranked_response
+        """
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE recipes_reciperanking')
+        for period in RecipeRanking.objects.values_list(
+            'period', flat=True
+        ).distinct():
+            queryset = Recipe.objects.filter(
+                rankings__period=period, rankings__score__gt=0
+            ).order_by('-rankings__score', '-id').values_list(
+                'pk', flat=True
+            )[:6]
+            timings = []
+            for _ in range(repeat):
+                started = perf_counter()
+                list(queryset.all())
+                timings.append((perf_counter() - started) * 1000)
+            self.stdout.write(
+                f'read {period}, ms: {median(timings):.2f}'
+            )
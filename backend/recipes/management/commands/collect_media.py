@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from recipes.models import StoredFile
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет файлы хранилища без ссылок (StoredFile.references = 0), '
+        'не изменявшиеся дольше MEDIA_COLLECT_DELAY сек.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='только показать файлы, ничего не удаляя',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(
+            seconds=settings.MEDIA_COLLECT_DELAY
+        )
+        names = StoredFile.objects.filter(
+            references__lte=0, updated__lt=cutoff
+        ).values_list('name', flat=True)
+        deleted = 0
+        for name in list(names.iterator()):
+            with transaction.atomic():
+                # ссылка могла появиться после выборки
+                stored = StoredFile.objects.select_for_update().filter(
+                    name=name, references__lte=0
+                ).first()
+                if stored is None:
+                    continue
+                if default_storage.exists(name) and (
+                    default_storage.get_modified_time(name) >= cutoff
+                ):
+                    # файл только что записан повторно
+                    continue
+                self.stdout.write(name)
+                if options['dry_run']:
+                    continue
+                default_storage.delete(name)
+                stored.delete()
+                deleted += 1
+        self.stdout.write(self.style.SUCCESS(f'Удалено файлов: {deleted}'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import CounterDelta
+
+
+class Command(BaseCommand):
+    help = (
+        'Применяет отложенные изменения счетчиков CounterDelta '
+        'пачками, запускается периодически (сервис counters '
+        'в infra/docker-compose.yml)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='количество изменений в одной транзакции',
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            flushed = CounterDelta.objects.flush(options['batch_size'])
+            if not flushed:
+                break
+            total += flushed
+        self.stdout.write(self.style.SUCCESS(
+            f'Применено изменений счетчиков: {total}'
+        ))
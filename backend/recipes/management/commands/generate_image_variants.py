@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import generate_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Создает уменьшенные копии изображений рецептов, для которых '
+        'их нет или они устарели (например, задача фонового пула '
+        'потерялась при перезапуске). С --force пересоздает все'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='пересоздать копии для всех рецептов',
+        )
+
+    def handle(self, *args, **options):
+        processed = 0
+        for recipe_id, image, variants in Recipe.objects.values_list(
+            'id', 'image', 'image_variants'
+        ).order_by('id').iterator():
+            if not image or (
+                not options['force'] and variants.get('source') == image
+            ):
+                continue
+            generate_variants(recipe_id, force=options['force'])
+            processed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {processed}'
+        ))
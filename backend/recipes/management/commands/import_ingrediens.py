@@ -1,43 +1,218 @@
+import csv
 import json
 import os
+import re
+import time
+from itertools import islice
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
-from recipes.models import Ingredient
+from recipes.models import Ingredient, normalize_ingredient
+from recipes.versions import bump_catalog_version
 
-data = os.path.dirname(
-    os.path.dirname(os.path.dirname(os.path.abspath("data")))
-)
+READ_CHUNK_SIZE = 64 * 1024
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+FORMATS = ('json', 'csv')
 
 
-class Command(BaseCommand):
-    def handle(self, *args, **options):
-        Ingredient.objects.all().delete()
-        with open(
-            f"{data}/foodgram-project-react/data/ingredients.json",
-            "r"
-        ) as j:
-            data_dict = json.loads(j.read())
-            print('всего записей', )
-            count = 0
+class JSONArrayReader:
+    """
+    Потоковое чтение JSON массива [значение, значение, ...]:
+    файл читается кусками READ_CHUNK_SIZE, в памяти только текущий
+    кусок. Разбор строгий: массив открывается "[", значения
+    разделяются ровно одной запятой, после "]" допустимы только
+    пробельные символы
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.decoder = json.JSONDecoder()
+        self.buffer, self.position, self.eof = '', 0, False
+        self.number = 0
+
+    def read_more(self):
+        """
+        следующий кусок файла в буфер, False в конце файла
+        """
+        if self.eof:
+            return False
+        chunk = self.file.read(READ_CHUNK_SIZE)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return not self.eof
+
+    def next_char(self):
+        """
+        следующий символ после пробельных, '' в конце файла
+        """
+        while True:
+            self.position = WHITESPACE.match(
+                self.buffer, self.position
+            ).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.read_more():
+                return ''
+
+    def error(self, expected):
+        return CommandError(
+            f'Некорректный JSON после записи {self.number}: '
+            f'ожидается {expected}'
+        )
+
+    def decode(self):
+        """
+        значение целиком: число на границе куска дочитывается
+        """
+        char = self.next_char()
+        if char in ('', ',', ']'):
+            raise self.error('значение')
+        while True:
             try:
-                for record in data_dict:
-                    count += 1
-                    name = record.get("name")
-                    measurement_unit = record.get("measurement_unit")
-                    try:
-                        Ingredient.objects.get_or_create(
-                            name=name,
-                            measurement_unit=measurement_unit
-                        )
-                    except Exception as error:
-                        print('Ошибка импорта', record, error)
-
-                print(
-                    f"Загрузка ингредиентов завершена! "
-                    f"Загружено товаров: "
-                    f"{Ingredient.objects.all().count()}"
+                value, end = self.decoder.raw_decode(
+                    self.buffer, self.position
                 )
-            except Exception as error:
-                print("Что-то не так с моделями, путями или базой данных "
-                      f"проверьте, ошибка: {error}")
+            except json.JSONDecodeError:
+                if not self.read_more():
+                    raise self.error('значение')
+                continue
+            if end < len(self.buffer) or not self.read_more():
+                self.position = end
+                return value
+
+    def __iter__(self):
+        if self.next_char() != '[':
+            raise self.error('"["')
+        self.position += 1
+        if self.next_char() == ']':
+            self.position += 1
+        else:
+            while True:
+                yield self.decode()
+                self.number += 1
+                char = self.next_char()
+                if char not in (',', ']'):
+                    raise self.error('"," или "]"')
+                self.position += 1
+                if char == ']':
+                    break
+        if self.next_char():
+            raise self.error('конец файла')
+
+
+def read_json(file):
+    """
+    записи JSON массива [{"name": ..., "measurement_unit": ...}, ...]
+    """
+    for number, record in enumerate(JSONArrayReader(file), 1):
+        if not isinstance(record, dict):
+            raise CommandError(
+                f'Запись {number}: ожидается объект '
+                f'{{"name": ..., "measurement_unit": ...}}, '
+                f'получено {type(record).__name__}'
+            )
+        yield record.get('name'), record.get('measurement_unit')
+
+
+def read_csv(file):
+    """
+    строки name,measurement_unit, заголовок необязателен
+    """
+    for row in csv.reader(file):
+        if len(row) < 2 or row[:2] == ['name', 'measurement_unit']:
+            continue
+        yield row[0], row[1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Загрузка ингредиентов из JSON или CSV файла. '
+        'Существующие ингредиенты не удаляются и не дублируются'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='путь к файлу ингредиентов')
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='формат файла, по умолчанию по расширению',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='количество записей в одном INSERT',
+        )
+
+    def clean(self, records):
+        """
+        проверка записей: строки допустимой длины,
+        название и единица измерения нормализуются как в Ingredient.save
+        """
+        for name, measurement_unit in records:
+            if not isinstance(name, str) or not isinstance(
+                measurement_unit, str
+            ):
+                self.skipped += 1
+                continue
+            name, measurement_unit = normalize_ingredient(
+                name, measurement_unit
+            )
+            if not (
+                settings.MIN_LEN_INGRIDIENT_CHARFIELD <= len(name)
+                <= settings.MAX_LEN_INGRIDIENT_CHARFIELD
+            ) or not (
+                1 <= len(measurement_unit)
+                <= settings.MAX_LEN_INGRIDIENT_CHARFIELD
+            ):
+                self.skipped += 1
+                continue
+            yield Ingredient(name=name, measurement_unit=measurement_unit)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(
+            path
+        )[1].lstrip('.').lower()
+        if file_format not in FORMATS:
+            raise CommandError(
+                f'Неизвестный формат "{file_format}", укажите --format'
+            )
+        if not os.path.isfile(path):
+            raise CommandError(f'Файл {path} не найден')
+        readers = {'json': read_json, 'csv': read_csv}
+        processed = self.skipped = 0
+        started = time.monotonic()
+        with open(path, encoding='utf-8', newline='') as file:
+            ingredients = self.clean(readers[file_format](file))
+            with transaction.atomic():
+                # существующие ингредиенты и повторы в файле отбрасывает
+                # ограничение уникальности ingredient_with_unit,
+                # добавленные строки - разница количества в транзакции
+                count_before = Ingredient.objects.count()
+                while True:
+                    batch = list(islice(ingredients, options['batch_size']))
+                    if not batch:
+                        break
+                    Ingredient.objects.bulk_create(
+                        batch, ignore_conflicts=True
+                    )
+                    processed += len(batch)
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(
+                        f'обработано записей: {processed}, '
+                        f'{processed / elapsed:.0f} в сек.'
+                    )
+                loaded = Ingredient.objects.count() - count_before
+                if loaded:
+                    transaction.on_commit(bump_catalog_version)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Загрузка ингредиентов завершена за {elapsed:.1f} сек. '
+            f'Новых: {loaded}, '
+            f'уже были или повторяются в файле: {processed - loaded}, '
+            f'пропущено некорректных: {self.skipped}'
+        ))
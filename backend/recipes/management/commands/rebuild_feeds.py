@@ -0,0 +1,65 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.models import FanoutAuthor, FeedEntry
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Назначает авторов FanoutAuthor, чьи рецепты раскладываются '
+        'по лентам подписчиков: от FEED_FANOUT_MIN_SUBSCRIBERS '
+        'подписчиков, снимается ниже половины порога. Повторно '
+        'раскладывает рецепты назначенных авторов за --window сек., '
+        'задачи раскладки которых потерялись при перезапуске воркера. '
+        'Запускается периодически (cron) чаще, чем раз в --window'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='заново разложить рецепты всех назначенных авторов',
+        )
+        parser.add_argument(
+            '--window',
+            type=int,
+            default=settings.FEED_REPAIR_WINDOW,
+            help='проверять рецепты, опубликованные за window сек.',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        threshold = settings.FEED_FANOUT_MIN_SUBSCRIBERS
+        current = set(
+            FanoutAuthor.objects.values_list('author_id', flat=True)
+        )
+        enabled = set(User.objects.filter(
+            subscribers_count__gte=threshold
+        ).values_list('id', flat=True))
+        # между половиной порога и порогом автор остается как есть
+        disabled = set(User.objects.filter(
+            id__in=current, subscribers_count__lt=threshold // 2
+        ).values_list('id', flat=True))
+        added = enabled - current
+        for author_id in disabled:
+            FeedEntry.objects.disable_fanout(author_id)
+        for author_id in (
+            enabled | current if options['rebuild'] else added
+        ) - disabled:
+            FeedEntry.objects.enable_fanout(author_id)
+        repaired = FeedEntry.objects.repair(
+            timezone.now() - timedelta(seconds=options['window'])
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Ленты обновлены за {time.monotonic() - started:.2f} сек. '
+            f'Назначено авторов: {len(added)}, снято: {len(disabled)}, '
+            f'всего: {len(current | added) - len(disabled)}, '
+            f'разложено повторно рецептов: {repaired}'
+        ))
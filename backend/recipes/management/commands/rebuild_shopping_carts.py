@@ -0,0 +1,62 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShoppingCartIngredient
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересобирает агрегат списков покупок ShoppingCartIngredient '
+        'по корзинам пользователей: пачками по --batch-size '
+        'пользователей под блокировкой их строк, изменяются только '
+        'расходящиеся строки. С --check только сверяет агрегат '
+        'и завершается с ошибкой при расхождениях'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='только проверить, ничего не изменяя',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='пользователей в одной транзакции пересборки',
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            self.check_aggregates()
+            return
+        user_ids = list(User.objects.order_by('pk').values_list(
+            'pk', flat=True
+        ))
+        fixed = 0
+        for start in range(0, len(user_ids), options['batch_size']):
+            fixed += ShoppingCartIngredient.objects.rebuild(
+                user_ids[start:start + options['batch_size']]
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок пересобраны, исправлено строк: {fixed}'
+        ))
+
+    def check_aggregates(self):
+        expected = ShoppingCartIngredient.objects.expected()
+        actual = ShoppingCartIngredient.objects.actual()
+        mismatches = sorted(
+            key for key in expected.keys() | actual.keys()
+            if expected.get(key) != actual.get(key)
+        )
+        for user_id, ingredient_id in mismatches:
+            self.stdout.write(
+                f'user {user_id}, ingredient {ingredient_id}: '
+                f'ожидается {expected.get((user_id, ingredient_id), 0)}, '
+                f'в агрегате {actual.get((user_id, ingredient_id), 0)}'
+            )
+        if mismatches:
+            raise CommandError(f'Расхождений: {len(mismatches)}')
+        self.stdout.write(self.style.SUCCESS('Списки покупок согласованы'))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import COUNTERS, CounterDelta
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет денормализованные счетчики Recipe и User с таблицами '
+        'связей и исправляет расхождения. Отложенные изменения '
+        'применяются заранее. С --check только сверяет и завершается '
+        'с ошибкой при расхождениях'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='только проверить, ничего не изменяя',
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            self.check_counters()
+            return
+        while CounterDelta.objects.flush(1000):
+            pass
+        for counter in COUNTERS:
+            fixed = CounterDelta.objects.reconcile(counter)
+            self.stdout.write(f'{counter}: исправлено {fixed}')
+        self.stdout.write(self.style.SUCCESS('Счетчики согласованы'))
+
+    def check_counters(self):
+        pending = CounterDelta.objects.count()
+        if pending:
+            self.stdout.write(f'отложенных изменений: {pending}')
+        mismatches = 0
+        for counter in COUNTERS:
+            model, field, *_ = COUNTERS[counter]
+            for pk, actual, expected in CounterDelta.objects.mismatches(
+                counter
+            ).values_list('pk', field, 'expected').iterator():
+                mismatches += 1
+                self.stdout.write(
+                    f'{counter} {pk}: ожидается {expected}, '
+                    f'в счетчике {actual}'
+                )
+        if mismatches:
+            raise CommandError(f'Расхождений: {mismatches}')
+        self.stdout.write(self.style.SUCCESS('Счетчики согласованы'))
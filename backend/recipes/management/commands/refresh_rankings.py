@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import RecipeEvent, RecipeRanking
+
+
+class Command(BaseCommand):
+    help = (
+        'Обновляет рейтинги рецептов RecipeRanking по накопленным '
+        'событиям избранного и списков покупок, запускается '
+        'периодически (cron). Выводит время работы и скорость обработки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='количество событий в одной транзакции',
+        )
+
+    def handle(self, *args, **options):
+        pending = RecipeEvent.objects.count()
+        started = time.monotonic()
+        processed = 0
+        while True:
+            batch_started = time.monotonic()
+            refreshed = RecipeRanking.objects.refresh(options['batch_size'])
+            if not refreshed:
+                break
+            processed += refreshed
+            self.stdout.write(
+                f'событий: {refreshed}, '
+                f'{time.monotonic() - batch_started:.2f} сек.'
+            )
+        pruned = RecipeRanking.objects.prune()
+        elapsed = time.monotonic() - started
+        rate = processed / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Рейтинги обновлены за {elapsed:.2f} сек., '
+            f'событий: {processed} из {pending}, {rate:.0f} в сек., '
+            f'удалено затухших: {pruned}'
+        ))
@@ -0,0 +1,53 @@
+# Generated by Django 4.0 on 2026-10-18 12:30
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+FORWARD_SQL = (
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_trgm '
+    'ON recipes_ingredient USING gin (UPPER(name) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_search_vector '
+    'ON recipes_ingredient USING gin (search_vector)',
+    'DROP TRIGGER IF EXISTS recipes_ingredient_search_vector_update '
+    'ON recipes_ingredient',
+    'CREATE TRIGGER recipes_ingredient_search_vector_update '
+    'BEFORE INSERT OR UPDATE OF name ON recipes_ingredient '
+    'FOR EACH ROW EXECUTE PROCEDURE '
+    "tsvector_update_trigger(search_vector, 'pg_catalog.simple', name)",
+    "UPDATE recipes_ingredient "
+    "SET search_vector = to_tsvector('pg_catalog.simple', name)",
+)
+
+REVERSE_SQL = (
+    'DROP TRIGGER IF EXISTS recipes_ingredient_search_vector_update '
+    'ON recipes_ingredient',
+    'DROP INDEX IF EXISTS recipes_ingredient_search_vector',
+    'DROP INDEX IF EXISTS recipes_ingredient_name_trgm',
+)
+
+
+def run_postgres_sql(statements):
+    """
+    индексы и триггер только для PostgreSQL,
+    в остальных СУБД поиск работает без них
+    """
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_shoppingcartingredient'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(
+            run_postgres_sql(FORWARD_SQL), run_postgres_sql(REVERSE_SQL)
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.0 on 2026-10-18 12:00
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def count_references(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    StoredFile = apps.get_model('recipes', 'StoredFile')
+    counts = Counter()
+    for image, variants in Recipe.objects.values_list(
+        'image', 'image_variants'
+    ).iterator():
+        counts[image] += 1
+        for variant, sources in variants.items():
+            if variant != 'source':
+                counts.update(sources.values())
+    StoredFile.objects.bulk_create(
+        (
+            StoredFile(name=name, references=references)
+            for name, references in counts.items() if name
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Имя файла')),
+                ('references', models.IntegerField(default=0, verbose_name='Количество ссылок')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Изменен')),
+            ],
+            options={
+                'verbose_name': 'Файл',
+                'verbose_name_plural': 'Файлы',
+            },
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
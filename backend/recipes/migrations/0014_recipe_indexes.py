@@ -0,0 +1,41 @@
+# Generated by Django 4.0 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+# таблицы связей ManyToManyField создаются Django, индексы по
+# (user_id, recipe_id) для избранного и списка покупок пользователя
+# добавляются SQL: уникальный индекс (recipe_id, user_id) не подходит
+# для поиска по пользователю, индекс только по user_id не покрывающий
+THROUGH_INDEXES = (
+    ('recipes_recipe_favorite', 'recipe_favorite_user_recipe_idx'),
+    ('recipes_recipe_cart', 'recipe_cart_user_recipe_idx'),
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_storedfile'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub_date', '-id'], name='recipe_pub_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date'], name='recipe_author_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ingredientamount',
+            index=models.Index(fields=['ingredients', 'recipe'], name='ingredient_amount_recipe_idx'),
+        ),
+        *(
+            migrations.RunSQL(
+                f'CREATE INDEX {name} ON {table} (user_id, recipe_id)',
+                f'DROP INDEX {name}',
+            )
+            for table, name in THROUGH_INDEXES
+        ),
+    ]
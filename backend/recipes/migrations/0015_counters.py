@@ -0,0 +1,72 @@
+# Generated by Django 4.0 on 2026-10-18 12:00
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_related(related, related_field):
+    return Coalesce(
+        Subquery(
+            related.objects.filter(
+                **{related_field: OuterRef('pk')}
+            ).order_by().values(related_field).annotate(
+                total=Count('*')
+            ).values('total')
+        ),
+        0,
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    User = apps.get_model('users', 'User')
+    Recipe.objects.update(
+        favorites_count=count_related(Recipe.favorite.through, 'recipe_id'),
+        carts_count=count_related(Recipe.cart.through, 'recipe_id'),
+    )
+    User.objects.update(
+        subscribers_count=count_related(
+            User.subscribe.through, 'to_user_id'
+        ),
+        recipes_count=count_related(Recipe, 'author_id'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_user_counters'),
+        ('recipes', '0014_recipe_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='carts_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date', '-id'], name='recipe_favorites_count_idx'),
+        ),
+        migrations.CreateModel(
+            name='CounterDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('counter', models.CharField(choices=[('recipe_favorites', 'recipe_favorites'), ('recipe_carts', 'recipe_carts'), ('user_subscribers', 'user_subscribers'), ('user_recipes', 'user_recipes')], max_length=32, verbose_name='Счетчик')),
+                ('object_id', models.BigIntegerField(verbose_name='id объекта')),
+                ('delta', models.IntegerField(verbose_name='Изменение')),
+            ],
+            options={
+                'verbose_name': 'Изменение счетчика',
+                'verbose_name_plural': 'Изменения счетчиков',
+            },
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
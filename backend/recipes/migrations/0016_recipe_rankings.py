@@ -0,0 +1,61 @@
+# Generated by Django 4.0 on 2026-10-18 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankingState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(max_length=16, unique=True, verbose_name='Период')),
+                ('epoch', models.DateTimeField(verbose_name='Эпоха')),
+            ],
+            options={
+                'verbose_name': 'Эпоха рейтинга',
+                'verbose_name_plural': 'Эпохи рейтингов',
+            },
+        ),
+        migrations.CreateModel(
+            name='RecipeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('favorite', 'Избранное'), ('cart', 'Список покупок')], max_length=16, verbose_name='Событие')),
+                ('delta', models.IntegerField(verbose_name='Изменение')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Время')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='recipes.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Событие рецепта',
+                'verbose_name_plural': 'События рецептов',
+            },
+        ),
+        migrations.CreateModel(
+            name='RecipeRanking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(max_length=16, verbose_name='Период')),
+                ('score', models.FloatField(default=0, verbose_name='Рейтинг')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rankings', to='recipes.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Рейтинг рецепта',
+                'verbose_name_plural': 'Рейтинги рецептов',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='reciperanking',
+            index=models.Index(fields=['period', '-score', 'recipe'], name='recipe_ranking_score_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='reciperanking',
+            constraint=models.UniqueConstraint(fields=('recipe', 'period'), name='unique_recipe_ranking_period'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.0 on 2026-10-18 19:00
+
+from django.db import migrations
+
+# поиск по name обслуживает recipes.ingredient_index,
+# индексы и триггер миграции 0011 только замедляют запись
+FORWARD_SQL = (
+    'DROP TRIGGER IF EXISTS recipes_ingredient_search_vector_update '
+    'ON recipes_ingredient',
+    'DROP INDEX IF EXISTS recipes_ingredient_search_vector',
+    'DROP INDEX IF EXISTS recipes_ingredient_name_trgm',
+)
+
+REVERSE_SQL = (
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_trgm '
+    'ON recipes_ingredient USING gin (UPPER(name) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_search_vector '
+    'ON recipes_ingredient USING gin (search_vector)',
+    'CREATE TRIGGER recipes_ingredient_search_vector_update '
+    'BEFORE INSERT OR UPDATE OF name ON recipes_ingredient '
+    'FOR EACH ROW EXECUTE PROCEDURE '
+    "tsvector_update_trigger(search_vector, 'pg_catalog.simple', name)",
+    "UPDATE recipes_ingredient "
+    "SET search_vector = to_tsvector('pg_catalog.simple', name)",
+)
+
+
+def run_postgres_sql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0017_feed'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_postgres_sql(FORWARD_SQL), run_postgres_sql(REVERSE_SQL)
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.0 on 2026-10-18 21:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    индекс (ingredients, recipe) повторяет индекс внешнего ключа
+    ingredients: рецепты с ингредиентом находятся по нему,
+    ингредиенты рецепта - по unique_ingridient_for_recipe
+    """
+
+    dependencies = [
+        ('recipes', '0018_drop_ingredient_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ingredientamount',
+            name='ingredient_amount_recipe_idx',
+        ),
+    ]
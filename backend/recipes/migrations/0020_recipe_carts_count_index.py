@@ -0,0 +1,17 @@
+# Generated by Django 4.0 on 2026-10-18 21:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0019_drop_ingredient_amount_recipe_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-carts_count', '-pub_date', '-id'], name='recipe_carts_count_idx'),
+        ),
+    ]
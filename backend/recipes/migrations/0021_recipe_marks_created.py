@@ -0,0 +1,80 @@
+# Generated by Django 4.0 on 2026-10-18 22:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_model(name, db_table, verbose_name, verbose_name_plural):
+    """
+    модель для таблицы, созданной Django для ManyToManyField
+    """
+    return migrations.CreateModel(
+        name=name,
+        fields=[
+            ('id', models.AutoField(primary_key=True, serialize=False, verbose_name='ID')),
+            ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='recipes.recipe', verbose_name='Рецепт')),
+            ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+        ],
+        options={
+            'verbose_name': verbose_name,
+            'verbose_name_plural': verbose_name_plural,
+            'db_table': db_table,
+            'abstract': False,
+            'unique_together': {('recipe', 'user')},
+        },
+    )
+
+
+class Migration(migrations.Migration):
+    """
+    избранное и списки покупок получают время добавления: удаление
+    вычитает из рейтингов вклад, затухший с момента добавления.
+    Существующим связям присваивается время миграции
+    """
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0020_recipe_carts_count_index'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                mark_model(
+                    'Favorite', 'recipes_recipe_favorite',
+                    'Избранный рецепт', 'Избранные рецепты',
+                ),
+                mark_model(
+                    'Cart', 'recipes_recipe_cart',
+                    'Рецепт в списке покупок', 'Рецепты в списках покупок',
+                ),
+                migrations.AlterField(
+                    model_name='recipe',
+                    name='favorite',
+                    field=models.ManyToManyField(related_name='favorites', through='recipes.Favorite', to=settings.AUTH_USER_MODEL, verbose_name='Избранные рецепты'),
+                ),
+                migrations.AlterField(
+                    model_name='recipe',
+                    name='cart',
+                    field=models.ManyToManyField(related_name='carts', through='recipes.Cart', to=settings.AUTH_USER_MODEL, verbose_name='Список покупок'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Добавлен'),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Добавлен'),
+        ),
+        migrations.AlterField(
+            model_name='recipeevent',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.0 on 2026-10-18 23:00
+
+from django.db import migrations
+
+# search_vector заполнял триггер миграции 0011, удаленный в 0018:
+# поиск по name обслуживает recipes.ingredient_index
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0021_recipe_marks_created'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='ingredient',
+            name='search_vector',
+        ),
+    ]
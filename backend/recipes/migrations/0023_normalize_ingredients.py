@@ -0,0 +1,40 @@
+# Generated by Django 4.0 on 2026-10-18 23:30
+
+from django.db import migrations
+
+
+def normalize_ingredients(apps, schema_editor):
+    """
+    Ingredient.save хранит название и единицу измерения
+    нормализованными, import_ingrediens сравнивает записи
+    по ограничению уникальности. Строки, нормализованный вариант
+    которых уже есть, остаются как есть: на них ссылаются рецепты
+    """
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    for pk, name, measurement_unit in Ingredient.objects.values_list(
+        'pk', 'name', 'measurement_unit'
+    ).iterator():
+        # как recipes.models.normalize_ingredient
+        normalized = ' '.join(name.split()), measurement_unit.strip()
+        if normalized == (name, measurement_unit):
+            continue
+        name, measurement_unit = normalized
+        if not Ingredient.objects.filter(
+            name=name, measurement_unit=measurement_unit
+        ).exists():
+            Ingredient.objects.filter(pk=pk).update(
+                name=name, measurement_unit=measurement_unit
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0022_remove_ingredient_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            normalize_ingredients, migrations.RunPython.noop
+        ),
+    ]
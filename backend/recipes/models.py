@@ -1,26 +1,47 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
 from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth import get_user_model
-from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import (MaxValueValidator, MinLengthValidator,
                                     MinValueValidator, RegexValidator,
                                     validate_slug,)
-from django.db.models import (CASCADE, CharField, DateTimeField, ForeignKey,
-                              ImageField, ManyToManyField, Model,
-                              PositiveSmallIntegerField, TextField,
-                              UniqueConstraint,)
+from django.db import transaction
+from django.db.models import (CASCADE, AutoField, BigIntegerField,
+                              BooleanField, Case, CharField, Count,
+                              DateTimeField, Exists, F, FloatField, ForeignKey,
+                              ImageField, Index, IntegerField, JSONField,
+                              ManyToManyField, Model, OneToOneField, OuterRef,
+                              PositiveSmallIntegerField, Prefetch, QuerySet,
+                              Subquery, Sum, TextField, UniqueConstraint,
+                              Value, When,)
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 
+from .versions import bump_version, rows_version
+from users.models import CounterFieldsMixin
+
 User = get_user_model()
 
 
+def normalize_ingredient(name, measurement_unit):
+    """
+    пробелы в названии схлопываются, по краям единицы
+    измерения отбрасываются
+    """
+    return ' '.join(name.split()), measurement_unit.strip()
+
+
 class Ingredient(Model):
     """
     Модель интгридиентов - ингредиенты добавляются администратором
     через admin панель. Обязательная проверка на уникальность
     сочетания name и measurement_unit
-    search_vector - вспомогательное поле для поиска ингредиента
     """
     name = CharField(
         verbose_name='Ингредиент',
@@ -41,7 +62,6 @@ class Ingredient(Model):
             )
         ]
     )
-    search_vector = SearchVectorField(null=True)
 
     class Meta:
         verbose_name = 'Ингредиент'
@@ -57,6 +77,14 @@ class Ingredient(Model):
     def __str__(self) -> str:
         return f'{self.name} {self.measurement_unit}'
 
+    def save(self, *args, **kwargs):
+        # хранятся нормализованные значения: повторы отбрасывает
+        # ограничение ingredient_with_unit, на нем основан импорт
+        self.name, self.measurement_unit = normalize_ingredient(
+            self.name, self.measurement_unit
+        )
+        super().save(*args, **kwargs)
+
 
 class Tag(Model):
     """
@@ -126,7 +154,55 @@ class Tag(Model):
         return f'{self.name} (цвет: {self.color})'
 
 
-class Recipe(Model):
+class RecipeQuerySet(QuerySet):
+    """
+    Выборка рецептов для чтения через api.
+    with_user_flags - флаги избранного, списка покупок и подписки
+    на автора вычисляются в одном запросе через Exists(),
+    теги и ингредиенты подгружаются пачкой через prefetch_related,
+    количество запросов не зависит от размера страницы
+    """
+
+    def with_user_flags(self, user):
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+                author_is_subscribed=Value(
+                    False, output_field=BooleanField()
+                ),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Recipe.favorite.through.objects.filter(
+                    recipe=OuterRef('pk'), user=user
+                )
+            ),
+            is_in_shopping_cart=Exists(
+                Recipe.cart.through.objects.filter(
+                    recipe=OuterRef('pk'), user=user
+                )
+            ),
+            author_is_subscribed=Exists(
+                User.subscribe.through.objects.filter(
+                    from_user=user, to_user=OuterRef('author')
+                )
+            ),
+        )
+
+    def for_read(self, user):
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredient_amount',
+                queryset=IngredientAmount.objects.select_related(
+                    'ingredients'
+                ),
+            ),
+        ).with_user_flags(user)
+
+
+class Recipe(CounterFieldsMixin, Model):
     name = CharField(
         verbose_name='Название блюда',
         max_length=settings.MAX_LEN_RECIPE_CHARFIELD,
@@ -154,6 +230,7 @@ class Recipe(Model):
         verbose_name='Избранные рецепты',
         related_name='favorites',
         to=User,
+        through='recipes.Favorite',
     )
     tags = ManyToManyField(
         verbose_name='Теги',
@@ -170,6 +247,7 @@ class Recipe(Model):
         verbose_name='Список покупок',
         related_name='carts',
         to=User,
+        through='recipes.Cart',
     )
     pub_date = DateTimeField(
         verbose_name='Дата публикации',
@@ -179,6 +257,12 @@ class Recipe(Model):
         verbose_name='Изображение блюда',
         upload_to='recipe_images/',
     )
+    image_variants = JSONField(
+        verbose_name='Уменьшенные копии изображения',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     text = TextField(
         verbose_name='Описание блюда',
         max_length=settings.MAX_LEN_RECIPE_TEXTFIELD,
@@ -205,10 +289,44 @@ class Recipe(Model):
         ),
     )
 
+    # счетчики поддерживает CounterDeltaQuerySet
+    favorites_count = IntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+    )
+    carts_count = IntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False,
+    )
+
+    COUNTER_FIELDS = ('favorites_count', 'carts_count')
+
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date', )
+        indexes = (
+            # лента и keyset пагинация: ORDER BY pub_date DESC, id DESC
+            Index(fields=('-pub_date', '-id'), name='recipe_pub_date_id_idx'),
+            # рецепты автора: фильтр author, последние рецепты в подписках
+            Index(
+                fields=('author', '-pub_date'),
+                name='recipe_author_pub_date_idx',
+            ),
+            # сортировка по популярности
+            Index(
+                fields=('-favorites_count', '-pub_date', '-id'),
+                name='recipe_favorites_count_idx',
+            ),
+            Index(
+                fields=('-carts_count', '-pub_date', '-id'),
+                name='recipe_carts_count_idx',
+            ),
+        )
         constraints = (
             UniqueConstraint(
                 fields=('name', 'author'),
@@ -270,3 +388,965 @@ class IngredientAmount(Model):
 
     def __str__(self) -> str:
         return f'{self.ingredients}'
+
+
+_maintained_recipes = ContextVar('maintained_recipes', default=frozenset())
+
+
+class RecipeMark(Model):
+    """
+    Рецепт в избранном или списке покупок пользователя.
+    created - время добавления: удаление связи вычитает из рейтинга
+    RecipeRanking вклад, затухший с этого же момента
+    """
+    # таблицы созданы Django для ManyToManyField без through
+    id = AutoField(primary_key=True, verbose_name='ID')
+    recipe = ForeignKey(
+        verbose_name='Рецепт',
+        related_name='+',
+        to=Recipe,
+        on_delete=CASCADE,
+    )
+    user = ForeignKey(
+        verbose_name='Пользователь',
+        related_name='+',
+        to=User,
+        on_delete=CASCADE,
+    )
+    created = DateTimeField(
+        verbose_name='Добавлен',
+        default=timezone.now,
+    )
+
+    class Meta:
+        abstract = True
+        unique_together = (('recipe', 'user'),)
+
+    def __str__(self) -> str:
+        return f'{self.user_id}: {self.recipe_id}'
+
+
+class Favorite(RecipeMark):
+
+    class Meta(RecipeMark.Meta):
+        db_table = 'recipes_recipe_favorite'
+        verbose_name = 'Избранный рецепт'
+        verbose_name_plural = 'Избранные рецепты'
+
+
+class Cart(RecipeMark):
+
+    class Meta(RecipeMark.Meta):
+        db_table = 'recipes_recipe_cart'
+        verbose_name = 'Рецепт в списке покупок'
+        verbose_name_plural = 'Рецепты в списках покупок'
+
+
+class ShoppingCartQuerySet(QuerySet):
+    """
+    Поддержка агрегата списка покупок ShoppingCartIngredient.
+    Изменения корзины и ингредиентов рецепта применяются как разница
+    количеств только к затронутым строкам. Конкурентные изменения
+    сериализуются блокировкой строки рецепта, затем строк пользователей
+    (всегда в этом порядке, без взаимных блокировок).
+    Методы вызываются внутри transaction.atomic().
+    Сохранение и удаление отдельных строк IngredientAmount (админка,
+    каскадное удаление рецепта, автора или ингредиента) применяются
+    сигналами через change_amounts, кроме рецептов внутри maintained()
+    """
+
+    def recipe_amounts(self, recipe):
+        """
+        блокирует рецепт и возвращает {ingredient_id: amount}
+        """
+        Recipe.objects.select_for_update().get(pk=recipe.pk)
+        return dict(
+            IngredientAmount.objects.filter(
+                recipe=recipe
+            ).values_list('ingredients_id', 'amount')
+        )
+
+    def apply(self, user_ids, deltas):
+        """
+        прибавляет deltas {ingredient_id: amount} к спискам покупок
+        пользователей user_ids, строки с нулевым итогом удаляются
+        """
+        deltas = {pk: delta for pk, delta in deltas.items() if delta}
+        if not user_ids or not deltas:
+            return
+        rows = self.filter(user_id__in=user_ids, ingredient_id__in=deltas)
+        existing = set(rows.values_list('user_id', 'ingredient_id'))
+        rows.update(
+            amount=F('amount') + Case(
+                *(
+                    When(ingredient_id=pk, then=Value(delta))
+                    for pk, delta in deltas.items()
+                ),
+                output_field=IntegerField(),
+            )
+        )
+        self.bulk_create(
+            self.model(user_id=user_id, ingredient_id=pk, amount=delta)
+            for user_id in user_ids
+            for pk, delta in deltas.items()
+            if delta > 0 and (user_id, pk) not in existing
+        )
+        rows.filter(amount__lte=0).delete()
+
+    def add_recipe(self, user, recipe):
+        self.add_recipes(user, (recipe.pk,))
+
+    def remove_recipe(self, user, recipe):
+        self.remove_recipes(user, (recipe.pk,))
+
+    def lock_recipes(self, user, recipe_ids):
+        """
+        блокирует рецепты recipe_ids (по порядку pk) и пользователя,
+        возвращает id найденных рецептов и рецептов в корзине
+        """
+        found = set(
+            Recipe.objects.select_for_update().filter(
+                pk__in=recipe_ids
+            ).order_by('pk').values_list('pk', flat=True)
+        )
+        User.objects.select_for_update().get(pk=user.pk)
+        in_cart = set(
+            user.carts.filter(pk__in=found).values_list('pk', flat=True)
+        )
+        return found, in_cart
+
+    def total_amounts(self, recipe_ids):
+        """
+        {ingredient_id: amount} по всем рецептам recipe_ids
+        """
+        if not recipe_ids:
+            return {}
+        return dict(
+            IngredientAmount.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values('ingredients_id').annotate(
+                total=Sum('amount')
+            ).order_by().values_list('ingredients_id', 'total')
+        )
+
+    def add_recipes(self, user, recipe_ids):
+        """
+        рецепты в корзину одним INSERT, возвращает id найденных
+        и добавленных рецептов
+        """
+        with transaction.atomic():
+            found, in_cart = self.lock_recipes(user, recipe_ids)
+            added = found - in_cart
+            if added:
+                user.carts.add(*added)
+                self.apply((user.pk,), self.total_amounts(added))
+            return found, added
+
+    def remove_recipes(self, user, recipe_ids):
+        """
+        рецепты из корзины одним DELETE, возвращает id найденных
+        и удаленных рецептов
+        """
+        with transaction.atomic():
+            found, removed = self.lock_recipes(user, recipe_ids)
+            if removed:
+                user.carts.remove(*removed)
+                self.apply((user.pk,), {
+                    pk: -amount
+                    for pk, amount in self.total_amounts(removed).items()
+                })
+            return found, removed
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        """
+        ингредиенты рецепта изменены: разница применяется ко всем
+        спискам покупок, в которых есть рецепт.
+        old_amounts получены через recipe_amounts() в той же транзакции
+        """
+        deltas = {
+            pk: new_amounts.get(pk, 0) - old_amounts.get(pk, 0)
+            for pk in old_amounts.keys() | new_amounts.keys()
+        }
+        user_ids = list(
+            User.objects.select_for_update().filter(
+                carts=recipe
+            ).order_by('pk').values_list('pk', flat=True)
+        )
+        self.apply(user_ids, deltas)
+
+    @contextmanager
+    def maintained(self, recipe_id):
+        """
+        изменения ингредиентов рецепта применяет вызывающий код
+        одним change_recipe, сигналы строк IngredientAmount их пропускают
+        """
+        token = _maintained_recipes.set(
+            _maintained_recipes.get() | {recipe_id}
+        )
+        try:
+            yield
+        finally:
+            _maintained_recipes.reset(token)
+
+    def change_amounts(self, recipe_id, old_amounts, new_amounts):
+        """
+        изменение строк IngredientAmount рецепта вне maintained():
+        блокировка рецепта и разница всем спискам покупок с ним
+        """
+        if recipe_id in _maintained_recipes.get():
+            return
+        with transaction.atomic():
+            # блокировка рецепта, как в recipe_amounts
+            list(Recipe.objects.select_for_update().filter(
+                pk=recipe_id
+            ).values_list('pk', flat=True))
+            self.change_recipe(recipe_id, old_amounts, new_amounts)
+
+    def expected(self, user_ids=None):
+        """
+        итоги, посчитанные заново по корзинам пользователей
+        (всех или user_ids) {(user_id, ingredient_id): amount}
+        """
+        # одно условие на связь корзины: второй filter() по
+        # многозначной связи добавил бы второй JOIN
+        amounts = IngredientAmount.objects.filter(
+            recipe__cart__isnull=False
+        ) if user_ids is None else IngredientAmount.objects.filter(
+            recipe__cart__in=user_ids
+        )
+        return {
+            (row['user'], row['ingredient']): row['total']
+            for row in amounts.values(
+                user=F('recipe__cart'), ingredient=F('ingredients')
+            ).annotate(total=Sum('amount')).order_by()
+        }
+
+    def actual(self, user_ids=None):
+        """
+        строки агрегата {(user_id, ingredient_id): amount}
+        """
+        rows = self if user_ids is None else self.filter(
+            user_id__in=user_ids
+        )
+        return {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in rows.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            ).iterator()
+        }
+
+    def rebuild(self, user_ids):
+        """
+        Приводит агрегат пользователей user_ids к пересчитанным
+        итогам, изменяя только расходящиеся строки. Пользователи
+        блокируются (по порядку pk) до чтения итогов: все изменения
+        агрегата держат блокировку пользователя до фиксации, поэтому
+        итоги не устаревают до записи. Возвращает количество
+        исправленных строк
+        """
+        with transaction.atomic():
+            user_ids = list(
+                User.objects.select_for_update().filter(
+                    pk__in=user_ids
+                ).order_by('pk').values_list('pk', flat=True)
+            )
+            expected = self.expected(user_ids)
+            actual = self.actual(user_ids)
+            stale = actual.keys() - expected.keys()
+            missing = expected.keys() - actual.keys()
+            changed = {
+                key: amount for key, amount in expected.items()
+                if key in actual and actual[key] != amount
+            }
+            for (user_id, ingredient_id) in stale:
+                self.filter(
+                    user_id=user_id, ingredient_id=ingredient_id
+                ).delete()
+            for (user_id, ingredient_id), amount in changed.items():
+                self.filter(
+                    user_id=user_id, ingredient_id=ingredient_id
+                ).update(amount=amount)
+            self.bulk_create(
+                self.model(
+                    user_id=user_id,
+                    ingredient_id=ingredient_id,
+                    amount=expected[user_id, ingredient_id],
+                )
+                for user_id, ingredient_id in missing
+            )
+        return len(stale) + len(changed) + len(missing)
+
+
+class ShoppingCartIngredient(Model):
+    """
+    Материализованный список покупок: итоговое количество
+    ингредиента по всем рецептам в корзине пользователя.
+    Поддерживается ShoppingCartQuerySet, пересобирается
+    командой rebuild_shopping_carts
+    """
+    user = ForeignKey(
+        verbose_name='Пользователь',
+        related_name='shopping_cart_ingredients',
+        to=User,
+        on_delete=CASCADE,
+    )
+    ingredient = ForeignKey(
+        verbose_name='Ингредиент',
+        related_name='shopping_cart_ingredients',
+        to=Ingredient,
+        on_delete=CASCADE,
+    )
+    amount = IntegerField(
+        verbose_name='Количество',
+        default=0,
+    )
+
+    objects = ShoppingCartQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Ингредиент списка покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = (
+            UniqueConstraint(
+                fields=('user', 'ingredient', ),
+                name='unique_ingredient_in_shopping_cart',
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.ingredient}: {self.amount}'
+
+
+class StoredFileQuerySet(QuerySet):
+    """
+    Счетчики ссылок на файлы ContentAddressedStorage.
+    Одно имя в names - одна ссылка, повторы считаются
+    """
+
+    def register(self, names):
+        """
+        учет новых файлов без ссылок, например загруженных,
+        но еще не привязанных к рецепту
+        """
+        self.bulk_create(
+            (self.model(name=name) for name in set(names) if name),
+            ignore_conflicts=True,
+        )
+
+    def acquire(self, names):
+        counts = Counter(name for name in names if name)
+        self.register(counts)
+        self.change(counts)
+
+    def release(self, names):
+        counts = Counter(name for name in names if name)
+        self.change({name: -count for name, count in counts.items()})
+
+    def change(self, counts):
+        """
+        одно UPDATE на каждое различное изменение количества ссылок
+        """
+        names_by_count = {}
+        for name, count in counts.items():
+            if count:
+                names_by_count.setdefault(count, []).append(name)
+        now = timezone.now()
+        for count, names in names_by_count.items():
+            self.filter(name__in=sorted(names)).update(
+                references=F('references') + count, updated=now,
+            )
+
+
+class StoredFile(Model):
+    """
+    Файл ContentAddressedStorage и количество ссылок на него
+    из Recipe.image и Recipe.image_variants.
+    Файлы без ссылок удаляет команда collect_media
+    """
+    name = CharField(
+        verbose_name='Имя файла',
+        max_length=255,
+        unique=True,
+    )
+    references = IntegerField(
+        verbose_name='Количество ссылок',
+        default=0,
+    )
+    updated = DateTimeField(
+        verbose_name='Изменен',
+        auto_now=True,
+    )
+
+    objects = StoredFileQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
+
+    def __str__(self) -> str:
+        return f'{self.name}: {self.references}'
+
+
+class CounterDeltaQuerySet(QuerySet):
+    """
+    Денормализованные счетчики Recipe и User (COUNTERS).
+    add() меняет счетчик сразу F() выражением, если строка не
+    заблокирована другой транзакцией; для заблокированных строк
+    (популярный рецепт, который сейчас добавляют в избранное многие)
+    изменение записывается в CounterDelta без ожидания блокировки
+    и применяется пачкой flush() (команда flush_counters).
+    reconcile() пересчитывает счетчики по таблицам связей
+    (команда reconcile_counters)
+    """
+
+    def add(self, counter, deltas):
+        """
+        deltas {pk: изменение} для счетчика counter
+        """
+        model, field, *_ = COUNTERS[counter]
+        deltas = {pk: delta for pk, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        with transaction.atomic():
+            locked = set(
+                model.objects.select_for_update(skip_locked=True).filter(
+                    pk__in=deltas
+                ).values_list('pk', flat=True)
+            )
+            self.apply(model, field, {pk: deltas[pk] for pk in locked})
+            self.bulk_create(
+                self.model(counter=counter, object_id=pk, delta=delta)
+                for pk, delta in deltas.items() if pk not in locked
+            )
+
+    @staticmethod
+    def apply(model, field, deltas):
+        if deltas:
+            model.objects.filter(pk__in=deltas).update(**{
+                field: F(field) + Case(
+                    *(
+                        When(pk=pk, then=Value(delta))
+                        for pk, delta in deltas.items()
+                    ),
+                    output_field=IntegerField(),
+                )
+            })
+
+    def flush(self, batch_size):
+        """
+        применяет до batch_size отложенных изменений,
+        возвращает количество примененных записей
+        """
+        with transaction.atomic():
+            rows = list(
+                self.select_for_update(skip_locked=True).order_by(
+                    'id'
+                ).values_list('id', 'counter', 'object_id', 'delta')[
+                    :batch_size
+                ]
+            )
+            totals = {}
+            for _, counter, object_id, delta in rows:
+                deltas = totals.setdefault(counter, Counter())
+                deltas[object_id] += delta
+            for counter, deltas in totals.items():
+                model, field, *_ = COUNTERS[counter]
+                self.apply(model, field, deltas)
+            self.filter(id__in=[row[0] for row in rows]).delete()
+        return len(rows)
+
+    @staticmethod
+    def expected(counter):
+        """
+        подсчет по таблице связей для OuterRef('pk') объекта
+        """
+        _, _, related, related_field = COUNTERS[counter]
+        return Coalesce(
+            Subquery(
+                related.objects.filter(
+                    **{related_field: OuterRef('pk')}
+                ).order_by().values(related_field).annotate(
+                    total=Count('*')
+                ).values('total')
+            ),
+            0,
+        )
+
+    def mismatches(self, counter):
+        """
+        объекты, у которых счетчик отличается от подсчета
+        по таблице связей, с аннотацией expected
+        """
+        model, field, *_ = COUNTERS[counter]
+        return model.objects.annotate(
+            expected=self.expected(counter)
+        ).exclude(**{field: F('expected')})
+
+    def reconcile(self, counter):
+        """
+        исправляет расхождения, возвращает количество исправленных
+        объектов. Вызывается после flush() всех отложенных изменений
+        """
+        model, field, *_ = COUNTERS[counter]
+        with transaction.atomic():
+            pks = list(self.mismatches(counter).values_list('pk', flat=True))
+            model.objects.filter(pk__in=pks).update(
+                **{field: self.expected(counter)}
+            )
+        return len(pks)
+
+
+# счетчик: (модель, поле, модель связи, поле связи с объектом)
+COUNTERS = {
+    'recipe_favorites': (
+        Recipe, 'favorites_count', Recipe.favorite.through, 'recipe_id'
+    ),
+    'recipe_carts': (
+        Recipe, 'carts_count', Recipe.cart.through, 'recipe_id'
+    ),
+    'user_subscribers': (
+        User, 'subscribers_count', User.subscribe.through, 'to_user_id'
+    ),
+    'user_recipes': (
+        User, 'recipes_count', Recipe, 'author_id'
+    ),
+}
+
+
+class CounterDelta(Model):
+    """
+    отложенное изменение счетчика из COUNTERS,
+    применяется командой flush_counters
+    """
+    counter = CharField(
+        verbose_name='Счетчик',
+        max_length=32,
+        choices=[(counter, counter) for counter in COUNTERS],
+    )
+    object_id = BigIntegerField(
+        verbose_name='id объекта',
+    )
+    delta = IntegerField(
+        verbose_name='Изменение',
+    )
+
+    objects = CounterDeltaQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Изменение счетчика'
+        verbose_name_plural = 'Изменения счетчиков'
+
+    def __str__(self) -> str:
+        return f'{self.counter} {self.object_id}: {self.delta}'
+
+
+class RecipeEvent(Model):
+    """
+    Очередь событий избранного и списков покупок для рейтингов
+    RecipeRanking, обрабатывается и очищается командой
+    refresh_rankings
+    """
+    FAVORITE = 'favorite'
+    CART = 'cart'
+    KINDS = (
+        (FAVORITE, 'Избранное'),
+        (CART, 'Список покупок'),
+    )
+    recipe = ForeignKey(
+        verbose_name='Рецепт',
+        related_name='events',
+        to=Recipe,
+        on_delete=CASCADE,
+    )
+    kind = CharField(
+        verbose_name='Событие',
+        max_length=16,
+        choices=KINDS,
+    )
+    delta = IntegerField(
+        verbose_name='Изменение',
+    )
+    # для удаления из избранного или списка покупок - время добавления
+    created = DateTimeField(
+        verbose_name='Время',
+        default=timezone.now,
+    )
+
+    class Meta:
+        verbose_name = 'Событие рецепта'
+        verbose_name_plural = 'События рецептов'
+
+    def __str__(self) -> str:
+        return f'{self.recipe_id} {self.kind}: {self.delta}'
+
+
+class RecipeRankingQuerySet(QuerySet):
+    """
+    Рейтинги рецептов с экспоненциальным затуханием: вклад события
+    weight * delta уменьшается вдвое каждые half_life секунд
+    (RECIPE_RANKING_PERIODS, RECIPE_RANKING_WEIGHTS).
+    Чтобы не пересчитывать все строки при каждом обновлении,
+    score хранится приведенным к эпохе периода RankingState.epoch:
+    вклад события weight * delta * 2 ** ((created - epoch) / half_life).
+    Порядок строк при этом совпадает с порядком затухших значений.
+    Удаление связи взвешивается временем ее добавления и вычитает
+    ровно затухший вклад добавления; рейтинг не опускается ниже нуля
+    (связи, добавленные до появления событий, в нем не учтены).
+    prune() после обработки событий удаляет строки с затухшим
+    рейтингом меньше RECIPE_RANKING_MIN_SCORE, так рецепты без новых
+    событий уходят из коротких периодов. Когда показатель степени
+    становится большим, все строки периода приводятся к новой
+    эпохе (rebase)
+    """
+
+    def refresh(self, batch_size):
+        """
+        обрабатывает до batch_size событий RecipeEvent
+        и удаляет их, возвращает количество событий
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            events = list(
+                RecipeEvent.objects.select_for_update(
+                    skip_locked=True
+                ).order_by('id').values_list(
+                    'id', 'recipe_id', 'kind', 'delta', 'created'
+                )[:batch_size]
+            )
+            if not events:
+                return 0
+            for period, half_life in settings.RECIPE_RANKING_PERIODS.items():
+                epoch = self.period_epoch(period, half_life, now)
+                scores = Counter()
+                for _, recipe_id, kind, delta, created in events:
+                    scores[recipe_id] += (
+                        settings.RECIPE_RANKING_WEIGHTS[kind] * delta
+                        * 2 ** ((created - epoch).total_seconds() / half_life)
+                    )
+                self.apply(period, scores)
+            RecipeEvent.objects.filter(
+                id__in=[event[0] for event in events]
+            ).delete()
+            # кэшированные COUNT(*) выборок по рейтингу устарели
+            transaction.on_commit(partial(
+                bump_version, rows_version(Recipe._meta.label_lower)
+            ))
+        return len(events)
+
+    def period_epoch(self, period, half_life, now):
+        """
+        эпоха периода, при необходимости rebase
+        """
+        state, _ = RankingState.objects.select_for_update().get_or_create(
+            period=period, defaults={'epoch': now}
+        )
+        half_lives = (now - state.epoch).total_seconds() / half_life
+        if half_lives > settings.RECIPE_RANKING_REBASE_AFTER:
+            self.prune_period(period, half_life, state.epoch, now)
+            self.filter(period=period).update(
+                score=F('score') * 2 ** -half_lives
+            )
+            state.epoch = now
+            state.save(update_fields=('epoch',))
+        return state.epoch
+
+    def prune(self):
+        """
+        удаляет строки всех периодов, затухший рейтинг которых
+        меньше RECIPE_RANKING_MIN_SCORE, возвращает их количество
+        """
+        now = timezone.now()
+        epochs = dict(RankingState.objects.values_list('period', 'epoch'))
+        deleted = sum(
+            self.prune_period(period, half_life, epochs[period], now)
+            for period, half_life in settings.RECIPE_RANKING_PERIODS.items()
+            if period in epochs
+        )
+        if deleted:
+            bump_version(rows_version(Recipe._meta.label_lower))
+        return deleted
+
+    def prune_period(self, period, half_life, epoch, now):
+        half_lives = (now - epoch).total_seconds() / half_life
+        deleted, _ = self.filter(
+            period=period,
+            score__lt=settings.RECIPE_RANKING_MIN_SCORE * 2 ** half_lives,
+        ).delete()
+        return deleted
+
+    def apply(self, period, scores):
+        scores = {pk: score for pk, score in scores.items() if score}
+        if not scores:
+            return
+        rows = self.filter(period=period, recipe_id__in=scores)
+        existing = set(rows.values_list('recipe_id', flat=True))
+        rows.update(score=Greatest(
+            F('score') + Case(
+                *(
+                    When(recipe_id=pk, then=Value(score))
+                    for pk, score in scores.items()
+                ),
+                output_field=FloatField(),
+            ),
+            Value(0.0),
+        ))
+        self.bulk_create(
+            (
+                self.model(recipe_id=pk, period=period, score=score)
+                for pk, score in scores.items()
+                if pk not in existing and score > 0
+            ),
+            ignore_conflicts=True,
+        )
+
+
+class RecipeRanking(Model):
+    """
+    рейтинг рецепта за период RECIPE_RANKING_PERIODS,
+    поддерживается командой refresh_rankings
+    """
+    recipe = ForeignKey(
+        verbose_name='Рецепт',
+        related_name='rankings',
+        to=Recipe,
+        on_delete=CASCADE,
+    )
+    period = CharField(
+        verbose_name='Период',
+        max_length=16,
+    )
+    score = FloatField(
+        verbose_name='Рейтинг',
+        default=0,
+    )
+
+    objects = RecipeRankingQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        indexes = (
+            Index(
+                fields=('period', '-score', 'recipe'),
+                name='recipe_ranking_score_idx',
+            ),
+        )
+        constraints = (
+            UniqueConstraint(
+                fields=('recipe', 'period'),
+                name='unique_recipe_ranking_period',
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.recipe_id} {self.period}: {self.score}'
+
+
+class RankingState(Model):
+    """
+    эпоха, к которой приведены рейтинги периода
+    """
+    period = CharField(
+        verbose_name='Период',
+        max_length=16,
+        unique=True,
+    )
+    epoch = DateTimeField(
+        verbose_name='Эпоха',
+    )
+
+    class Meta:
+        verbose_name = 'Эпоха рейтинга'
+        verbose_name_plural = 'Эпохи рейтингов'
+
+    def __str__(self) -> str:
+        return f'{self.period}: {self.epoch}'
+
+
+class FanoutAuthor(Model):
+    """
+    Автор, рецепты которого раскладываются по лентам подписчиков
+    FeedEntry при публикации (много подписчиков). Назначается
+    командой rebuild_feeds по User.subscribers_count
+    """
+    author = OneToOneField(
+        verbose_name='Автор',
+        related_name='fanout',
+        to=User,
+        on_delete=CASCADE,
+    )
+
+    class Meta:
+        verbose_name = 'Автор с рассылкой в ленты'
+        verbose_name_plural = 'Авторы с рассылкой в ленты'
+
+    def __str__(self) -> str:
+        return f'{self.author_id}'
+
+
+class FeedEntryQuerySet(QuerySet):
+    """
+    Лента рецептов подписок пользователя, гибридная схема:
+    рецепты большинства авторов выбираются при чтении по индексу
+    (author, -pub_date), рецепты авторов FanoutAuthor заранее
+    раскладываются в FeedEntry подписчиков при публикации,
+    подписке и назначении автора
+    """
+
+    def feed(self, user):
+        """
+        ветви ленты пользователя: рецепты авторов, читаемых при
+        запросе, по индексу (author, -pub_date) и разложенные
+        в FeedEntry. RecipeCursorPagination.paginate_union ограничивает
+        каждую ветвь страницей и объединяет их UNION
+        """
+        subscriptions = User.subscribe.through.objects.filter(
+            from_user_id=user.pk
+        )
+        recipes = Recipe.objects.for_read(user)
+        return (
+            recipes.filter(author__in=subscriptions.exclude(
+                to_user__fanout__isnull=False
+            ).values('to_user_id')),
+            recipes.filter(feed_entries__user=user),
+        )
+
+    def add_entries(self, entries):
+        self.bulk_create(
+            (
+                self.model(user_id=user_id, recipe_id=recipe_id)
+                for user_id, recipe_id in entries
+            ),
+            batch_size=settings.FEED_FANOUT_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+    def fanout_recipe(self, recipe_id):
+        """
+        новый рецепт автора FanoutAuthor в ленты всех подписчиков
+        """
+        recipe = Recipe.objects.filter(
+            pk=recipe_id, author__fanout__isnull=False
+        ).values_list('author_id', flat=True).first()
+        if recipe is None:
+            return
+        self.add_entries(
+            (user_id, recipe_id)
+            for user_id in User.subscribe.through.objects.filter(
+                to_user_id=recipe
+            ).values_list('from_user_id', flat=True).iterator(
+                chunk_size=settings.FEED_FANOUT_BATCH_SIZE
+            )
+        )
+
+    def repair(self, since):
+        """
+        рецепты авторов FanoutAuthor, опубликованные после since,
+        записей ленты которых меньше, чем подписок на автора:
+        задача fanout_recipe не выполнилась. Возвращает количество
+        разложенных повторно рецептов
+        """
+        entries = self.filter(recipe_id=OuterRef('pk')).order_by().values(
+            'recipe_id'
+        ).annotate(total=Count('*')).values('total')
+        subscribers = User.subscribe.through.objects.filter(
+            to_user_id=OuterRef('author_id')
+        ).order_by().values('to_user_id').annotate(
+            total=Count('*')
+        ).values('total')
+        recipe_ids = list(
+            Recipe.objects.filter(
+                author__fanout__isnull=False, pub_date__gte=since
+            ).annotate(
+                entries=Coalesce(Subquery(entries), 0),
+                subscribers=Coalesce(Subquery(subscribers), 0),
+            ).filter(entries__lt=F('subscribers')).values_list(
+                'pk', flat=True
+            )
+        )
+        for recipe_id in recipe_ids:
+            self.fanout_recipe(recipe_id)
+        return len(recipe_ids)
+
+    def follow(self, user_id, author_ids):
+        """
+        подписка: последние FEED_BACKFILL_SIZE рецептов
+        авторов FanoutAuthor в ленту пользователя, для всех
+        авторов одним запросом с коррелированным подзапросом
+        """
+        latest_recipes = Recipe.objects.filter(
+            author=OuterRef('author')
+        ).order_by('-pub_date').values('pk')[:settings.FEED_BACKFILL_SIZE]
+        self.add_entries(
+            (user_id, recipe_id)
+            for recipe_id in Recipe.objects.filter(
+                author_id__in=author_ids,
+                author__fanout__isnull=False,
+                pk__in=Subquery(latest_recipes),
+            ).values_list('id', flat=True)
+        )
+
+    def unfollow(self, user_id, author_ids):
+        self.filter(
+            user_id=user_id, recipe__author_id__in=author_ids
+        ).delete()
+
+    def enable_fanout(self, author_id):
+        """
+        назначение автора: его последние рецепты
+        в ленты всех подписчиков
+        """
+        with transaction.atomic():
+            FanoutAuthor.objects.get_or_create(author_id=author_id)
+            recipe_ids = list(
+                Recipe.objects.filter(author_id=author_id).order_by(
+                    '-pub_date'
+                ).values_list('id', flat=True)[:settings.FEED_BACKFILL_SIZE]
+            )
+            self.add_entries(
+                (user_id, recipe_id)
+                for user_id in User.subscribe.through.objects.filter(
+                    to_user_id=author_id
+                ).values_list('from_user_id', flat=True).iterator(
+                    chunk_size=settings.FEED_FANOUT_BATCH_SIZE
+                )
+                for recipe_id in recipe_ids
+            )
+
+    def disable_fanout(self, author_id):
+        with transaction.atomic():
+            FanoutAuthor.objects.filter(author_id=author_id).delete()
+            self.filter(recipe__author_id=author_id).delete()
+
+
+class FeedEntry(Model):
+    """
+    рецепт автора FanoutAuthor в ленте подписчика
+    """
+    user = ForeignKey(
+        verbose_name='Подписчик',
+        related_name='feed_entries',
+        to=User,
+        on_delete=CASCADE,
+    )
+    recipe = ForeignKey(
+        verbose_name='Рецепт',
+        related_name='feed_entries',
+        to=Recipe,
+        on_delete=CASCADE,
+    )
+
+    objects = FeedEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = (
+            UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_entry',
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.user_id}: {self.recipe_id}'
@@ -0,0 +1,325 @@
+from collections import Counter
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import DEFERRED
+from django.db.models.signals import (m2m_changed, post_delete, post_init,
+                                      post_save, pre_delete, pre_save,)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .images import schedule_variants, variant_names
+from .models import (CounterDelta, FeedEntry, Ingredient, IngredientAmount,
+                     Recipe, RecipeEvent, ShoppingCartIngredient, StoredFile,
+                     Tag,)
+from .tasks import submit_on_commit
+from .versions import (RECIPE_CONTENT, bump_catalog_version, bump_version,
+                       relations_version, rows_version,)
+
+User = get_user_model()
+
+RECIPE_ROWS = rows_version(Recipe._meta.label_lower)
+
+
+# счетчик, поле связи с объектом счетчика, второе поле связи и
+# объявлено ли m2m поле на модели объекта счетчика: recipe.favorite,
+# recipe.cart, но user.subscribe со стороны подписчика
+M2M_COUNTERS = {
+    Recipe.favorite.through: (
+        'recipe_favorites', 'recipe_id', 'user_id', True
+    ),
+    Recipe.cart.through: ('recipe_carts', 'recipe_id', 'user_id', True),
+    User.subscribe.through: (
+        'user_subscribers', 'to_user_id', 'from_user_id', False
+    ),
+}
+RANKED_COUNTERS = {
+    'recipe_favorites': RecipeEvent.FAVORITE,
+    'recipe_carts': RecipeEvent.CART,
+}
+
+
+def bump_versions(*names):
+    for name in names:
+        transaction.on_commit(partial(bump_version, name))
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver((post_save, post_delete), sender=Tag)
+def catalog_changed(**kwargs):
+    """
+    индексы и кэш ответов каталога обновляются
+    после фиксации транзакции
+    """
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=User)
+def model_changed(sender, signal, created=False, update_fields=None,
+                  **kwargs):
+    """
+    версия общих данных рецептов для кэшей api, обновление
+    last_login при входе ее не меняет. Состав строк для кэша
+    COUNT(*) меняют только создание и удаление
+    """
+    if update_fields == {'last_login'}:
+        return
+    bump_versions(RECIPE_CONTENT)
+    if created or signal is post_delete:
+        bump_versions(rows_version(sender._meta.label_lower))
+
+
+@receiver(m2m_changed)
+def relation_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    теги рецептов меняют общие данные и состав выборок по тегам,
+    избранное, список покупок и подписки - только версию связей
+    пользователей, выборки остальных пользователей не меняются
+    """
+    if not action.startswith('post_'):
+        return
+    if sender is Recipe.tags.through:
+        bump_versions(RECIPE_CONTENT, RECIPE_ROWS)
+    elif sender in M2M_COUNTERS:
+        _, counted_field, _, on_counted_model = M2M_COUNTERS[sender]
+        if reverse == on_counted_model:
+            user_ids = (instance.pk,)
+        elif pk_set is not None:
+            user_ids = pk_set
+        else:
+            # clear со стороны объекта счетчика: пользователи неизвестны
+            user_ids = ()
+            bump_versions(rows_version(
+                sender._meta.get_field(counted_field).related_model
+                ._meta.label_lower
+            ))
+        bump_versions(*map(relations_version, user_ids))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_saved(instance, **kwargs):
+    """
+    новое изображение рецепта - задача на создание
+    уменьшенных копий
+    """
+    if instance.image and (
+        instance.image_variants.get('source') != instance.image.name
+    ):
+        schedule_variants(instance)
+
+
+@receiver(post_init, sender=Recipe)
+def remember_recipe_image(instance, **kwargs):
+    """
+    имя изображения, загруженное из базы данных, без отдельного
+    запроса при сохранении; DEFERRED - поле не загружалось
+    """
+    image = instance.__dict__.get('image', DEFERRED)
+    instance.previous_image = getattr(image, 'name', image) if (
+        instance.pk
+    ) else None
+
+
+@receiver(pre_save, sender=Recipe)
+def load_previous_image(instance, update_fields=None, **kwargs):
+    """
+    изображение присвоено рецепту, загруженному без него (only/defer):
+    прежнее имя читается из базы данных
+    """
+    if instance.previous_image is DEFERRED and 'image' in instance.__dict__:
+        instance.previous_image = Recipe.objects.filter(
+            pk=instance.pk
+        ).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=Recipe)
+def count_recipe_image(instance, **kwargs):
+    """
+    ссылки на файлы изображения в StoredFile,
+    ссылки на копии меняет generate_variants
+    """
+    if instance.previous_image is DEFERRED:
+        return
+    if instance.image.name != instance.previous_image:
+        StoredFile.objects.acquire((instance.image.name,))
+        StoredFile.objects.release((instance.previous_image,))
+        instance.previous_image = instance.image.name
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_image(instance, **kwargs):
+    StoredFile.objects.release(
+        (instance.image.name, *variant_names(instance.image_variants))
+    )
+
+
+@receiver(post_init, sender=IngredientAmount)
+def remember_amount(instance, **kwargs):
+    """
+    загруженные ингредиент и количество - прежнее состояние
+    строки для списков покупок
+    """
+    instance.loaded_amount = instance.pk and {
+        instance.__dict__.get('ingredients_id'):
+        instance.__dict__.get('amount', 0)
+    }
+
+
+@receiver(post_save, sender=IngredientAmount)
+def amount_saved(instance, created, raw=False, **kwargs):
+    """
+    строка ингредиента сохранена отдельно (админка):
+    разница применяется к спискам покупок с рецептом
+    """
+    if raw:
+        return
+    amounts = {instance.ingredients_id: instance.amount}
+    ShoppingCartIngredient.objects.change_amounts(
+        instance.recipe_id,
+        {} if created else instance.loaded_amount or {},
+        amounts,
+    )
+    instance.loaded_amount = amounts
+
+
+@receiver(pre_delete, sender=IngredientAmount)
+def amount_deleted(instance, **kwargs):
+    """
+    до удаления строки, в том числе каскадом от рецепта, автора
+    или ингредиента, пока связи корзин с рецептом еще существуют
+    """
+    ShoppingCartIngredient.objects.change_amounts(
+        instance.recipe_id, {instance.ingredients_id: instance.amount}, {}
+    )
+
+
+@receiver(m2m_changed)
+def relation_counted(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    счетчики избранного, списков покупок и подписчиков.
+    post_add получает только действительно добавленные связи,
+    удаляемые связи запоминаются в pre_remove/pre_clear
+    """
+    if sender not in M2M_COUNTERS:
+        return
+    counter, counted_field, other_field, on_counted_model = (
+        M2M_COUNTERS[sender]
+    )
+    # instance - объект счетчика или вторая сторона связи
+    counted_instance = reverse != on_counted_model
+    if counted_instance:
+        instance_field, target_field = counted_field, other_field
+    else:
+        instance_field, target_field = other_field, counted_field
+    if action in ('pre_remove', 'pre_clear'):
+        links = sender.objects.filter(**{instance_field: instance.pk})
+        if action == 'pre_remove':
+            links = links.filter(**{f'{target_field}__in': pk_set})
+        instance.removed_links = link_times(counter, links, counted_field)
+        return
+    if action == 'post_add':
+        now = timezone.now()
+        count_links(counter, [
+            (pk, now) for pk in (
+                [instance.pk] * len(pk_set) if counted_instance else pk_set
+            )
+        ], 1)
+    elif action in ('post_remove', 'post_clear'):
+        count_links(counter, instance.__dict__.pop('removed_links', ()), -1)
+
+
+def link_times(counter, links, counted_field):
+    """
+    (объект счетчика, время добавления) связей links,
+    время нужно только рейтингам
+    """
+    if counter in RANKED_COUNTERS:
+        return list(links.values_list(counted_field, 'created'))
+    return [
+        (pk, None) for pk in links.values_list(counted_field, flat=True)
+    ]
+
+
+def count_links(counter, links, sign):
+    """
+    добавленные (sign 1) или удаленные (-1) связи links из
+    link_times: изменение счетчика и события рейтингов
+    refresh_rankings, удаление - со временем добавления связи
+    """
+    deltas = Counter()
+    for pk, _ in links:
+        deltas[pk] += sign
+    CounterDelta.objects.add(counter, deltas)
+    if counter in RANKED_COUNTERS:
+        RecipeEvent.objects.bulk_create(
+            RecipeEvent(
+                recipe_id=pk, kind=RANKED_COUNTERS[counter],
+                delta=sign * count, created=created,
+            )
+            for (pk, created), count in Counter(links).items()
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_counted(instance, created, **kwargs):
+    if created:
+        CounterDelta.objects.add('user_recipes', {instance.author_id: 1})
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(instance, created, **kwargs):
+    """
+    рецепт автора FanoutAuthor раскладывается по лентам подписчиков
+    в фоне, остальные попадают в ленту при чтении
+    """
+    if created:
+        submit_on_commit(FeedEntry.objects.fanout_recipe, instance.pk)
+
+
+@receiver(m2m_changed, sender=User.subscribe.through)
+def subscription_changed(instance, action, reverse, pk_set, **kwargs):
+    """
+    ленты подписчиков авторов FanoutAuthor при подписке и отписке,
+    reverse - изменение со стороны автора
+    """
+    if action == 'post_add':
+        if reverse:
+            for user_id in pk_set:
+                FeedEntry.objects.follow(user_id, [instance.pk])
+        else:
+            FeedEntry.objects.follow(instance.pk, pk_set)
+    elif action == 'pre_remove':
+        if reverse:
+            FeedEntry.objects.filter(
+                user_id__in=pk_set, recipe__author_id=instance.pk
+            ).delete()
+        else:
+            FeedEntry.objects.unfollow(instance.pk, pk_set)
+    elif action == 'pre_clear':
+        if reverse:
+            FeedEntry.objects.filter(recipe__author_id=instance.pk).delete()
+        else:
+            FeedEntry.objects.filter(user_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_uncounted(instance, **kwargs):
+    CounterDelta.objects.add('user_recipes', {instance.author_id: -1})
+
+
+@receiver(pre_delete, sender=User)
+def user_uncounted(instance, **kwargs):
+    """
+    связи удаляемого пользователя удаляются каскадом без m2m_changed,
+    счетчики и рейтинги рецептов и авторов уменьшаются заранее
+    """
+    for through, (counter, counted_field, other_field, _) in (
+        M2M_COUNTERS.items()
+    ):
+        count_links(counter, link_times(
+            counter,
+            through.objects.filter(**{other_field: instance.pk}),
+            counted_field,
+        ), -1)
@@ -0,0 +1,58 @@
+import hashlib
+import os
+from uuid import uuid4
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файловое хранилище с адресацией по содержимому.
+    Файл получает имя по sha256 содержимого и кладется в подкаталоги
+    по первым символам хэша (upload_to сохраняется как префикс):
+    recipe_images/3f/a2/3fa2...e1.png - в одном каталоге не больше
+    256 подкаталогов и равномерно распределенные файлы.
+    Одинаковое содержимое хранится один раз: повторная запись
+    возвращает имя существующего файла.
+    Ссылки на файлы учитывает StoredFile, неиспользуемые файлы
+    удаляет команда collect_media
+    """
+    shard_depth = 2
+    shard_width = 2
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        shards = [
+            digest[level * self.shard_width:(level + 1) * self.shard_width]
+            for level in range(self.shard_depth)
+        ]
+        return '/'.join(
+            part for part in (directory, *shards, digest + extension) if part
+        )
+
+    def _save(self, name, content):
+        name = self.content_name(name, content)
+        if self.exists(name):
+            # mtime защищает файл от collect_media,
+            # пока новая ссылка на него не записана
+            os.utime(self.path(name))
+            return name
+        # запись во временный файл и жесткая ссылка под именем
+        # содержимого: одновременная запись того же содержимого
+        # не переименовывается get_available_name, а получает
+        # существующий файл
+        temporary = super()._save(f'{name}.{uuid4().hex}.tmp', content)
+        try:
+            os.link(self.path(temporary), self.path(name))
+        except FileExistsError:
+            os.utime(self.path(name))
+        finally:
+            os.remove(self.path(temporary))
+        return name
@@ -0,0 +1,30 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.BACKGROUND_WORKERS, thread_name_prefix='recipes'
+)
+
+
+def run(task, *args):
+    try:
+        task(*args)
+    except Exception:
+        logger.exception('background task %s%s failed', task.__name__, args)
+    finally:
+        close_old_connections()
+
+
+def submit_on_commit(task, *args):
+    """
+    задача в пул потоков процесса после фиксации транзакции,
+    ответ на запрос ее не ждет. Задачи не переживают перезапуск
+    воркера - для каждой есть команда досчета
+    (generate_image_variants, rebuild_feeds за FEED_REPAIR_WINDOW)
+    """
+    transaction.on_commit(lambda: _executor.submit(run, task, *args))
@@ -0,0 +1,75 @@
+from uuid import uuid4
+
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+
+CATALOG = 'catalog'
+RECIPE_CONTENT = 'recipe_content'
+
+# отдельный кэш без вытеснения, settings.CACHES
+cache = ConnectionProxy(caches, 'versions')
+
+
+def get_version(name):
+    """
+    Версия набора данных в общем кэше, меняется при записи
+    (recipes.signals). По версиям сверяются индексы в памяти
+    воркеров и кэши ответов и счетчиков api.
+    CATALOG - теги и ингредиенты,
+    RECIPE_CONTENT - данные рецептов, общие для всех пользователей
+    (рецепт, его теги, автор), без избранного и списков покупок,
+    rows_version(label) - состав строк модели для COUNT(*): создание
+    и удаление записей, теги рецептов, рейтинги,
+    relations_version(user_id) - избранное, список покупок
+    и подписки пользователя
+    """
+    key = f'version:{name}'
+    cache.add(key, uuid4().hex, None)
+    return cache.get(key)
+
+
+def get_versions(names):
+    """
+    get_version для нескольких наборов, одним чтением из кэша,
+    если все версии уже есть
+    """
+    keys = [f'version:{name}' for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def rows_version(label):
+    return f'{label}:rows'
+
+
+def relations_version(user_id):
+    return f'relations:{user_id}'
+
+
+async def aget_version(name):
+    """
+    get_version для асинхронных views
+    """
+    key = f'version:{name}'
+    await cache.aadd(key, uuid4().hex, None)
+    return await cache.aget(key)
+
+
+def bump_version(name):
+    cache.set(f'version:{name}', uuid4().hex, None)
+
+
+def catalog_version():
+    return get_version(CATALOG)
+
+
+async def acatalog_version():
+    return await aget_version(CATALOG)
+
+
+def bump_catalog_version():
+    bump_version(CATALOG)
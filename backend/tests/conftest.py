@@ -0,0 +1,110 @@
+from itertools import count
+
+import pytest
+from django.core.cache import caches
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, IngredientAmount, Recipe, Tag
+from users.models import User
+
+_numbers = count(1)
+
+
+@pytest.fixture(autouse=True)
+def isolated(settings, tmp_path):
+    """
+    у каждого теста свой кэш в памяти и каталог media
+    """
+    settings.CACHES = {
+        alias: {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': f'tests-{alias}',
+        }
+        for alias in settings.CACHES
+    }
+    settings.MEDIA_ROOT = str(tmp_path / 'media')
+    for cache in caches.all():
+        cache.clear()
+
+
+@pytest.fixture
+def make_user(db):
+    def make(**fields):
+        number = next(_numbers)
+        return User.objects.create_user(**{
+            'username': f'user{number}',
+            'email': f'user{number}@example.com',
+            'password': 'password',
+            'first_name': 'Имя',
+            'last_name': 'Фамилия',
+            **fields,
+        })
+    return make
+
+
+@pytest.fixture
+def tags(db):
+    return [
+        Tag.objects.create(
+            name=f'тег {number}',
+            color=f'#0000{number:02d}',
+            slug=f'tag{number}',
+        )
+        for number in range(1, 4)
+    ]
+
+
+@pytest.fixture
+def ingredients(db):
+    return Ingredient.objects.bulk_create(
+        Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+        for number in range(1, 6)
+    )
+
+
+@pytest.fixture
+def make_recipe(make_user, tags, ingredients):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+
+    def make(author=None, amounts=None, **fields):
+        """
+        amounts - {ingredient: amount}, по умолчанию
+        первые три ингредиента по 10
+        """
+        number = next(_numbers)
+        name = ''.join(letters[int(digit)] for digit in str(number))
+        recipe = Recipe.objects.create(**{
+            'author': author or make_user(),
+            'name': f'recipe {name}',
+            'text': 'text',
+            'cooking_time': 10,
+            'image': 'recipe_images/image.png',
+            **fields,
+        })
+        recipe.tags.set(tags[:2])
+        if amounts is None:
+            amounts = {ingredient: 10 for ingredient in ingredients[:3]}
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(
+                recipe=recipe, ingredients=ingredient, amount=amount
+            )
+            for ingredient, amount in amounts.items()
+        )
+        return recipe
+    return make
+
+
+@pytest.fixture
+def client():
+    return APIClient()
+
+
+@pytest.fixture
+def auth_client():
+    def make(user):
+        client = APIClient()
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+    return make
@@ -0,0 +1,117 @@
+"""
+Потоковые ответы в режиме asgi (foodgram.handlers.ASGIHandler):
+части читаются в потоке порциями, не в цикле событий и не целиком
+"""
+import asyncio
+import importlib
+
+from django.http import StreamingHttpResponse
+from django.urls import clear_url_caches
+from rest_framework.authtoken.models import Token
+
+import pytest
+from asgiref.sync import async_to_sync
+from foodgram import urls
+from foodgram.handlers import ASGIHandler
+
+from recipes.models import ShoppingCartIngredient
+
+
+def send_response(response):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    async_to_sync(ASGIHandler().send_response)(response, send)
+    return messages
+
+
+def in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+@pytest.mark.django_db
+def test_parts_read_in_batches_outside_event_loop(settings):
+    settings.ASGI_STREAMING_BATCH_SIZE = 2
+    read = []
+
+    def parts():
+        for number in range(5):
+            assert not in_event_loop()
+            read.append(number)
+            yield f'{number}\n'
+
+    def sent_parts(messages):
+        return [
+            message.get('body', b'') for message in messages
+            if message['type'] == 'http.response.body'
+        ]
+
+    response = StreamingHttpResponse(parts(), content_type='text/plain')
+    messages = send_response(response)
+    assert messages[0]['type'] == 'http.response.start'
+    assert sent_parts(messages) == [
+        b'0\n', b'1\n', b'2\n', b'3\n', b'4\n', b''
+    ]
+    assert messages[-1] == {'type': 'http.response.body'}
+    assert read == [0, 1, 2, 3, 4]
+
+
+@pytest.fixture(params=(False, True), ids=('sync_view', 'async_view'))
+def async_views(request, settings):
+    """
+    маршруты api с асинхронными views (settings.ASYNC_VIEWS)
+    и без них
+    """
+    def load(enabled):
+        settings.ASYNC_VIEWS = enabled
+        importlib.reload(importlib.import_module('api.urls'))
+        importlib.reload(urls)
+        clear_url_caches()
+
+    load(request.param)
+    yield
+    load(False)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_download_shopping_cart(async_views, make_user, make_recipe,
+                                ingredients, settings):
+    settings.ASGI_STREAMING_BATCH_SIZE = 1
+    user = make_user()
+    recipe = make_recipe()
+    ShoppingCartIngredient.objects.add_recipes(user, (recipe.pk,))
+    token = Token.objects.create(user=user)
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    async_to_sync(ASGIHandler())({
+        'type': 'http',
+        'method': 'GET',
+        'path': '/api/recipes/download_shopping_cart/',
+        'query_string': b'',
+        'headers': [
+            (b'authorization', f'Token {token.key}'.encode()),
+            (b'host', b'testserver'),
+        ],
+    }, receive, send)
+    assert messages[0]['status'] == 200
+    body = [message.get('body', b'') for message in messages[1:]]
+    assert b''.join(body).decode() == (
+        'Список покупок\n'
+        'ингредиент 1: 10 г\n'
+        'ингредиент 2: 10 г\n'
+        'ингредиент 3: 10 г\n'
+    )
+    # заголовок и строки отправлены по одной, затем завершение
+    assert body[-1] == b'' and len(body) == 5
@@ -0,0 +1,134 @@
+"""
+Массовые избранное и подписки: статус для каждого id, количество
+запросов не зависит от количества id, одинаковые параллельные
+запросы не добавляют связь дважды
+"""
+import threading
+
+import pytest
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+
+from recipes.models import Favorite, Recipe
+
+MISSING = 10 ** 9
+
+
+def statuses(response):
+    return {item['id']: item['status'] for item in response.data['results']}
+
+
+@pytest.mark.django_db
+def test_favorite_statuses(make_user, make_recipe, auth_client):
+    user = make_user()
+    first, second = make_recipe(), make_recipe()
+    user.favorites.add(first)
+    client = auth_client(user)
+    response = client.post(
+        '/api/recipes/favorite/',
+        {'ids': [first.pk, second.pk, MISSING]},
+        format='json',
+    )
+    assert response.status_code == 200
+    assert statuses(response) == {
+        first.pk: 'exists', second.pk: 'added', MISSING: 'not_found',
+    }
+    user.favorites.remove(first)
+    response = client.delete(
+        '/api/recipes/favorite/',
+        {'ids': [first.pk, second.pk, MISSING]},
+        format='json',
+    )
+    assert statuses(response) == {
+        first.pk: 'absent', second.pk: 'removed', MISSING: 'not_found',
+    }
+    assert not user.favorites.exists()
+
+
+@pytest.mark.django_db
+def test_subscribe_statuses(make_user, auth_client):
+    user, author, other = make_user(), make_user(), make_user()
+    user.subscribe.add(author)
+    response = auth_client(user).post(
+        '/api/users/subscribe/',
+        {'ids': [author.pk, other.pk, MISSING]},
+        format='json',
+    )
+    assert statuses(response) == {
+        author.pk: 'exists', other.pk: 'added', MISSING: 'not_found',
+    }
+    assert set(user.subscribe.values_list('pk', flat=True)) == {
+        author.pk, other.pk
+    }
+
+
+def count_queries(client, method, url, ids):
+    with CaptureQueriesContext(connection) as context:
+        response = getattr(client, method)(url, {'ids': ids}, format='json')
+    assert response.status_code == 200
+    return len(context.captured_queries)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('url', (
+    '/api/recipes/favorite/', '/api/users/subscribe/'
+))
+def test_bulk_queries_fixed(url, make_user, make_recipe, auth_client):
+    """
+    запросы на 1 и на 5 id: блокировки, текущие связи,
+    INSERT или DELETE, счетчики и события рейтингов
+    """
+    if 'users' in url:
+        objects = [make_user().pk for _ in range(6)]
+    else:
+        objects = [make_recipe().pk for _ in range(6)]
+    client = auth_client(make_user())
+    counts = {
+        method: [
+            count_queries(client, method, url, ids)
+            for ids in (objects[:1], objects[1:])
+        ]
+        for method in ('post', 'delete')
+    }
+    assert counts['post'][0] == counts['post'][1]
+    assert counts['delete'][0] == counts['delete'][1]
+
+
+@pytest.mark.skipif(
+    connection.vendor != 'postgresql',
+    reason='конкурентные транзакции проверяются на PostgreSQL',
+)
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_identical_posts(make_user, make_recipe, auth_client):
+    user = make_user()
+    ids = [make_recipe().pk for _ in range(3)]
+    barrier = threading.Barrier(4)
+    results, errors = [], []
+
+    def post():
+        client = auth_client(user)
+        try:
+            barrier.wait()
+            response = client.post(
+                '/api/recipes/favorite/', {'ids': ids}, format='json'
+            )
+            results.append(statuses(response))
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=post) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    for pk in ids:
+        assert [result[pk] for result in results].count('added') == 1
+    assert Favorite.objects.filter(user=user).count() == 3
+    assert set(
+        Recipe.objects.filter(pk__in=ids).values_list(
+            'favorites_count', flat=True
+        )
+    ) == {1}
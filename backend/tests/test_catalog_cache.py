@@ -0,0 +1,51 @@
+import pytest
+
+from recipes.models import Tag
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('path', ('/api/tags/', '/api/ingredients/'))
+def test_catalog_without_queries(
+    path, tags, ingredients, client, django_assert_num_queries
+):
+    """
+    с теплым кэшем каталог отвечает без запросов к базе данных:
+    304 по If-None-Match и тело ответа из кэша
+    """
+    response = client.get(path)
+    assert response.status_code == 200
+    etag = response['ETag']
+    with django_assert_num_queries(0):
+        response = client.get(path, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    with django_assert_num_queries(0):
+        response = client.get(path)
+    assert response.status_code == 200
+    assert response['ETag'] == etag
+    assert len(response.data) == len(
+        tags if path == '/api/tags/' else ingredients
+    )
+
+
+@pytest.mark.django_db
+def test_ingredient_search_without_queries(
+    ingredients, client, django_assert_num_queries
+):
+    client.get('/api/ingredients/', {'name': 'ингр'})
+    with django_assert_num_queries(0):
+        response = client.get('/api/ingredients/', {'name': 'диент 3'})
+    assert response.status_code == 200
+    assert [item['name'] for item in response.data] == ['ингредиент 3']
+
+
+@pytest.mark.django_db
+def test_catalog_change_invalidates_etag(
+    tags, client, django_capture_on_commit_callbacks
+):
+    etag = client.get('/api/tags/')['ETag']
+    with django_capture_on_commit_callbacks(execute=True):
+        Tag.objects.create(name='новый', color='#000099', slug='new')
+    response = client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+    assert len(response.data) == 4
@@ -0,0 +1,269 @@
+"""
+Пул соединений (foodgram.db.pool.ConnectionPool) с поддельными
+connect, check и reset; возврат соединений в пул при закрытии
+соединения Django (foodgram.db.postgresql)
+"""
+import threading
+import time
+
+import psycopg2.extensions
+import pytest
+
+from foodgram.db import pool as pool_module
+from foodgram.db.pool import ConnectionPool, PoolTimeout
+from foodgram.db.postgresql import base
+
+
+class FakeConnection:
+    isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
+
+    def __init__(self, number):
+        self.number = number
+        self.closed = False
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def close(self):
+        self.closed = True
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class Backend:
+    """
+    поддельные функции backend базы данных: usable и reusable -
+    результаты check и reset, вызовы записываются
+    """
+
+    def __init__(self):
+        self.connections = []
+        self.checked = []
+        self.reset_connections = []
+        self.usable = True
+        self.reusable = True
+
+    def connect(self):
+        connection = FakeConnection(len(self.connections))
+        self.connections.append(connection)
+        return connection
+
+    def check(self, connection):
+        self.checked.append(connection)
+        if isinstance(self.usable, Exception):
+            raise self.usable
+        return self.usable
+
+    def reset(self, connection):
+        self.reset_connections.append(connection)
+        if isinstance(self.reusable, Exception):
+            raise self.reusable
+        return self.reusable
+
+
+@pytest.fixture
+def backend():
+    return Backend()
+
+
+@pytest.fixture
+def make_pool(backend):
+    def make(**options):
+        return ConnectionPool(
+            'default', backend.connect, backend.check, backend.reset,
+            **{'max_size': 2, 'max_overflow': 1, 'timeout': 0.05, **options}
+        )
+    return make
+
+
+def stats(pool, *keys):
+    values = pool.stats()
+    return {key: values[key] for key in keys}
+
+
+def test_released_connection_reused(make_pool, backend):
+    pool = make_pool()
+    connection = pool.acquire()
+    pool.release(connection)
+    assert backend.reset_connections == [connection]
+    assert pool.acquire() is connection
+    # проверка только после check_interval простоя
+    assert backend.checked == []
+    assert stats(pool, 'size', 'idle', 'in_use', 'created', 'checkouts') == {
+        'size': 1, 'idle': 0, 'in_use': 1, 'created': 1, 'checkouts': 2,
+    }
+
+
+def test_last_released_acquired_first(make_pool):
+    pool = make_pool()
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+    assert pool.acquire() is second
+    assert pool.acquire() is first
+
+
+def test_overflow_closed_on_release(make_pool, backend):
+    pool = make_pool()
+    connections = [pool.acquire() for _ in range(3)]
+    assert stats(pool, 'size', 'in_use') == {'size': 3, 'in_use': 3}
+    for connection in connections:
+        pool.release(connection)
+    # в пуле остаются max_size, временное соединение закрыто
+    assert [connection.closed for connection in connections] == [
+        False, False, True
+    ]
+    assert backend.reset_connections == connections[:2]
+    assert stats(pool, 'size', 'idle', 'in_use', 'closed') == {
+        'size': 2, 'idle': 2, 'in_use': 0, 'closed': 1,
+    }
+
+
+def test_acquire_timeout(make_pool):
+    pool = make_pool()
+    for _ in range(3):
+        pool.acquire()
+    started = time.monotonic()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert time.monotonic() - started >= 0.05
+    assert stats(pool, 'in_use', 'timeouts', 'checkouts') == {
+        'in_use': 3, 'timeouts': 1, 'checkouts': 3,
+    }
+    # время ожидания учитывается только для выданных соединений
+    assert pool.stats()['wait_time'] < 0.05
+
+
+def test_waiting_acquire_gets_released(make_pool):
+    pool = make_pool(max_size=1, max_overflow=0, timeout=5)
+    connection = pool.acquire()
+    acquired = []
+    waiting = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiting.start()
+    time.sleep(0.05)
+    assert acquired == []
+    pool.release(connection)
+    waiting.join(5)
+    assert acquired == [connection]
+    values = pool.stats()
+    assert values['created'] == 1 and values['timeouts'] == 0
+    assert values['max_wait_time'] >= 0.05
+    assert values['wait_time'] == pytest.approx(
+        values['max_wait_time'], abs=0.01
+    )
+
+
+@pytest.mark.parametrize('usable', (False, OSError('connection lost')))
+def test_failed_check_discarded(usable, make_pool, backend):
+    pool = make_pool(check_interval=0)
+    connection = pool.acquire()
+    pool.release(connection)
+    backend.usable = usable
+    replacement = pool.acquire()
+    assert backend.checked == [connection]
+    assert connection.closed and replacement is not connection
+    assert stats(pool, 'size', 'in_use', 'created', 'closed',
+                 'failed_checks') == {
+        'size': 1, 'in_use': 1, 'created': 2, 'closed': 1,
+        'failed_checks': 1,
+    }
+
+
+def test_expired_connection_closed(make_pool, backend):
+    pool = make_pool(max_lifetime=0)
+    connection = pool.acquire()
+    pool.release(connection)
+    assert pool.acquire() is not connection
+    # устаревшее соединение закрывается без проверки
+    assert connection.closed and backend.checked == []
+    assert stats(pool, 'created', 'closed', 'failed_checks') == {
+        'created': 2, 'closed': 1, 'failed_checks': 0,
+    }
+
+
+@pytest.mark.parametrize('reusable', (False, OSError('connection lost')))
+def test_failed_reset_discarded(reusable, make_pool, backend):
+    pool = make_pool()
+    connection = pool.acquire()
+    backend.reusable = reusable
+    pool.release(connection)
+    assert connection.closed
+    assert stats(pool, 'size', 'idle', 'in_use', 'closed') == {
+        'size': 0, 'idle': 0, 'in_use': 0, 'closed': 1,
+    }
+
+
+def test_failed_connect_frees_slot(make_pool, backend):
+    pool = make_pool(max_size=1, max_overflow=0)
+
+    def failing_connect():
+        raise OSError('connection refused')
+
+    pool.connect = failing_connect
+    with pytest.raises(OSError):
+        pool.acquire()
+    assert stats(pool, 'size', 'in_use', 'created') == {
+        'size': 0, 'in_use': 0, 'created': 0,
+    }
+    pool.connect = backend.connect
+    assert pool.acquire() is backend.connections[0]
+
+
+@pytest.mark.parametrize('status, reusable, rollbacks', (
+    (psycopg2.extensions.TRANSACTION_STATUS_IDLE, True, 0),
+    (psycopg2.extensions.TRANSACTION_STATUS_INTRANS, True, 1),
+    (psycopg2.extensions.TRANSACTION_STATUS_INERROR, True, 1),
+    (psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN, False, 0),
+))
+def test_postgresql_reset(status, reusable, rollbacks):
+    connection = FakeConnection(0)
+    connection.status = status
+    assert base.reset(connection) is reusable
+    assert connection.rollbacks == rollbacks
+    connection.close()
+    assert base.reset(connection) is False
+    assert base.check(connection) is False
+
+
+@pytest.fixture
+def wrapper(monkeypatch, backend):
+    """
+    DatabaseWrapper foodgram.db.postgresql с поддельным connect
+    и отдельным реестром пулов
+    """
+    monkeypatch.setattr(pool_module, '_pools', {})
+    monkeypatch.setattr(
+        base, 'connect',
+        lambda conn_params, isolation_level: backend.connect(),
+    )
+    monkeypatch.setattr(base, 'reset', backend.reset)
+
+    def make():
+        return base.DatabaseWrapper({
+            'NAME': 'foodgram', 'USER': '', 'PASSWORD': '', 'HOST': '',
+            'PORT': '', 'OPTIONS': {}, 'TIME_ZONE': None,
+            'CONN_MAX_AGE': 0, 'AUTOCOMMIT': True, 'ATOMIC_REQUESTS': False,
+            'POOL': {'MAX_SIZE': 1, 'MAX_OVERFLOW': 0, 'TIMEOUT': 0.05},
+        }, alias='pooled')
+    return make
+
+
+def test_close_returns_connection_to_pool(wrapper, backend):
+    first, second = wrapper(), wrapper()
+    params = first.get_connection_params()
+    first.connection = first.get_new_connection(params)
+    assert first.connection_pool is second.get_pool(params)
+    # пул из одного соединения занят
+    with pytest.raises(psycopg2.OperationalError):
+        second.get_new_connection(params)
+    first._close()
+    assert backend.reset_connections == [first.connection]
+    assert second.get_new_connection(params) is first.connection
+    assert not first.connection.closed
+    assert stats(first.connection_pool, 'created', 'timeouts') == {
+        'created': 1, 'timeouts': 1,
+    }
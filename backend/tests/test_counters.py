@@ -0,0 +1,93 @@
+"""
+Денормализованные счетчики не затираются полным save() объекта,
+загруженного до изменения счетчика
+"""
+from contextlib import contextmanager
+
+import pytest
+from django.db.models.signals import pre_save
+
+from recipes.models import CounterDelta, Recipe
+from users.models import User
+
+
+@contextmanager
+def counted_before_save(model, counter, pk):
+    """
+    изменение счетчика другим запросом между загрузкой
+    объекта и его сохранением
+    """
+    def receiver(instance, **kwargs):
+        if instance.pk == pk:
+            CounterDelta.objects.add(counter, {pk: 1})
+
+    pre_save.connect(receiver, sender=model)
+    try:
+        yield
+    finally:
+        pre_save.disconnect(receiver, sender=model)
+
+
+@pytest.mark.django_db
+def test_stale_save_keeps_counters(make_user, make_recipe):
+    recipe = make_recipe()
+    author = User.objects.get(pk=recipe.author_id)
+    fan = make_user()
+    fan.favorites.add(recipe)
+    fan.carts.add(recipe)
+    fan.subscribe.add(author)
+    recipe.name = 'stale recipe'
+    recipe.save()
+    author.first_name = 'Автор'
+    author.save()
+    recipe = Recipe.objects.get(pk=recipe.pk)
+    assert (recipe.name, recipe.favorites_count, recipe.carts_count) == (
+        'stale recipe', 1, 1
+    )
+    author = User.objects.get(pk=author.pk)
+    assert (author.first_name, author.subscribers_count) == ('Автор', 1)
+    assert author.recipes_count == 1
+
+
+@pytest.mark.django_db
+def test_explicit_counter_update_fields_skipped(make_recipe):
+    recipe = make_recipe()
+    recipe.favorites_count = 100
+    recipe.save(update_fields=('name', 'favorites_count'))
+    assert Recipe.objects.get(pk=recipe.pk).favorites_count == 0
+
+
+@pytest.mark.django_db
+def test_api_recipe_edit_keeps_counters(make_recipe, tags, ingredients,
+                                        auth_client):
+    recipe = make_recipe()
+    client = auth_client(recipe.author)
+    with counted_before_save(Recipe, 'recipe_favorites', recipe.pk):
+        response = client.patch(
+            f'/api/recipes/{recipe.pk}/',
+            {
+                'name': 'edited recipe',
+                'tags': [tags[0].pk],
+                'ingredients': [{'id': ingredients[0].pk, 'amount': 5}],
+            },
+            format='json',
+        )
+    assert response.status_code == 200
+    recipe = Recipe.objects.get(pk=recipe.pk)
+    assert (recipe.name, recipe.favorites_count) == ('edited recipe', 1)
+
+
+@pytest.mark.django_db
+def test_api_set_password_keeps_counters(make_user, auth_client):
+    user = make_user()
+    client = auth_client(user)
+    with counted_before_save(User, 'user_subscribers', user.pk):
+        response = client.post(
+            '/api/users/set_password/',
+            {'current_password': 'password', 'new_password': 'Xk3!pass9q'},
+            format='json',
+        )
+    assert response.status_code == 204
+    user = User.objects.get(pk=user.pk)
+    assert user.check_password('Xk3!pass9q')
+    assert user.subscribers_count == 1
@@ -0,0 +1,101 @@
+"""
+Лента подписок /api/recipes/feed/: объединение рецептов авторов,
+читаемых при запросе, и разложенных FeedEntry, keyset пагинация
+"""
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from recipes.models import FeedEntry, Recipe
+
+URL = '/api/recipes/feed/'
+
+
+@pytest.fixture
+def feed(make_user, make_recipe, tags):
+    """
+    подписчик, автор с чтением при запросе и автор FanoutAuthor,
+    рецепты авторов чередуются по времени публикации
+    """
+    user, pulled, pushed = make_user(), make_user(), make_user()
+    user.subscribe.add(pulled, pushed)
+    stranger = make_user()
+    now = timezone.now()
+    recipes = []
+    for number in range(8):
+        recipe = make_recipe(author=(pulled, pushed)[number % 2])
+        Recipe.objects.filter(pk=recipe.pk).update(
+            pub_date=now - timedelta(minutes=number)
+        )
+        recipes.append(recipe.pk)
+    make_recipe(author=stranger)
+    FeedEntry.objects.enable_fanout(pushed.pk)
+    return user, recipes
+
+
+def ids(response):
+    return [item['id'] for item in response.data['results']]
+
+
+@pytest.mark.django_db
+def test_feed_pages(feed, auth_client):
+    user, recipes = feed
+    client = auth_client(user)
+    response = client.get(URL, {'limit': 3})
+    assert response.status_code == 200
+    pages = [ids(response)]
+    assert response.data['previous'] is None
+    while response.data['next']:
+        response = client.get(response.data['next'])
+        pages.append(ids(response))
+    assert pages == [recipes[:3], recipes[3:6], recipes[6:]]
+    response = client.get(response.data['previous'])
+    assert ids(response) == recipes[3:6]
+
+
+@pytest.mark.django_db
+def test_feed_filters_each_branch(feed, auth_client, tags):
+    user, recipes = feed
+    Recipe.objects.get(pk=recipes[0]).tags.set([tags[2]])
+    Recipe.objects.get(pk=recipes[1]).tags.set([tags[2]])
+    response = auth_client(user).get(
+        URL, {'limit': 6, 'tags': tags[2].slug}
+    )
+    assert ids(response) == recipes[:2]
+
+
+@pytest.mark.django_db
+def test_feed_union_of_limited_branches(feed, auth_client):
+    user, recipes = feed
+    client = auth_client(user)
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(URL, {'limit': 2})
+    assert ids(response) == recipes[:2]
+    sql = next(
+        query['sql'] for query in context.captured_queries
+        if ' UNION ' in query['sql']
+    )
+    # каждая ветвь ограничена размером страницы + 1
+    assert sql.count('LIMIT 3') == 3
+
+
+@pytest.mark.django_db
+def test_rebuild_feeds_repairs_lost_fanout(feed, make_recipe, auth_client,
+                                           settings):
+    settings.FEED_FANOUT_MIN_SUBSCRIBERS = 1
+    user, recipes = feed
+    pushed = Recipe.objects.get(pk=recipes[1]).author
+    # задача раскладки выполняется после фиксации транзакции,
+    # в тесте она не запускается, как при перезапуске воркера
+    lost = make_recipe(author=pushed)
+    assert not FeedEntry.objects.filter(recipe=lost).exists()
+    call_command('rebuild_feeds', stdout=StringIO())
+    assert FeedEntry.objects.filter(recipe=lost, user=user).exists()
+    response = auth_client(user).get(URL, {'limit': 1})
+    assert ids(response) == [lost.pk]
+    assert FeedEntry.objects.repair(timezone.now() - timedelta(days=1)) == 0
@@ -0,0 +1,74 @@
+"""
+Фильтры ленты рецептов (api.filters): подзапросы EXISTS отдают
+те же рецепты, что и прежние фильтры через JOIN с DISTINCT,
+без повторяющихся строк
+"""
+import pytest
+
+from recipes.models import Recipe
+
+URL = '/api/recipes/'
+
+
+@pytest.fixture
+def filtered(make_user, make_recipe, tags):
+    """
+    пользователь и рецепты двух авторов со всеми тегами,
+    часть рецептов в избранном и в списке покупок
+    """
+    user = make_user()
+    authors = [make_user(), make_user()]
+    for number in range(12):
+        recipe = make_recipe(author=authors[number % 2])
+        recipe.tags.set(tags if number % 3 else tags[:1])
+        if number % 4:
+            user.favorites.add(recipe)
+        if number % 5:
+            user.carts.add(recipe)
+    return user, authors
+
+
+def joined(user, params):
+    """
+    выборка прежних фильтров: JOIN по связям и DISTINCT
+    """
+    queryset = Recipe.objects.all()
+    if params.get('is_favorited'):
+        queryset = queryset.filter(favorite=user)
+    if params.get('is_in_shopping_cart'):
+        queryset = queryset.filter(cart=user)
+    if params.get('tags'):
+        queryset = queryset.filter(tags__slug__in=params['tags'])
+    if params.get('author'):
+        queryset = queryset.filter(author_id=params['author'])
+    return set(queryset.distinct().values_list('pk', flat=True))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('params', (
+    {'tags': ['tag1', 'tag2', 'tag3']},
+    {'tags': ['tag2', 'tag3'], 'author': 0},
+    {'is_favorited': 1, 'tags': ['tag1', 'tag2']},
+    {'is_favorited': 1, 'is_in_shopping_cart': 1},
+    {
+        'is_favorited': 1, 'is_in_shopping_cart': 1,
+        'tags': ['tag1', 'tag2', 'tag3'], 'author': 1,
+    },
+))
+def test_filters_match_joins(params, filtered, auth_client):
+    user, authors = filtered
+    if 'author' in params:
+        params = {**params, 'author': authors[params['author']].pk}
+    response = auth_client(user).get(URL, {**params, 'limit': 100})
+    assert response.status_code == 200
+    ids = [recipe['id'] for recipe in response.data['results']]
+    assert len(ids) == len(set(ids)) == response.data['count']
+    assert ids and set(ids) == joined(user, params)
+
+
+@pytest.mark.django_db
+def test_user_filters_anonymous(filtered, client):
+    response = client.get(URL, {'is_favorited': 1, 'limit': 100})
+    assert response.data['results'] == []
+    response = client.get(URL, {'is_favorited': 0, 'limit': 100})
+    assert response.data['count'] == Recipe.objects.count()
@@ -0,0 +1,158 @@
+"""
+Загрузка изображения рецепта /api/recipes/images/ файлом: multipart
+форма или тело запроса, подписанная ссылка image принимается
+созданием и изменением рецепта вместе с прежней base64 строкой
+"""
+from base64 import b64encode
+from io import BytesIO
+
+import pytest
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+
+from api.serializers import image_reference_salt
+from recipes.models import Recipe, StoredFile
+
+URL = '/api/recipes/images/'
+
+
+def png(color='red'):
+    buffer = BytesIO()
+    Image.new('RGB', (8, 8), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def recipe_data(tags, ingredients, image, name='рецепт с картинкой'):
+    return {
+        'name': name,
+        'text': 'text',
+        'cooking_time': 10,
+        'tags': [tags[0].pk],
+        'ingredients': [{'id': ingredients[0].pk, 'amount': 10}],
+        'image': image,
+    }
+
+
+def upload(client, content=None):
+    response = client.post(
+        URL,
+        {'image': SimpleUploadedFile('photo.png', content or png())},
+        format='multipart',
+    )
+    assert response.status_code == 201, response.data
+    return response.data
+
+
+@pytest.mark.django_db
+def test_multipart_upload(make_user, auth_client):
+    user = make_user()
+    data = upload(auth_client(user))
+    stored = StoredFile.objects.get()
+    assert signing.loads(
+        data['image'], salt=image_reference_salt(user)
+    ) == stored.name
+    assert data['url'].endswith(default_storage.url(stored.name))
+    assert stored.references == 0
+    assert default_storage.open(stored.name).read() == png()
+
+
+@pytest.mark.django_db
+def test_raw_body_upload(make_user, auth_client):
+    response = auth_client(make_user()).generic(
+        'POST', URL, png(), content_type='image/png'
+    )
+    assert response.status_code == 201, response.data
+    assert response.data['url'].endswith('.png')
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('content', (b'not an image', b''))
+def test_upload_rejects_non_image(content, make_user, auth_client):
+    response = auth_client(make_user()).post(
+        URL,
+        {'image': SimpleUploadedFile('photo.png', content)},
+        format='multipart',
+    )
+    assert response.status_code == 400
+    assert not StoredFile.objects.exists()
+
+
+@pytest.mark.django_db
+def test_upload_anonymous(client):
+    response = client.post(
+        URL, {'image': SimpleUploadedFile('photo.png', png())},
+        format='multipart',
+    )
+    assert response.status_code == 401
+
+
+@pytest.mark.django_db
+def test_reference_create_and_update(make_user, tags, ingredients,
+                                     auth_client):
+    user = make_user()
+    client = auth_client(user)
+    first = upload(client)
+    response = client.post(
+        '/api/recipes/', recipe_data(tags, ingredients, first['image']),
+        format='json',
+    )
+    assert response.status_code == 201, response.data
+    recipe = Recipe.objects.get(pk=response.data['id'])
+    assert first['url'].endswith(recipe.image.url)
+    assert StoredFile.objects.get(name=recipe.image.name).references == 1
+    second = upload(client, png('blue'))
+    response = client.patch(
+        f'/api/recipes/{recipe.pk}/',
+        recipe_data(tags, ingredients, second['image']),
+        format='json',
+    )
+    assert response.status_code == 200, response.data
+    recipe.refresh_from_db()
+    assert second['url'].endswith(recipe.image.url)
+    assert dict(StoredFile.objects.values_list('name', 'references')) == {
+        first['url'].split('/media/')[1]: 0, recipe.image.name: 1,
+    }
+
+
+def tampered(reference):
+    value, _, signature = reference.rpartition(':')
+    return f'{value}:{signature[:-1]}{"A" if signature[-1] != "A" else "B"}'
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('case', ('tampered', 'other_user', 'expired'))
+def test_bad_reference_rejected(case, make_user, tags, ingredients,
+                                auth_client, monkeypatch, settings):
+    user = make_user()
+    reference = upload(auth_client(user))['image']
+    if case == 'tampered':
+        reference = tampered(reference)
+    elif case == 'other_user':
+        user = make_user()
+    else:
+        expired = signing.time.time() + settings.MEDIA_COLLECT_DELAY + 1
+        monkeypatch.setattr(signing.time, 'time', lambda: expired)
+    response = auth_client(user).post(
+        '/api/recipes/', recipe_data(tags, ingredients, reference),
+        format='json',
+    )
+    assert response.status_code == 400
+    assert response.data['image'] == [
+        'Ссылка на изображение недействительна, загрузите изображение заново'
+    ]
+    assert not Recipe.objects.exists()
+
+
+@pytest.mark.django_db
+def test_base64_image_still_accepted(make_user, tags, ingredients,
+                                     auth_client):
+    image = 'data:image/png;base64,' + b64encode(png()).decode()
+    response = auth_client(make_user()).post(
+        '/api/recipes/', recipe_data(tags, ingredients, image),
+        format='json',
+    )
+    assert response.status_code == 201, response.data
+    recipe = Recipe.objects.get(pk=response.data['id'])
+    assert default_storage.open(recipe.image.name).read() == png()
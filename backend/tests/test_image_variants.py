@@ -0,0 +1,138 @@
+"""
+Копии изображений рецептов: generate_variants создает варианты
+RECIPE_IMAGE_VARIANTS во всех доступных форматах, сериализатор
+отдает совместимый формат в image и все форматы в image_sources
+"""
+from io import BytesIO
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+from recipes import images
+from recipes.images import generate_variants
+from recipes.models import Recipe
+
+
+def png(size=(600, 400), mode='RGB'):
+    buffer = BytesIO()
+    Image.new(mode, size, 'red').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def recipe_with_image(make_recipe):
+    def make(content):
+        name = default_storage.save(
+            'recipe_images/source.png', ContentFile(content)
+        )
+        return make_recipe(image=name)
+    return make
+
+
+def image_size(name):
+    with default_storage.open(name) as file, Image.open(file) as image:
+        return image.size
+
+
+@pytest.mark.django_db
+def test_generate_variants(recipe_with_image, settings):
+    recipe = recipe_with_image(png())
+    generate_variants(recipe.pk)
+    variants = Recipe.objects.get(pk=recipe.pk).image_variants
+    assert variants['source'] == recipe.image.name
+    expected_formats = {'webp', 'jpeg'} | (
+        {'avif'} if images.features.check('avif') else set()
+    )
+    for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+        assert set(variants[variant]) == expected_formats
+        width, height = image_size(variants[variant]['jpeg'])
+        assert width <= size[0] and height <= size[1]
+        assert width / height == pytest.approx(1.5, rel=0.02)
+
+
+@pytest.mark.django_db
+def test_transparent_image_keeps_png(recipe_with_image):
+    recipe = recipe_with_image(png(mode='RGBA'))
+    generate_variants(recipe.pk)
+    variants = Recipe.objects.get(pk=recipe.pk).image_variants
+    assert 'png' in variants['card'] and 'jpeg' not in variants['card']
+
+
+@pytest.mark.django_db
+def test_format_not_encoded(recipe_with_image, monkeypatch):
+    """
+    формат, который Pillow не смог закодировать, пропускается,
+    копии остаются в остальных форматах
+    """
+    encode = images.encode
+
+    def failing_encode(image, image_format):
+        if image_format == 'WEBP':
+            raise OSError('encoder webp not available')
+        return encode(image, image_format)
+
+    monkeypatch.setattr(images, 'encode', failing_encode)
+    monkeypatch.setattr(images.features, 'check', lambda feature: False)
+    recipe = recipe_with_image(png())
+    generate_variants(recipe.pk)
+    variants = Recipe.objects.get(pk=recipe.pk).image_variants
+    assert {variant: set(sources) for variant, sources in variants.items()
+            if variant != 'source'} == {
+        'thumbnail': {'jpeg'}, 'card': {'jpeg'}, 'full': {'jpeg'},
+    }
+
+
+@pytest.mark.django_db
+def test_serializer_variants(recipe_with_image, client,
+                             django_capture_on_commit_callbacks):
+    recipe = recipe_with_image(png())
+    response = client.get(f'/api/recipes/{recipe.pk}/')
+    # копии еще не созданы - оригинал
+    assert response.data['image'].endswith(recipe.image.url)
+    assert response.data['image_sources'] == {}
+    # смена версии после фиксации сбрасывает кэш ответов
+    with django_capture_on_commit_callbacks(execute=True):
+        generate_variants(recipe.pk)
+    variants = Recipe.objects.get(pk=recipe.pk).image_variants
+    response = client.get('/api/recipes/', {'limit': 6})
+    card = response.data['results'][0]
+    assert card['image'].endswith(
+        default_storage.url(variants['card']['jpeg'])
+    )
+    assert {
+        image_format: url.rsplit('/', 1)[-1]
+        for image_format, url in card['image_sources'].items()
+    } == {
+        image_format: name.rsplit('/', 1)[-1]
+        for image_format, name in variants['card'].items()
+    }
+    response = client.get(f'/api/recipes/{recipe.pk}/')
+    assert response.data['image'].endswith(
+        default_storage.url(variants['full']['jpeg'])
+    )
+    assert set(response.data['image_sources']) == set(variants['full'])
+
+
+@pytest.mark.django_db
+def test_serializer_without_compatible_format(recipe_with_image, client,
+                                              monkeypatch):
+    """
+    совместимый формат не создан: image - оригинал,
+    созданные форматы остаются в image_sources
+    """
+    encode = images.encode
+
+    def failing_encode(image, image_format):
+        if image_format == 'JPEG':
+            raise OSError('encoder jpeg not available')
+        return encode(image, image_format)
+
+    monkeypatch.setattr(images, 'encode', failing_encode)
+    recipe = recipe_with_image(png())
+    generate_variants(recipe.pk)
+    response = client.get(f'/api/recipes/{recipe.pk}/')
+    assert response.data['image'].endswith(recipe.image.url)
+    assert 'webp' in response.data['image_sources']
+    assert 'jpeg' not in response.data['image_sources']
@@ -0,0 +1,116 @@
+import json
+
+import pytest
+from django.core.management import CommandError, call_command
+
+from recipes.management.commands import import_ingrediens
+from recipes.models import Ingredient
+
+
+@pytest.fixture
+def write_json(tmp_path):
+    def write(records):
+        path = tmp_path / 'ingredients.json'
+        path.write_text(json.dumps(records, ensure_ascii=False))
+        return str(path)
+    return write
+
+
+@pytest.mark.django_db
+def test_non_object_record(write_json):
+    path = write_json([{'name': 'соль', 'measurement_unit': 'г'}, 'сахар'])
+    with pytest.raises(CommandError, match='Запись 2'):
+        call_command('import_ingrediens', path)
+
+
+@pytest.mark.django_db
+def test_invalid_records_skipped(write_json, capsys):
+    path = write_json([
+        {'name': 'соль', 'measurement_unit': 'г'},
+        {'name': 12345, 'measurement_unit': 'г'},
+        {'name': 'мука', 'measurement_unit': None},
+        {'name': 'ab', 'measurement_unit': 'г'},
+        {'name': 'x' * 151, 'measurement_unit': 'г'},
+    ])
+    call_command('import_ingrediens', path)
+    assert list(Ingredient.objects.values_list('name', flat=True)) == [
+        'соль'
+    ]
+    assert 'пропущено некорректных: 4' in capsys.readouterr().out
+
+
+@pytest.mark.django_db
+def test_reimport_matches_unnormalized_rows(write_json):
+    """
+    ингредиент из админки с лишними пробелами
+    не дублируется повторным импортом
+    """
+    Ingredient.objects.create(name='соль  морская ', measurement_unit='г ')
+    path = write_json([
+        {'name': ' соль морская', 'measurement_unit': 'г'},
+        {'name': 'соль   морская', 'measurement_unit': 'г'},
+        {'name': 'перец', 'measurement_unit': 'г'},
+    ])
+    call_command('import_ingrediens', path)
+    call_command('import_ingrediens', path)
+    assert Ingredient.objects.count() == 2
+
+
+@pytest.fixture
+def write_text(tmp_path):
+    def write(text):
+        path = tmp_path / 'ingredients.json'
+        path.write_text(text)
+        return str(path)
+    return write
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('text', (
+    '',
+    ',,[[',
+    '{"name": "соль", "measurement_unit": "г"}',
+    '[{"name": "соль", "measurement_unit": "г"},]',
+    '[,{"name": "соль", "measurement_unit": "г"}]',
+    '[{"name": "соль", "measurement_unit": "г"},,'
+    '{"name": "перец", "measurement_unit": "г"}]',
+    '[{"name": "соль", "measurement_unit": "г"}'
+    '{"name": "перец", "measurement_unit": "г"}]',
+    '[{"name": "соль", "measurement_unit": "г"}',
+    '[{"name": "соль", "measurement_unit": "г"}] []',
+))
+def test_malformed_json(text, write_text):
+    with pytest.raises(CommandError, match='Некорректный JSON'):
+        call_command('import_ingrediens', write_text(text))
+    assert not Ingredient.objects.exists()
+
+
+@pytest.mark.django_db
+def test_json_read_in_small_chunks(write_json, monkeypatch):
+    """
+    записи и числа на границах кусков файла
+    """
+    monkeypatch.setattr(import_ingrediens, 'READ_CHUNK_SIZE', 3)
+    records = [
+        {'name': f'ингредиент {number}', 'measurement_unit': 'г',
+         'id': 10 ** number}
+        for number in range(1, 8)
+    ]
+    call_command('import_ingrediens', write_json(records))
+    assert Ingredient.objects.count() == 7
+    call_command('import_ingrediens', write_json([]))
+    assert Ingredient.objects.count() == 7
+
+
+@pytest.mark.django_db
+def test_duplicates_reported(write_json, capsys):
+    Ingredient.objects.create(name='соль', measurement_unit='г')
+    path = write_json([
+        {'name': 'соль', 'measurement_unit': 'г'},
+        {'name': 'перец', 'measurement_unit': 'г'},
+        {'name': ' перец ', 'measurement_unit': 'г'},
+    ])
+    call_command('import_ingrediens', path, '--batch-size', 2)
+    out = capsys.readouterr().out
+    assert 'Новых: 1, уже были или повторяются в файле: 2' in out
+    assert Ingredient.objects.count() == 2
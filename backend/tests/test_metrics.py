@@ -0,0 +1,53 @@
+"""
+Метрики: снимок каждого воркера под своим ключом слота,
+/metrics/ суммирует живые слоты, Server-Timing только при
+settings.SERVER_TIMING
+"""
+import pytest
+from django.core.cache import cache
+
+from foodgram import metrics as metrics_module
+from foodgram.metrics import (Metrics, RequestTimings, render_metrics,
+                              slot_key)
+
+KEY = ('TagViewSet.list', 'GET', 200)
+
+
+def worker(monkeypatch, pid):
+    monkeypatch.setattr(metrics_module.os, 'getpid', lambda: pid)
+    worker_metrics = Metrics()
+    worker_metrics.observe(KEY, 0.02, RequestTimings())
+    worker_metrics.flush(force=True)
+    return worker_metrics
+
+
+def test_workers_flush_own_slots(monkeypatch):
+    first = worker(monkeypatch, 1)
+    second = worker(monkeypatch, 2)
+    assert (first.slot, second.slot) == (0, 1)
+    second.observe(KEY, 0.02, RequestTimings())
+    text = render_metrics(second.collect())
+    assert (
+        'foodgram_request_duration_seconds_count{endpoint="TagViewSet.list",'
+        'method="GET",status="200"} 3'
+    ) in text
+
+
+def test_taken_slot_claims_another(monkeypatch):
+    first = worker(monkeypatch, 1)
+    # слот устарел и занят другим воркером
+    cache.delete(slot_key(first.slot))
+    second = worker(monkeypatch, 2)
+    assert second.slot == 0
+    monkeypatch.setattr(metrics_module.os, 'getpid', lambda: 1)
+    first.flush(force=True)
+    assert first.slot == 1
+    assert cache.get(slot_key(0))['worker'].endswith(':2')
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('enabled', (False, True))
+def test_server_timing(enabled, client, settings):
+    settings.SERVER_TIMING = enabled
+    response = client.get('/api/tags/')
+    assert ('Server-Timing' in response) is enabled
@@ -0,0 +1,214 @@
+from base64 import b64encode
+from datetime import timedelta
+
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.utils import timezone
+
+from api.paginators import CountStrategyPaginator, count_versions
+from recipes.models import Recipe
+
+
+def paginator(queryset, user):
+    return CountStrategyPaginator(
+        queryset, 6, versions=count_versions(queryset, user)
+    )
+
+
+@pytest.mark.django_db
+def test_empty_result_set_count(django_assert_num_queries):
+    queryset = Recipe.objects.filter(pk__in=[])
+    with django_assert_num_queries(0):
+        assert paginator(queryset, AnonymousUser()).count == 0
+
+
+@pytest.mark.django_db
+def test_count_cache_versions(
+    make_recipe, make_user, django_assert_num_queries,
+    django_capture_on_commit_callbacks,
+):
+    """
+    избранное не сбрасывает COUNT(*) общих выборок,
+    только выборок самого пользователя; новый рецепт - всех
+    """
+    recipe = make_recipe()
+    user = make_user()
+    anonymous = AnonymousUser()
+    favorites = Recipe.objects.filter(favorite=user)
+    assert paginator(Recipe.objects.all(), anonymous).count == 1
+    assert paginator(favorites, user).count == 0
+    with django_capture_on_commit_callbacks(execute=True):
+        user.favorites.add(recipe)
+    with django_assert_num_queries(0):
+        assert paginator(Recipe.objects.all(), anonymous).count == 1
+    assert paginator(favorites, user).count == 1
+    with django_capture_on_commit_callbacks(execute=True):
+        make_recipe()
+    assert paginator(Recipe.objects.all(), anonymous).count == 2
+
+
+@pytest.fixture
+def tied_recipes(make_user, make_recipe, tags):
+    """
+    рецепты двух авторов, по три рецепта с одинаковым pub_date;
+    у части рецептов первого автора третий тег
+    """
+    authors = [make_user(), make_user()]
+    now = timezone.now()
+    for number in range(12):
+        recipe = make_recipe(author=authors[number % 2])
+        Recipe.objects.filter(pk=recipe.pk).update(
+            pub_date=now - timedelta(minutes=number // 3)
+        )
+        if number % 4 == 0:
+            recipe.tags.add(tags[2])
+    return authors
+
+
+def walk(client, params):
+    """
+    id рецептов по страницам вперед по ссылкам next
+    и обратно по ссылкам previous
+    """
+    response = client.get('/api/recipes/', {'cursor': '', **params})
+    assert response.status_code == 200
+    forward = [[item['id'] for item in response.data['results']]]
+    while response.data['next']:
+        response = client.get(response.data['next'])
+        forward.append([item['id'] for item in response.data['results']])
+    backward = []
+    while response.data['previous']:
+        response = client.get(response.data['previous'])
+        backward.append([item['id'] for item in response.data['results']])
+    return forward, backward
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('filters', ('author', 'tags', 'both', 'none'))
+def test_cursor_pages_with_filters(filters, tied_recipes, tags, client):
+    author = tied_recipes[0]
+    params, queryset = {'limit': 2}, Recipe.objects.all()
+    if filters in ('author', 'both'):
+        params['author'] = author.pk
+        queryset = queryset.filter(author=author)
+    if filters in ('tags', 'both'):
+        params['tags'] = tags[2].slug
+        queryset = queryset.filter(tags=tags[2])
+    expected = list(
+        queryset.order_by('-pub_date', '-id').values_list('pk', flat=True)
+    )
+    forward, backward = walk(client, params)
+    ids = [pk for page in forward for pk in page]
+    # порядок (-pub_date, -id) без повторов и пропусков
+    # при одинаковых pub_date на границах страниц
+    assert ids == expected
+    assert all(len(page) == 2 for page in forward[:-1])
+    assert backward == forward[-2::-1]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('cursor', (
+    'abc',
+    '!!!',
+    b64encode(b'0|not a date|1').decode(),
+    b64encode(b'0|2024-01-01T00:00:00+00:00').decode(),
+    b64encode(b'0|2024-01-01T00:00:00+00:00|x').decode(),
+))
+def test_invalid_cursor(cursor, client):
+    response = client.get('/api/recipes/', {'cursor': cursor})
+    assert response.status_code == 404
+    assert response.data['detail'] == 'Некорректный cursor'
+
+
+@pytest.fixture
+def estimates(monkeypatch):
+    """
+    оценка планировщика подменена: estimates.value - оценка
+    (None - как не на PostgreSQL), estimates.calls - число оценок
+    """
+    class Estimates:
+        value = None
+        calls = 0
+
+        def __call__(self, queryset, sql, params):
+            self.calls += 1
+            return self.value
+
+    estimated = Estimates()
+    monkeypatch.setattr(
+        CountStrategyPaginator, 'estimated_count', staticmethod(estimated)
+    )
+    return estimated
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('estimate, count, exact', (
+    (None, 2, True),
+    (100, 2, True),
+    (1000, 2, True),
+    (1001, 1001, False),
+))
+def test_count_estimate_threshold(estimate, count, exact, estimates,
+                                  make_recipe, settings):
+    """
+    оценка выше COUNT_ESTIMATE_THRESHOLD возвращается вместо
+    COUNT(*), иначе считается точное количество
+    """
+    settings.COUNT_ESTIMATE_THRESHOLD = 1000
+    make_recipe()
+    make_recipe()
+    estimates.value = estimate
+    counted = paginator(Recipe.objects.all(), AnonymousUser())
+    assert (counted.count, counted.count_exact) == (count, exact)
+    assert estimates.calls == 1
+
+
+@pytest.mark.django_db
+def test_count_estimate_cached(estimates, make_recipe, make_user, settings,
+                               django_assert_num_queries,
+                               django_capture_on_commit_callbacks):
+    """
+    оценка и COUNT(*) кэшируются до смены версий count_versions:
+    новый рецепт сбрасывает все выборки рецептов, избранное -
+    только выборки пользователя
+    """
+    settings.COUNT_ESTIMATE_THRESHOLD = 1000
+    make_recipe()
+    user = make_user()
+    estimates.value = 5000
+    anonymous = AnonymousUser()
+    favorites = Recipe.objects.filter(favorite=user)
+
+    def counted(queryset, user):
+        counting = paginator(queryset, user)
+        return counting.count, counting.count_exact
+
+    assert counted(Recipe.objects.all(), anonymous) == (5000, False)
+    assert counted(favorites, user) == (5000, False)
+    assert estimates.calls == 2
+    estimates.value = 10
+    with django_assert_num_queries(0):
+        assert counted(Recipe.objects.all(), anonymous) == (5000, False)
+        assert counted(favorites, user) == (5000, False)
+    assert estimates.calls == 2
+    with django_capture_on_commit_callbacks(execute=True):
+        user.favorites.add(Recipe.objects.get())
+    assert counted(Recipe.objects.all(), anonymous) == (5000, False)
+    assert counted(favorites, user) == (1, True)
+    assert estimates.calls == 3
+    with django_capture_on_commit_callbacks(execute=True):
+        make_recipe()
+    assert counted(Recipe.objects.all(), anonymous) == (2, True)
+    assert estimates.calls == 4
+
+
+@pytest.mark.django_db
+def test_count_exact_in_response(estimates, make_recipe, client, settings):
+    settings.COUNT_ESTIMATE_THRESHOLD = 1000
+    make_recipe()
+    estimates.value = 5000
+    response = client.get('/api/recipes/', {'limit': 6})
+    assert (response.data['count'], response.data['count_exact']) == (
+        5000, False
+    )
+    assert len(response.data['results']) == 1
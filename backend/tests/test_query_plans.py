@@ -0,0 +1,186 @@
+"""
+Планы запросов основных endpoint-ов: каждый SELECT, выполненный
+при построении страницы, должен читать таблицы по индексам.
+В PostgreSQL последовательное чтение запрещается планировщику
+(enable_seqscan = off), и Seq Scan в плане остается только там,
+где подходящего индекса нет. В SQLite ищется SCAN таблицы
+без USING INDEX
+"""
+import json
+import re
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+import pytest
+
+from api.views import (RECIPE_ORDERINGS, USER_ORDERINGS, RecipeViewSet,
+                       UserViewSet,)
+from recipes.models import FeedEntry, ShoppingCartIngredient
+
+SQLITE_SCAN = re.compile(r'\bSCAN (\w+)\b(?! USING)')
+
+
+@pytest.fixture
+def data(make_user, make_recipe, tags):
+    """
+    пользователь с подписками, избранным и списком покупок
+    """
+    user = make_user()
+    authors = [make_user() for _ in range(3)]
+    recipes = [
+        make_recipe(author=authors[number % 3]) for number in range(9)
+    ]
+    user.subscribe.add(*authors)
+    user.favorites.add(*recipes[:4])
+    ShoppingCartIngredient.objects.add_recipes(
+        user, [recipe.pk for recipe in recipes[2:6]]
+    )
+    FeedEntry.objects.enable_fanout(authors[0].pk)
+    return user, recipes
+
+
+@pytest.fixture
+def index_only(db):
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            # до конца транзакции теста
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return set(seq_scans(plan[0]['Plan']))
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        plan = '\n'.join(row[-1] for row in cursor.fetchall())
+    # подзапросы SQLite указаны псевдонимами (U0),
+    # проверяются только таблицы с известными именами
+    return set(SQLITE_SCAN.findall(plan)) & set(
+        connection.introspection.table_names()
+    )
+
+
+def seq_scans(node):
+    if node['Node Type'] == 'Seq Scan':
+        yield node['Relation Name']
+    for child in node.get('Plans', ()):
+        yield from seq_scans(child)
+
+
+def sorted_by_index(sql):
+    """
+    ORDER BY выполняется чтением индекса, без сортировки строк
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN {sql}')
+            return not any(
+                'Sort' in row[0] and 'Sort Key' not in row[0]
+                for row in cursor.fetchall()
+            )
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return not any(
+            'TEMP B-TREE FOR ORDER BY' in row[-1]
+            for row in cursor.fetchall()
+        )
+
+
+def assert_index_scans(queries):
+    selects = [
+        query['sql'] for query in queries
+        if query['sql'].startswith('SELECT')
+    ]
+    assert selects
+    for sql in selects:
+        assert not explain(sql), sql
+
+
+def view_page(viewset, action, user, params=None, **kwargs):
+    """
+    страница queryset-а, который строит viewset для action,
+    вместе с prefetch_related
+    """
+    request = Request(APIRequestFactory().get('/', params or {}))
+    request.user = user
+    view = viewset(
+        action=action, request=request, kwargs=kwargs, format_kwarg=None
+    )
+    queryset = view.filter_queryset(view.get_queryset())
+    if action == 'subscriptions':
+        queryset = view.get_subscribe_queryset(
+            user.subscribe.order_by('username')
+        )
+    if action != 'retrieve':
+        queryset = queryset[:6]
+    with CaptureQueriesContext(connection) as context:
+        list(queryset)
+    return context.captured_queries
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('params', (
+    {},
+    {'author': 'author'},
+    {'is_favorited': 1},
+    {'is_in_shopping_cart': 1},
+    {'tags': 'tag1'},
+))
+def test_recipe_list_plans(params, data, index_only):
+    user, recipes = data
+    if params.get('author'):
+        params = {'author': recipes[0].author_id}
+    assert_index_scans(view_page(RecipeViewSet, 'list', user, params))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('ordering', RECIPE_ORDERINGS)
+def test_recipe_ordering_plans(ordering, data, index_only):
+    user, _ = data
+    queries = view_page(RecipeViewSet, 'list', user, {'ordering': ordering})
+    assert_index_scans(queries)
+    assert sorted_by_index(queries[0]['sql'])
+
+
+@pytest.mark.django_db
+def test_recipe_detail_plans(data, index_only):
+    user, recipes = data
+    assert_index_scans(
+        view_page(RecipeViewSet, 'retrieve', user, pk=recipes[0].pk)
+    )
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('ordering', USER_ORDERINGS)
+def test_user_ordering_plans(ordering, data, index_only):
+    user, _ = data
+    queries = view_page(UserViewSet, 'list', user, {'ordering': ordering})
+    assert_index_scans(queries)
+    assert sorted_by_index(queries[0]['sql'])
+
+
+@pytest.mark.django_db
+def test_subscriptions_plans(data, index_only):
+    user, _ = data
+    assert_index_scans(view_page(UserViewSet, 'subscriptions', user))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('path', (
+    '/api/recipes/download_shopping_cart/',
+    '/api/recipes/feed/',
+))
+def test_action_plans(path, data, index_only, auth_client):
+    user, _ = data
+    client = auth_client(user)
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(path)
+        b''.join(getattr(response, 'streaming_content', ()))
+    assert response.status_code == 200
+    assert_index_scans(context.captured_queries)
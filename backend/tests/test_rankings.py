@@ -0,0 +1,81 @@
+"""
+Рейтинги RecipeRanking: удаление из избранного вычитает вклад
+добавления, рейтинг не отрицательный, затухшие строки удаляются
+"""
+from datetime import timedelta
+
+import pytest
+from django.conf import settings
+from django.utils import timezone
+
+from recipes.models import (Favorite, RankingState, RecipeEvent,
+                            RecipeRanking)
+
+PERIODS = tuple(settings.RECIPE_RANKING_PERIODS)
+
+
+def scores(recipe):
+    return dict(
+        RecipeRanking.objects.filter(recipe=recipe).values_list(
+            'period', 'score'
+        )
+    )
+
+
+def refresh():
+    RecipeRanking.objects.refresh(1000)
+    RecipeRanking.objects.prune()
+
+
+@pytest.mark.django_db
+def test_removal_weighted_by_add_time(make_user, make_recipe):
+    recipe = make_recipe()
+    early, late = make_user(), make_user()
+    early.favorites.add(recipe)
+    added = timezone.now() - timedelta(days=1)
+    Favorite.objects.filter(user=early).update(created=added)
+    RecipeEvent.objects.update(created=added)
+    late.favorites.add(recipe)
+    early.favorites.remove(recipe)
+    assert RecipeEvent.objects.get(delta=-1).created == added
+    refresh()
+    # остается вклад только второго добавления
+    assert scores(recipe) == pytest.approx(
+        {period: settings.RECIPE_RANKING_WEIGHTS['favorite']
+         for period in PERIODS},
+        rel=1e-6,
+    )
+
+
+@pytest.mark.django_db
+def test_score_not_negative(make_user, make_recipe):
+    recipe, other = make_recipe(), make_recipe()
+    user = make_user()
+    user.favorites.add(other)
+    # связь без события добавления, как до появления рейтингов
+    Favorite.objects.create(user=user, recipe=recipe)
+    refresh()
+    user.favorites.remove(recipe, other)
+    refresh()
+    assert RecipeRanking.objects.filter(score__lt=0).count() == 0
+    assert scores(recipe) == scores(other) == {}
+
+
+@pytest.mark.django_db
+def test_faded_recipes_leave_trending(make_user, make_recipe, client):
+    recipe = make_recipe()
+    make_user().favorites.add(recipe)
+    refresh()
+    assert set(scores(recipe)) == set(PERIODS)
+    # прошло трое суток без событий
+    RankingState.objects.update(
+        epoch=timezone.now() - timedelta(days=3)
+    )
+    refresh()
+    assert set(scores(recipe)) == set(PERIODS) - {'day'}
+    url = '/api/recipes/trending/'
+    response = client.get(url, {'window': 'day', 'limit': 6})
+    assert response.status_code == 200
+    assert response.data['results'] == []
+    response = client.get(url, {'window': 'week', 'limit': 6})
+    assert [item['id'] for item in response.data['results']] == [recipe.pk]
@@ -0,0 +1,62 @@
+from hashlib import md5
+from types import SimpleNamespace
+
+import pytest
+from django.core.cache import cache
+
+from foodgram.db.router import pin_key
+from recipes.models import Recipe
+from recipes.versions import RECIPE_CONTENT, bump_version
+
+
+def response_key(path, host='testserver'):
+    return 'recipe_response:' + md5(f'json:{host}:{path}'.encode()).hexdigest()
+
+
+@pytest.fixture
+def stale_recipe(make_recipe, client, settings):
+    """
+    рецепт в общем кэше, затем изменен, а его запись
+    вычисляет другой запрос (блокировка занята)
+    """
+    settings.RECIPE_CACHE_LOCK_TIMEOUT = 0.2
+    recipe = make_recipe()
+    path = f'/api/recipes/{recipe.pk}/'
+    assert client.get(path).status_code == 200
+    Recipe.objects.filter(pk=recipe.pk).update(name='recipe changed')
+    bump_version(RECIPE_CONTENT)
+    cache.add(f'{response_key(path)}:lock', 1, 60)
+    return path
+
+
+@pytest.mark.django_db
+def test_stale_entry_for_unpinned_client(stale_recipe, client):
+    assert client.get(stale_recipe).data['name'] != 'recipe changed'
+
+
+@pytest.mark.django_db
+def test_no_stale_entry_for_pinned_client(
+    stale_recipe, make_user, auth_client
+):
+    """
+    клиент после записи не получает запись прежней версии
+    """
+    client = auth_client(make_user())
+    cache.set(pin_key(SimpleNamespace(
+        META={'HTTP_AUTHORIZATION': client._credentials['HTTP_AUTHORIZATION']}
+    )), 1)
+    assert client.get(stale_recipe).data['name'] == 'recipe changed'
+
+
+@pytest.mark.django_db
+def test_cache_key_includes_host(
+    make_recipe, client, django_assert_num_queries
+):
+    path = f'/api/recipes/{make_recipe().pk}/'
+    client.get(path)
+    with django_assert_num_queries(0):
+        client.get(path)
+    assert cache.get(response_key(path)) is not None
+    assert cache.get(response_key(path, 'localhost')) is None
+    client.get(path, HTTP_HOST='localhost')
+    assert cache.get(response_key(path, 'localhost')) is not None
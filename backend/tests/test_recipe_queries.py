@@ -0,0 +1,177 @@
+from base64 import b64encode
+from io import BytesIO
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+
+from recipes.models import Ingredient, IngredientAmount
+
+# количество запросов не зависит от количества рецептов:
+# COUNT(*) (в PostgreSQL перед ним оценка планировщика EXPLAIN),
+# рецепты с автором и флагами, теги, ингредиенты
+LIST_QUERIES = 4 + (connection.vendor == 'postgresql')
+# рецепт с автором и флагами, теги, ингредиенты
+DETAIL_QUERIES = 3
+# токен и пользователь при аутентификации
+AUTH_QUERIES = 1
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('recipes_count', (1, 6))
+def test_recipe_list_queries(
+    recipes_count, make_recipe, make_user, auth_client,
+    django_assert_num_queries,
+):
+    for _ in range(recipes_count):
+        make_recipe()
+    client = auth_client(make_user())
+    with django_assert_num_queries(LIST_QUERIES + AUTH_QUERIES):
+        response = client.get('/api/recipes/?limit=6')
+    assert response.status_code == 200
+    assert len(response.data['results']) == recipes_count
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('recipes_count', (1, 6))
+def test_anonymous_recipe_list_queries(
+    recipes_count, make_recipe, client, django_assert_num_queries
+):
+    for _ in range(recipes_count):
+        make_recipe()
+    with django_assert_num_queries(LIST_QUERIES):
+        response = client.get('/api/recipes/?limit=6')
+    assert response.status_code == 200
+    assert len(response.data['results']) == recipes_count
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('ingredients_count', (1, 5))
+def test_recipe_detail_queries(
+    ingredients_count, make_recipe, make_user, ingredients, auth_client,
+    django_assert_num_queries,
+):
+    recipe = make_recipe(amounts={
+        ingredient: 10 for ingredient in ingredients[:ingredients_count]
+    })
+    user = make_user()
+    user.favorites.add(recipe)
+    user.subscribe.add(recipe.author)
+    client = auth_client(user)
+    with django_assert_num_queries(DETAIL_QUERIES + AUTH_QUERIES):
+        response = client.get(f'/api/recipes/{recipe.pk}/')
+    assert response.status_code == 200
+    assert len(response.data['ingredients']) == ingredients_count
+    assert response.data['is_favorited'] is True
+    assert response.data['author']['is_subscribed'] is True
+
+
+def png_base64():
+    buffer = BytesIO()
+    Image.new('RGB', (4, 4), 'red').save(buffer, 'PNG')
+    return 'data:image/png;base64,' + b64encode(buffer.getvalue()).decode()
+
+
+@pytest.fixture
+def many_ingredients(db):
+    return Ingredient.objects.bulk_create(
+        Ingredient(name=f'продукт {number}', measurement_unit='г')
+        for number in range(40)
+    )
+
+
+def recipe_data(tags, amounts, **fields):
+    return {
+        'name': 'много ингредиентов',
+        'text': 'text',
+        'cooking_time': 10,
+        'tags': [tags[0].pk],
+        'ingredients': [
+            {'id': ingredient.pk, 'amount': amount}
+            for ingredient, amount in amounts.items()
+        ],
+        **fields,
+    }
+
+
+def count_queries(send):
+    with CaptureQueriesContext(connection) as context:
+        response = send()
+    assert response.status_code in (200, 201), response.data
+    return response, context.captured_queries
+
+
+@pytest.mark.django_db
+def test_recipe_create_queries(make_user, tags, many_ingredients,
+                               auth_client):
+    """
+    создание рецепта с 1 и 30 ингредиентами - одинаковое
+    количество запросов: ингредиенты одним in_bulk и одним INSERT
+    """
+    client = auth_client(make_user())
+    counts = []
+    for name, count in (('рецепт один', 1), ('рецепт два', 30)):
+        _, queries = count_queries(lambda: client.post(
+            '/api/recipes/',
+            recipe_data(
+                tags,
+                {ingredient: 10 for ingredient in many_ingredients[:count]},
+                name=name,
+                image=png_base64(),
+            ),
+            format='json',
+        ))
+        counts.append(len(queries))
+    assert counts[0] == counts[1]
+
+
+@pytest.mark.django_db
+def test_recipe_update_diff_queries(make_user, tags, many_ingredients,
+                                    make_recipe, auth_client):
+    """
+    изменение рецепта с 30 ингредиентами: неизменные строки
+    IngredientAmount не трогаются, количество запросов
+    не зависит от количества изменений
+    """
+    author = make_user()
+    client = auth_client(author)
+    counts = []
+    for changes in (1, 5):
+        initial = {ingredient: 10 for ingredient in many_ingredients[:30]}
+        recipe = make_recipe(author=author, amounts=initial)
+        rows = dict(IngredientAmount.objects.filter(
+            recipe=recipe
+        ).values_list('ingredients_id', 'pk'))
+        amounts = dict(initial)
+        for ingredient in many_ingredients[:changes]:
+            del amounts[ingredient]
+        for ingredient in many_ingredients[changes:changes * 2]:
+            amounts[ingredient] = 20
+        for ingredient in many_ingredients[30:30 + changes]:
+            amounts[ingredient] = 5
+        _, queries = count_queries(lambda: client.patch(
+            f'/api/recipes/{recipe.pk}/',
+            recipe_data(tags, amounts, name=recipe.name),
+            format='json',
+        ))
+        counts.append(len(queries))
+        after = {
+            ingredients_id: (pk, amount)
+            for ingredients_id, pk, amount in IngredientAmount.objects.filter(
+                recipe=recipe
+            ).values_list('ingredients_id', 'pk', 'amount')
+        }
+        assert {pk: amount for pk, (_, amount) in after.items()} == {
+            ingredient.pk: amount for ingredient, amount in amounts.items()
+        }
+        # неизменные и измененные строки сохраняют pk
+        for ingredient in many_ingredients[changes:30]:
+            assert after[ingredient.pk][0] == rows[ingredient.pk]
+        updates = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('UPDATE "recipes_ingredientamount"')
+        ]
+        assert len(updates) == 1
+        assert updates[0].count(' WHEN ') == changes
+    assert counts[0] == counts[1]
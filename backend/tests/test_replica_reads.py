@@ -0,0 +1,85 @@
+"""
+Чтение с реплики (foodgram.db.router): реплика - отдельное
+соединение replica_0 к тестовой базе данных, не MIRROR. Данные теста
+не зафиксированы и реплике не видны, как при отставании репликации
+"""
+import time
+
+import pytest
+from django.core.cache.backends import locmem
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+
+REPLICA = 'replica_0'
+
+pytestmark = pytest.mark.skipif(
+    connection.vendor != 'postgresql',
+    reason='отдельное соединение реплики проверяется на PostgreSQL',
+)
+
+
+@pytest.fixture
+def replica(settings, db):
+    connections.settings[REPLICA] = {
+        **connections['default'].settings_dict
+    }
+    settings.REPLICA_DATABASES = [REPLICA]
+    try:
+        yield connections[REPLICA]
+    finally:
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+
+
+def user_url(user):
+    return f'/api/users/{user.pk}/'
+
+
+@pytest.mark.django_db
+def test_read_your_writes(replica, make_user, auth_client, monkeypatch,
+                          settings):
+    user, author = make_user(), make_user()
+    client = auth_client(user)
+    # автор есть только на основной базе данных
+    assert client.get(user_url(author)).status_code == 404
+    response = client.post(
+        '/api/users/subscribe/', {'ids': [author.pk]}, format='json'
+    )
+    assert response.status_code == 200
+    response = client.get(user_url(author))
+    assert response.status_code == 200
+    assert response.data['is_subscribed'] is True
+    expired = time.time() + settings.REPLICA_PIN_TIMEOUT + 1
+    monkeypatch.setattr(locmem.time, 'time', lambda: expired)
+    assert client.get(user_url(author)).status_code == 404
+
+
+@pytest.mark.django_db
+def test_replica_queries(replica, make_user, auth_client):
+    """
+    аутентификация - с основной базы данных, страница пользователей -
+    с реплики; после изменения все чтения с основной
+    """
+    user = make_user()
+    client = auth_client(user)
+    page = 'SELECT "users_user"."id", "users_user"."password"'
+
+    def get():
+        with CaptureQueriesContext(connection) as primary, \
+                CaptureQueriesContext(replica) as replicated:
+            response = client.get('/api/users/', {'limit': 6})
+        assert response.status_code == 200
+        return (
+            [query['sql'] for query in primary.captured_queries],
+            [query['sql'] for query in replicated.captured_queries],
+        )
+
+    primary, replicated = get()
+    assert 'authtoken_token' in primary[0]
+    assert not any(sql.startswith(page) for sql in primary)
+    assert any(sql.startswith(page) for sql in replicated)
+    client.post('/api/users/subscribe/', {'ids': [user.pk]}, format='json')
+    primary, replicated = get()
+    assert replicated == []
+    assert any(sql.startswith(page) for sql in primary)
@@ -0,0 +1,343 @@
+import json
+import random
+import threading
+import time
+from io import StringIO
+
+import pytest
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+
+from recipes.models import IngredientAmount, ShoppingCartIngredient
+
+CART_ADD_QUERIES = 19
+
+
+def actual():
+    return {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount
+        in ShoppingCartIngredient.objects.values_list(
+            'user_id', 'ingredient_id', 'amount'
+        )
+    }
+
+
+def assert_consistent():
+    assert actual() == ShoppingCartIngredient.objects.expected()
+
+
+@pytest.fixture
+def carts(make_user, make_recipe):
+    """
+    два пользователя с общим рецептом в корзине
+    """
+    recipe, other = make_recipe(), make_recipe()
+    users = [make_user(), make_user()]
+    for user in users:
+        ShoppingCartIngredient.objects.add_recipes(
+            user, (recipe.pk, other.pk)
+        )
+    assert_consistent()
+    return recipe, users
+
+
+@pytest.mark.django_db
+def test_amount_rows_saved_and_deleted(carts, ingredients):
+    recipe, _ = carts
+    row = IngredientAmount.objects.filter(recipe=recipe).first()
+    row.amount = 25
+    row.save()
+    assert_consistent()
+    row.ingredients = ingredients[4]
+    row.save()
+    assert_consistent()
+    IngredientAmount.objects.create(
+        recipe=recipe, ingredients=ingredients[3], amount=7
+    )
+    assert_consistent()
+    row.delete()
+    assert_consistent()
+
+
+@pytest.mark.django_db
+def test_cascade_deletes(carts, ingredients):
+    recipe, _ = carts
+    ingredients[0].delete()
+    assert_consistent()
+    recipe.author.delete()
+    assert_consistent()
+    assert ShoppingCartIngredient.objects.exists()
+
+
+@pytest.mark.django_db
+def test_api_recipe_edit_and_delete(carts, tags, ingredients, auth_client):
+    recipe, _ = carts
+    client = auth_client(recipe.author)
+    response = client.patch(
+        f'/api/recipes/{recipe.pk}/',
+        {
+            'tags': [tags[0].pk],
+            'ingredients': [
+                {'id': ingredients[0].pk, 'amount': 30},
+                {'id': ingredients[4].pk, 'amount': 5},
+            ],
+        },
+        format='json',
+    )
+    assert response.status_code == 200
+    assert_consistent()
+    response = client.delete(f'/api/recipes/{recipe.pk}/')
+    assert response.status_code == 204
+    assert_consistent()
+
+
+@pytest.mark.skipif(
+    connection.vendor != 'postgresql',
+    reason='конкурентные транзакции проверяются на PostgreSQL',
+)
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_cart_changes_and_recipe_edits(
+    make_user, make_recipe, tags, ingredients, auth_client
+):
+    """
+    корзины и ингредиенты рецептов меняются из нескольких потоков,
+    итог агрегата совпадает с пересчетом по корзинам
+    """
+    recipes = [make_recipe() for _ in range(3)]
+    users = [make_user() for _ in range(4)]
+    errors = []
+
+    def shopper(user, seed):
+        client = auth_client(user)
+        rnd = random.Random(seed)
+        try:
+            for _ in range(15):
+                recipe = rnd.choice(recipes)
+                method = rnd.choice((client.post, client.delete))
+                method(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connections.close_all()
+
+    def editor(recipe, seed):
+        client = auth_client(recipe.author)
+        rnd = random.Random(seed)
+        try:
+            for _ in range(10):
+                chosen = rnd.sample(ingredients, rnd.randint(1, 4))
+                response = client.patch(
+                    f'/api/recipes/{recipe.pk}/',
+                    {
+                        'tags': [tags[0].pk],
+                        'ingredients': [
+                            {'id': ingredient.pk,
+                             'amount': rnd.randint(1, 50)}
+                            for ingredient in chosen
+                        ],
+                    },
+                    format='json',
+                )
+                assert response.status_code == 200, response.data
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connections.close_all()
+
+    threads = [
+        threading.Thread(target=shopper, args=(user, number))
+        for number, user in enumerate(users)
+    ] + [
+        threading.Thread(target=editor, args=(recipe, number))
+        for number, recipe in enumerate(recipes)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert_consistent()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('recipes_count', (1, 4))
+def test_shopping_cart_queries(
+    recipes_count, make_user, make_recipe, ingredients, auth_client,
+    django_assert_num_queries,
+):
+    """
+    добавление в корзину и выгрузка списка покупок не зависят
+    от количества рецептов в корзине
+    """
+    user = make_user()
+    client = auth_client(user)
+    recipe = make_recipe()
+    # в корзине рецепты с другими ингредиентами: строки агрегата
+    # добавляемого рецепта каждый раз новые
+    others = [
+        make_recipe(amounts={ingredient: 5 for ingredient in ingredients[3:]})
+        for _ in range(recipes_count - 1)
+    ]
+    ShoppingCartIngredient.objects.add_recipes(
+        user, [other.pk for other in others]
+    )
+    # токен, рецепт, блокировки, связь корзины, счетчик и событие
+    # рейтинга, количества ингредиентов, изменение агрегата
+    with django_assert_num_queries(CART_ADD_QUERIES):
+        response = client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+    assert response.status_code == 201
+    # токен, агрегат списка покупок
+    with django_assert_num_queries(2):
+        response = client.get('/api/recipes/download_shopping_cart/')
+        content = b''.join(response.streaming_content)
+    assert content.count(b'\n') >= 3
+
+
+DOWNLOAD_URL = '/api/recipes/download_shopping_cart/'
+
+
+@pytest.fixture
+def cart_user(make_user, make_recipe, ingredients):
+    """
+    в корзине два рецепта с общими ингредиентами: количества
+    суммируются, строки списка упорядочены по названию
+    """
+    user = make_user()
+    first = make_recipe(amounts={ingredients[1]: 10, ingredients[0]: 5})
+    second = make_recipe(amounts={ingredients[0]: 7})
+    ShoppingCartIngredient.objects.add_recipes(user, (first.pk, second.pk))
+    return user
+
+
+def download(client, **params):
+    response = client.get(DOWNLOAD_URL, params)
+    assert response.status_code == 200
+    return response, b''.join(response.streaming_content).decode()
+
+
+@pytest.mark.django_db
+def test_download_txt(cart_user, auth_client):
+    response, content = download(auth_client(cart_user))
+    assert response['Content-Type'] == 'text/plain; charset=utf-8'
+    assert response['Content-Disposition'] == (
+        f'attachment; filename={cart_user.username}_shopping_list.txt'
+    )
+    assert content == (
+        'Список покупок\n'
+        'ингредиент 1: 12 г\n'
+        'ингредиент 2: 10 г\n'
+    )
+
+
+@pytest.mark.django_db
+def test_download_csv(cart_user, auth_client):
+    response, content = download(auth_client(cart_user), file_format='csv')
+    assert response['Content-Type'] == 'text/csv; charset=utf-8'
+    assert content.splitlines() == [
+        'name,amount,measurement_unit',
+        'ингредиент 1,12,г',
+        'ингредиент 2,10,г',
+    ]
+
+
+@pytest.mark.django_db
+def test_download_json(cart_user, auth_client):
+    response, content = download(auth_client(cart_user), file_format='json')
+    assert response['Content-Type'] == 'application/json; charset=utf-8'
+    assert json.loads(content) == [
+        {'amount': 12, 'name': 'ингредиент 1', 'measurement_unit': 'г'},
+        {'amount': 10, 'name': 'ингредиент 2', 'measurement_unit': 'г'},
+    ]
+
+
+@pytest.mark.django_db
+def test_download_unknown_format(cart_user, auth_client):
+    response = auth_client(cart_user).get(
+        DOWNLOAD_URL, {'file_format': 'xml'}
+    )
+    assert response.status_code == 400
+    assert 'txt, csv, json' in response.data['errors']
+
+
+@pytest.mark.django_db
+def test_download_empty_cart(make_user, make_recipe, auth_client, client):
+    user = make_user()
+    ShoppingCartIngredient.objects.add_recipes(
+        make_user(), (make_recipe().pk,)
+    )
+    assert auth_client(user).get(DOWNLOAD_URL).status_code == 204
+    assert client.get(DOWNLOAD_URL).status_code == 401
+
+
+@pytest.mark.django_db
+def test_rebuild_fixes_only_mismatches(carts, ingredients):
+    _, (user, other) = carts
+    rows = ShoppingCartIngredient.objects.filter(user=user)
+    kept = set(rows.values_list('pk', flat=True))
+    changed = rows.first()
+    rows.filter(pk=changed.pk).update(amount=1)
+    ShoppingCartIngredient.objects.create(
+        user=other, ingredient=ingredients[4], amount=3
+    )
+    ShoppingCartIngredient.objects.filter(user=other).first().delete()
+    with pytest.raises(CommandError):
+        call_command('rebuild_shopping_carts', '--check', stdout=StringIO())
+    call_command('rebuild_shopping_carts', '--batch-size', 1,
+                 stdout=StringIO())
+    assert_consistent()
+    # строки без расхождений не пересоздаются
+    assert set(rows.values_list('pk', flat=True)) == kept
+    call_command('rebuild_shopping_carts', '--check', stdout=StringIO())
+
+
+@pytest.mark.skipif(
+    connection.vendor != 'postgresql',
+    reason='конкурентные транзакции проверяются на PostgreSQL',
+)
+@pytest.mark.django_db(transaction=True)
+def test_rebuild_waits_for_cart_change(make_user, make_recipe):
+    """
+    пересборка во время незафиксированного изменения корзины
+    не затирает его устаревшими итогами
+    """
+    user = make_user()
+    first, second = make_recipe(), make_recipe()
+    ShoppingCartIngredient.objects.add_recipes(user, (first.pk,))
+    # расхождения, которые исправит пересборка, в тех же строках,
+    # что изменяет добавление второго рецепта
+    ShoppingCartIngredient.objects.filter(user=user).update(amount=1)
+    locked, errors = threading.Event(), []
+
+    def shopper():
+        try:
+            with transaction.atomic():
+                ShoppingCartIngredient.objects.add_recipes(
+                    user, (second.pk,)
+                )
+                locked.set()
+                time.sleep(0.5)
+        except Exception as error:
+            errors.append(error)
+        finally:
+            locked.set()
+            connections.close_all()
+
+    def rebuild():
+        try:
+            locked.wait()
+            ShoppingCartIngredient.objects.rebuild([user.pk])
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=shopper), threading.Thread(
+        target=rebuild
+    )]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert_consistent()
@@ -0,0 +1,71 @@
+import pytest
+from django.core.files.base import ContentFile
+
+from recipes.models import Recipe, StoredFile
+from recipes.storage import ContentAddressedStorage
+
+
+def references():
+    return dict(StoredFile.objects.values_list('name', 'references'))
+
+
+@pytest.mark.django_db
+def test_change_groups_names_by_count(django_assert_num_queries):
+    # INSERT новых имен и UPDATE на каждое различное количество
+    with django_assert_num_queries(3):
+        StoredFile.objects.acquire(['a.png', 'b.png', 'c.png', 'a.png'])
+    assert references() == {'a.png': 2, 'b.png': 1, 'c.png': 1}
+    with django_assert_num_queries(1):
+        StoredFile.objects.release(['a.png', 'b.png', 'c.png'])
+    assert references() == {'a.png': 1, 'b.png': 0, 'c.png': 0}
+
+
+@pytest.mark.django_db
+def test_recipe_save_without_image_query(
+    make_recipe, django_assert_num_queries
+):
+    recipe = Recipe.objects.get(pk=make_recipe().pk)
+    before = references()
+    recipe.name = 'recipe renamed'
+    # только UPDATE рецепта, без чтения прежнего изображения
+    with django_assert_num_queries(1):
+        recipe.save()
+    assert references() == before
+
+
+@pytest.mark.django_db
+def test_recipe_image_change_moves_reference(make_recipe):
+    recipe = Recipe.objects.get(pk=make_recipe().pk)
+    old_name = recipe.image.name
+    recipe.image = 'recipe_images/other.png'
+    recipe.save()
+    recipe.save()
+    assert references()[old_name] == 0
+    assert references()['recipe_images/other.png'] == 1
+    deferred = Recipe.objects.only('name').get(pk=recipe.pk)
+    deferred.image = 'recipe_images/third.png'
+    deferred.save()
+    assert references()['recipe_images/other.png'] == 0
+    assert references()['recipe_images/third.png'] == 1
+
+
+def test_concurrent_identical_saves_share_name(tmp_path, monkeypatch):
+    """
+    проверки exists() второй записи выполнены до того, как первая
+    запись создала файл: вторая получает то же имя, а не имя
+    с суффиксом get_available_name
+    """
+    storage = ContentAddressedStorage(location=str(tmp_path))
+    first = storage.save('recipe_images/a.png', ContentFile(b'image'))
+    exists = storage.exists
+    checks = iter(range(3))
+
+    def stale_exists(name):
+        return next(checks, None) is None and exists(name)
+
+    monkeypatch.setattr(storage, 'exists', stale_exists)
+    second = storage.save('recipe_images/b.png', ContentFile(b'image'))
+    assert first == second
+    files = [path for path in tmp_path.rglob('*') if path.is_file()]
+    assert [str(path.relative_to(tmp_path)) for path in files] == [first]
+    assert storage.open(first).read() == b'image'
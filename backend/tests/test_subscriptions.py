@@ -0,0 +1,78 @@
+"""
+Подписки /api/users/subscriptions/: количество запросов не зависит
+от количества авторов и рецептов, recipes_limit ограничен настройками
+"""
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from recipes.models import Recipe
+
+URL = '/api/users/subscriptions/'
+
+
+@pytest.fixture
+def subscriber(make_user, make_recipe):
+    """
+    подписчик и авторы с пятью рецептами, рецепты автора
+    опубликованы в разное время
+    """
+    def make(authors):
+        user = make_user()
+        now = timezone.now()
+        for _ in range(authors):
+            author = make_user()
+            for number in range(5):
+                recipe = make_recipe(author=author)
+                Recipe.objects.filter(pk=recipe.pk).update(
+                    pub_date=now - timedelta(minutes=number)
+                )
+            user.subscribe.add(author)
+        return user
+    return make
+
+
+def short_recipes(response):
+    return [len(author['recipes']) for author in response.data['results']]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('authors', (1, 4))
+def test_subscriptions_queries_fixed(authors, subscriber, auth_client,
+                                     django_assert_num_queries):
+    """
+    токен, страница авторов, рецепты всех авторов; количество
+    подписок после первого запроса берется из кэша пагинатора
+    """
+    client = auth_client(subscriber(authors))
+    client.get(URL, {'limit': 6})
+    with django_assert_num_queries(3):
+        response = client.get(URL, {'limit': 6})
+    assert response.status_code == 200
+    assert short_recipes(response) == [3] * authors
+
+
+@pytest.mark.django_db
+def test_recipes_limit_latest_first(subscriber, auth_client):
+    user = subscriber(1)
+    response = auth_client(user).get(URL, {'limit': 6, 'recipes_limit': 2})
+    author = user.subscribe.get()
+    assert [recipe['id'] for recipe in response.data['results'][0][
+        'recipes'
+    ]] == list(
+        author.recipes.order_by('-pub_date').values_list('pk', flat=True)[:2]
+    )
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('recipes_limit, expected', (
+    ('', 3), ('abc', 3), ('-1', 0), ('4', 4), ('1000', 4),
+))
+def test_recipes_limit_capped(recipes_limit, expected, subscriber,
+                              auth_client, settings):
+    settings.MAX_RECIPES_LIMIT = 4
+    response = auth_client(subscriber(2)).get(
+        URL, {'limit': 6, 'recipes_limit': recipes_limit}
+    )
+    assert short_recipes(response) == [expected, expected]
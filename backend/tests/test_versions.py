@@ -0,0 +1,22 @@
+from django.core.cache import cache
+
+from recipes.versions import CATALOG, bump_version, get_version
+
+
+def test_versions_survive_culling(settings):
+    """
+    вытеснение ключей общего кэша не сбрасывает версии данных
+    """
+    settings.CACHES = {
+        **settings.CACHES,
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'tests-culling',
+            'OPTIONS': {'MAX_ENTRIES': 10, 'CULL_FREQUENCY': 1},
+        },
+    }
+    bump_version(CATALOG)
+    version = get_version(CATALOG)
+    for number in range(100):
+        cache.set(f'response:{number}', number)
+    assert get_version(CATALOG) == version
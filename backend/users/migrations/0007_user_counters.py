@@ -0,0 +1,27 @@
+# Generated by Django 4.0 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_user_date_joined_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='subscribers_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-subscribers_count', '-date_joined'], name='user_subscribers_count_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0 on 2026-10-18 21:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-recipes_count', '-date_joined'], name='user_recipes_count_idx'),
+        ),
+    ]
@@ -1,13 +1,47 @@
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinLengthValidator, RegexValidator
-from django.db.models import CharField, EmailField, ManyToManyField
+from django.db.models import (CharField, EmailField, Index, IntegerField,
+                              ManyToManyField,)
 
 USER = 'user'
 ADMIN = 'admin'
 
 
-class User(AbstractUser):
+class CounterFieldsMixin:
+    """
+    Денормализованные счетчики COUNTER_FIELDS меняются только
+    update() с F() выражениями. save() существующего объекта их
+    не записывает: полное сохранение объекта, загруженного до
+    изменения счетчика (редактирование рецепта, смена пароля,
+    админ панель), вернуло бы прежнее значение
+    """
+
+    COUNTER_FIELDS = ()
+
+    def save(self, *args, force_insert=False, update_fields=None,
+             **kwargs):
+        if not (self._state.adding or force_insert):
+            if update_fields is None:
+                deferred = self.get_deferred_fields()
+                update_fields = [
+                    field.attname for field in self._meta.concrete_fields
+                    if not field.primary_key
+                    and field.attname not in deferred
+                    and field.name not in self.COUNTER_FIELDS
+                ]
+            else:
+                update_fields = [
+                    name for name in update_fields
+                    if name not in self.COUNTER_FIELDS
+                ]
+        return super().save(
+            *args, force_insert=force_insert, update_fields=update_fields,
+            **kwargs
+        )
+
+
+class User(CounterFieldsMixin, AbstractUser):
     """
     Модель пользователя.
     role - роль пользователя, назначается через админ панель
@@ -73,11 +107,36 @@ class User(AbstractUser):
         symmetrical=False,
         blank=True
     )
+    # счетчики поддерживает recipes.models.CounterDeltaQuerySet
+    subscribers_count = IntegerField(
+        verbose_name='Количество подписчиков',
+        default=0,
+        editable=False,
+    )
+    recipes_count = IntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+        editable=False,
+    )
+
+    COUNTER_FIELDS = ('subscribers_count', 'recipes_count')
 
     class Meta:
         ordering = ['username']
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
+        indexes = (
+            # список пользователей api: ORDER BY date_joined DESC
+            Index(fields=('-date_joined',), name='user_date_joined_idx'),
+            Index(
+                fields=('-subscribers_count', '-date_joined'),
+                name='user_subscribers_count_idx',
+            ),
+            Index(
+                fields=('-recipes_count', '-date_joined'),
+                name='user_recipes_count_idx',
+            ),
+        )
 
     @property
     def is_user(self):